@@ -1,23 +1,92 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Request, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
 import os
+import re
+import sys
 import json
+import gc
+import importlib
+import itertools
 import tempfile
-import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
-from xl_extract import extract_cell_content
-from xl_json_helper import get_cell_content
-from llm_call import analyze_excel_data
-from excel_highlighter import highlight_excel_cells
+from werkzeug.exceptions import RequestEntityTooLarge
+from upload_stream import HashingFileStream, UploadTooLarge, InvalidUpload, validate_ooxml_package
+from file_delivery import temp_path_for, atomic_output, commit_output, discard_output, publish_file, OutputVersions, DELIVERY_MODES
+import search_index
+import sessions
+import single_flight
+import corpus_index
+import table_detect
+import region_preview
+import compact_data
+import bulk_export
+import byte_lru
+import metrics
+import model_router
+import disk_reaper
+import xl_json_helper
+from xlsx_package import worksheet_bytes
 import uuid
 
+# xl_extract/excel_highlighter (openpyxl) and llm_call (requests) are imported inside
+# the routes that use them, so a cold start and routes like /health don't pay for them.
+# Pre-forking servers can load them once up front with warmup().
+HEAVY_MODULES = ('openpyxl', 'requests', 'xl_extract', 'llm_call', 'excel_highlighter')
+
+class UploadRequest(Request):
+    """Request whose uploaded file parts stream straight into a hashed, size-checked temp file"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFileStream(UPLOAD_FOLDER, MAX_UPLOAD_BYTES)
+
 app = Flask(__name__)
-CORS(app)  # Enable CORS for frontend communication
+app.request_class = UploadRequest
+CORS(app, expose_headers=['Server-Timing'])  # Enable CORS for frontend communication
 
 # Configuration
 UPLOAD_FOLDER = 'Excel_files'
 EXTRACT_OUTPUT_FOLDER = 'extract-output'
 ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
+WOPI_PUBLIC_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Frontend', 'server', 'public')
+# direct | link | copy - see file_delivery.DELIVERY_MODES
+WOPI_DELIVERY_MODE = os.getenv('WOPI_DELIVERY_MODE', 'link')
+if WOPI_DELIVERY_MODE not in DELIVERY_MODES:
+    print(f"Warning: Unknown WOPI_DELIVERY_MODE '{WOPI_DELIVERY_MODE}', falling back to 'link'")
+    WOPI_DELIVERY_MODE = 'link'
+
+# Upload limits: the compressed size is enforced while streaming, the rest against
+# the zip central directory before the workbook is parsed
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_MB', '250')) * 1024 * 1024
+MAX_UNCOMPRESSED_BYTES = int(os.getenv('MAX_UNCOMPRESSED_MB', '2048')) * 1024 * 1024
+MAX_COMPRESSION_RATIO = int(os.getenv('MAX_COMPRESSION_RATIO', '250'))
+MAX_ZIP_ENTRIES = int(os.getenv('MAX_ZIP_ENTRIES', '10000'))
+# Workbooks whose worksheet XML exceeds this are extracted in streaming mode: cells go
+# straight to disk and nothing is cached until a request needs it
+STREAMING_EXTRACT_BYTES = int(os.getenv('STREAMING_EXTRACT_MB', '64')) * 1024 * 1024
+# Cached extractions are held as compact_data.CompactSheets (COMPACT_EXTRACTIONS=0 keeps plain dicts)
+COMPACT_EXTRACTIONS = os.getenv('COMPACT_EXTRACTIONS', '1') != '0'
+# Leave room for the multipart envelope around the file itself
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 1024 * 1024
+
+# Disk budgets and TTLs enforced by the background reaper (0 disables a limit);
+# DISK_REAPER_INTERVAL_SECONDS=0 turns the reaper off
+DISK_REAPER_INTERVAL_SECONDS = int(os.getenv('DISK_REAPER_INTERVAL_SECONDS', '300'))
+UPLOAD_BUDGET_MB = int(os.getenv('UPLOAD_BUDGET_MB', '2048'))
+UPLOAD_TTL_HOURS = float(os.getenv('UPLOAD_TTL_HOURS', '168'))
+EXTRACT_BUDGET_MB = int(os.getenv('EXTRACT_BUDGET_MB', '1024'))
+EXTRACT_TTL_HOURS = float(os.getenv('EXTRACT_TTL_HOURS', '72'))
+WOPI_BUDGET_MB = int(os.getenv('WOPI_BUDGET_MB', '1024'))
+WOPI_TTL_HOURS = float(os.getenv('WOPI_TTL_HOURS', '24'))
+# Files no registered upload refers to (e.g. left over from a previous run)
+ORPHAN_TTL_HOURS = float(os.getenv('ORPHAN_TTL_HOURS', '1'))
+# Files that were already there when the server started - such as the recorded corpus
+# load_test.py replays from Excel_files/extract-output - are never reaped, as nothing in
+# this process made them. REAP_PREEXISTING_FILES=1 lets the reaper clean them up too.
+REAP_PREEXISTING_FILES = os.getenv('REAP_PREEXISTING_FILES', '0') == '1'
+STARTED_AT = time.time()
 
 # Ensure directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -32,34 +101,510 @@ file_extracted_data_cache = {}
 # Store the original file ID for each uploaded file
 original_file_ids = {}
 
+# Store mapping of file IDs to their cell search indexes
+file_search_index_cache = {}
+
+# Store mapping of file IDs to their merged-cell member -> merged key maps
+file_merged_map_cache = {}
+
+# Store mapping of file IDs to their style tables and per-cell style IDs
+file_styles_cache = {}
+
+# Store mapping of file IDs to their chart and image metadata
+file_drawings_cache = {}
+
+# Store mapping of file IDs to their detected tables (see table_detect)
+file_tables_cache = {}
+
+# Store mapping of file IDs to the workbook context that opens every /qna prompt about them.
+# A context is the whole workbook serialized, so the cache is bounded in memory
+# (PROMPT_CONTEXT_CACHE_MB, least recently asked about dropped first); a dropped one
+# is rebuilt from the cached extraction.
+PROMPT_CONTEXT_CACHE_MB = float(os.getenv('PROMPT_CONTEXT_CACHE_MB', '64'))
+file_prompt_context_cache = byte_lru.ByteLRU(int(PROMPT_CONTEXT_CACHE_MB * 1024 * 1024))
+
+# Store the latest file ID uploaded under each filename, for incremental re-extraction
+latest_upload_ids = {}
+
+# The disk reaper runs on its own thread. Uploads in use by a request are pinned (see
+# use_upload): the reaper only marks a pinned upload as evicted, and the last request
+# using it drops it from the registries. Adding or dropping an upload and walking a
+# registry happen under registry_lock.
+registry_lock = threading.RLock()
+upload_pins = {}
+evicted_uploads = set()
+
+# Token index over the cell values of every registered upload, for /corpus/search
+corpus = corpus_index.CorpusIndex()
+
+# /qna conversations
+SESSION_TTL_MINUTES = float(os.getenv('SESSION_TTL_MINUTES', '60'))
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', '1000'))
+qna_sessions = sessions.SessionStore(MAX_SESSIONS, SESSION_TTL_MINUTES * 60)
+
+# Identical /qna requests (same file, conversation, question and model) arriving while
+# one of them is being answered wait for it and share its answer instead of calling
+# the LLM again (COALESCE_QNA=0 answers each one separately)
+COALESCE_QNA = os.getenv('COALESCE_QNA', '1') != '0'
+qna_flights = single_flight.SingleFlight()
+
+# Highlighted outputs are numbered per upload ({file_id}_highlighted.v{n}.xlsx) so
+# concurrent highlights never overwrite a file a client was just given; the newest
+# HIGHLIGHT_VERSIONS_KEPT versions stay on disk
+HIGHLIGHT_VERSIONS_KEPT = int(os.getenv('HIGHLIGHT_VERSIONS_KEPT', '3'))
+highlight_versions = OutputVersions(keep=HIGHLIGHT_VERSIONS_KEPT)
+
+# Workbook loads for /qna/highlight, run while the LLM answers
+HIGHLIGHT_PREPARE_WORKERS = int(os.getenv('HIGHLIGHT_PREPARE_WORKERS', '4'))
+highlight_executor = ThreadPoolExecutor(max_workers=HIGHLIGHT_PREPARE_WORKERS, thread_name_prefix='highlight-prepare')
+
+SEARCH_MAX_PAGE_SIZE = 500
+MAX_RANGES_PER_REQUEST = 100
+
+def warmup():
+    """
+    Import every heavy module now instead of on first use.
+    Call in the parent before forking workers (or set API_PRELOAD=1) so the children
+    share the imported modules copy-on-write. Only imports happen here - no threads,
+    sockets or file handles that would be unsafe to inherit across fork().
+    """
+    for module_name in HEAVY_MODULES:
+        importlib.import_module(module_name)
+
+    # Move everything loaded so far out of the GC's tracked generations, so collections
+    # in forked children don't write to (and un-share) these pages
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+def _limit(value, scale):
+    return value * scale if value > 0 else None
+
+# What the API writes to the WOPI folder: highlighted versions (see highlighted_base_name),
+# their chart/image sidecars and the current-version pointer. The Node server's own
+# outputs there ('<name>_highlighted_<timestamp>.xlsx') must not match.
+WOPI_OUTPUT_PATTERN = re.compile(
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_highlighted\.'
+    r'(?:v\d+\.(?:xlsx|charts\.json|images\.json)|current\.json)'
+)
+
+def disk_policies():
+    """Reaper policy per managed directory (read at each pass, so paths can be reconfigured)"""
+    since = None if REAP_PREEXISTING_FILES else STARTED_AT
+    return [
+        disk_reaper.DirectoryPolicy(
+            'uploads', UPLOAD_FOLDER,
+            max_bytes=_limit(UPLOAD_BUDGET_MB, 1024 * 1024),
+            ttl_seconds=_limit(UPLOAD_TTL_HOURS, 3600),
+            orphan_ttl_seconds=_limit(ORPHAN_TTL_HOURS, 3600),
+            since=since
+        ),
+        disk_reaper.DirectoryPolicy(
+            'extractions', EXTRACT_OUTPUT_FOLDER,
+            max_bytes=_limit(EXTRACT_BUDGET_MB, 1024 * 1024),
+            ttl_seconds=_limit(EXTRACT_TTL_HOURS, 3600),
+            orphan_ttl_seconds=_limit(ORPHAN_TTL_HOURS, 3600),
+            since=since
+        ),
+        # The WOPI folder is shared with the Node server; only highlighted outputs (and
+        # their chart/image sidecars) are ours
+        disk_reaper.DirectoryPolicy(
+            'wopi', WOPI_PUBLIC_FOLDER,
+            max_bytes=_limit(WOPI_BUDGET_MB, 1024 * 1024),
+            ttl_seconds=_limit(WOPI_TTL_HOURS, 3600),
+            orphan_ttl_seconds=_limit(ORPHAN_TTL_HOURS, 3600),
+            since=since,
+            manages=lambda filename: WOPI_OUTPUT_PATTERN.fullmatch(filename) is not None
+        ),
+    ]
+
+def file_id_of(path):
+    """Upload ID a managed file belongs to (every derived file is prefixed with it)"""
+    file_id = os.path.basename(path)[:36]
+    return file_id if file_id in file_data_cache else None
+
+def is_referenced(path):
+    return file_id_of(path) is not None
+
+def use_upload(file_id):
+    """
+    Pin a registered upload until the end of the request, so it stays in the registries
+    while the request reads them; returns False if there is no such upload
+    """
+    with registry_lock:
+        if file_id not in file_data_cache or file_id in evicted_uploads:
+            return False
+        if 'pinned_uploads' not in g:
+            g.pinned_uploads = set()
+        if file_id not in g.pinned_uploads:
+            g.pinned_uploads.add(file_id)
+            upload_pins[file_id] = upload_pins.get(file_id, 0) + 1
+    return True
+
+@app.teardown_request
+def release_uploads(exc=None):
+    for file_id in g.pop('pinned_uploads', ()):
+        with registry_lock:
+            upload_pins[file_id] -= 1
+            if upload_pins[file_id]:
+                continue
+            del upload_pins[file_id]
+            evicted = file_id in evicted_uploads
+        if evicted:
+            forget_upload(file_id)
+
+def forget_upload(file_id):
+    """Drop an upload from every registry and remove the files derived from it"""
+    with registry_lock:
+        evicted_uploads.discard(file_id)
+        info = file_data_cache.pop(file_id, None)
+        corpus.remove_file(file_id)
+        qna_sessions.drop_file(file_id)
+        highlight_versions.drop(file_id)
+        for cache in (file_extracted_data_cache, original_file_ids, file_search_index_cache, file_merged_map_cache,
+                      file_styles_cache, file_drawings_cache, file_tables_cache, file_prompt_context_cache):
+            cache.pop(file_id, None)
+        if info is None:
+            return
+        if latest_upload_ids.get(info['filename']) == file_id:
+            del latest_upload_ids[info['filename']]
+
+    derived = []
+    for folder, prefix in ((UPLOAD_FOLDER, f"{file_id}_highlighted"), (WOPI_PUBLIC_FOLDER, f"{file_id}_highlighted"),
+                           (EXTRACT_OUTPUT_FOLDER, f"{file_id}_")):
+        if os.path.isdir(folder):
+            derived += [entry.path for entry in os.scandir(folder) if entry.name.startswith(prefix)]
+    for path in derived:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    print(f"Forgot upload {file_id} ({info['filename']})")
+
+def on_disk_eviction(path, reason):
+    """
+    Keep the registry consistent with the disk: losing an original means the upload is
+    gone. Extractions and highlighted outputs are derived and are rebuilt on demand.
+    """
+    file_id = os.path.basename(path)[:36]
+    with registry_lock:
+        info = file_data_cache.get(file_id)
+        if info is None or os.path.abspath(path) != os.path.abspath(info['file_path']):
+            return
+        print(f"Original of upload {file_id} evicted ({reason})")
+        # No new request can pin it now; one still using it drops it when it ends
+        evicted_uploads.add(file_id)
+        if upload_pins.get(file_id):
+            return
+    forget_upload(file_id)
+
+reaper = disk_reaper.DiskReaper(disk_policies, is_referenced, on_disk_eviction,
+                                interval_seconds=DISK_REAPER_INTERVAL_SECONDS)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def search_cells_by_value(data, search_term):
+@app.before_request
+def start_request_timing():
+    metrics.begin_request(request.endpoint or 'unknown')
+    # Started on first request rather than at import, so it runs in each forked worker
+    reaper.ensure_started()
+
+@app.after_request
+def add_server_timing(response):
+    stages = metrics.end_request(response.status_code)
+    if stages:
+        response.headers['Server-Timing'] = metrics.server_timing_header(stages)
+    return response
+
+def extraction_base_name(file_id):
+    """File name prefix shared by everything extracted from an upload"""
+    return f"{file_id}_{file_data_cache[file_id]['filename'].split('.')[0]}"
+
+def extraction_json_path(file_id):
+    """Path of an upload's extracted cell data on disk"""
+    return os.path.join(EXTRACT_OUTPUT_FOLDER, f"{extraction_base_name(file_id)}_cell_content.json")
+
+def cache_extracted_data(file_id, data):
+    """Keep an upload's extracted data in memory, in compact form unless disabled"""
+    if COMPACT_EXTRACTIONS:
+        with metrics.stage('compact'):
+            data = compact_data.compact_workbook(data)
+    file_extracted_data_cache[file_id] = data
+    return data
+
+def load_extracted_data(file_id):
+    """
+    Return the extracted cell data for an uploaded file, loading it from disk once.
+    If the disk reaper evicted the extraction, it is regenerated from the original -
+    to disk first for uploads that were extracted in streaming mode.
+    """
+    disk_reaper.touch(file_data_cache[file_id]['file_path'])
+    metrics.record_cache('extracted_data', file_id in file_extracted_data_cache)
+    if file_id not in file_extracted_data_cache:
+        json_path = extraction_json_path(file_id)
+        if file_data_cache[file_id].get('streaming') and not os.path.exists(json_path):
+            restore_streamed_extraction(file_id)
+        try:
+            print(f"Loading JSON from: {json_path}")
+            with open(json_path, encoding='utf-8') as f:
+                cache_extracted_data(file_id, json.load(f))
+            disk_reaper.touch(json_path)
+        except FileNotFoundError:
+            print(f"Extraction missing for {file_id}; re-extracting")
+            metrics.inc('extraction_regenerations_total', help_text='Extractions rebuilt after eviction')
+            from xl_extract import extract_cell_content
+            with metrics.stage('extract'):
+                cache_extracted_data(file_id, extract_cell_content(file_data_cache[file_id]['file_path'], EXTRACT_OUTPUT_FOLDER))
+    return file_extracted_data_cache[file_id]
+
+def restore_streamed_extraction(file_id):
+    """
+    Re-extract an evicted extraction of an upload that was extracted in streaming mode,
+    in streaming mode again (straight to disk; it is loaded from there when needed)
+    """
+    print(f"Extraction missing for {file_id}; re-extracting in streaming mode")
+    metrics.inc('extraction_regenerations_total', help_text='Extractions rebuilt after eviction')
+    from xl_extract import extract_cell_content_streaming
+    with metrics.stage('extract'):
+        json_path = extract_cell_content_streaming(file_data_cache[file_id]['file_path'], EXTRACT_OUTPUT_FOLDER)
+    disk_reaper.touch(json_path)
+    return json_path
+
+def load_file_styles(file_id):
+    """Return the style info for an uploaded file, re-extracting it if it was evicted"""
+    metrics.record_cache('styles', file_id in file_styles_cache)
+    if file_id not in file_styles_cache:
+        styles_path = os.path.join(EXTRACT_OUTPUT_FOLDER, f"{extraction_base_name(file_id)}_styles.json")
+        try:
+            with open(styles_path, encoding='utf-8') as f:
+                file_styles_cache[file_id] = json.load(f)
+        except FileNotFoundError:
+            from xl_extract import extract_style_info
+            file_styles_cache[file_id] = extract_style_info(file_data_cache[file_id]['file_path'], EXTRACT_OUTPUT_FOLDER)
+    return file_styles_cache[file_id]
+
+def load_file_drawings(file_id):
+    """Return {'charts', 'images'} metadata for an uploaded file, re-extracting it if it was evicted"""
+    metrics.record_cache('drawings', file_id in file_drawings_cache)
+    if file_id not in file_drawings_cache:
+        base_path = os.path.join(EXTRACT_OUTPUT_FOLDER, extraction_base_name(file_id))
+        try:
+            with open(f"{base_path}_charts.json", encoding='utf-8') as f:
+                charts = json.load(f)
+            with open(f"{base_path}_images.json", encoding='utf-8') as f:
+                images = json.load(f)
+        except FileNotFoundError:
+            from xl_extract import extract_charts, extract_images
+            from xlsx_package import read_sheet_drawings
+            file_path = file_data_cache[file_id]['file_path']
+            drawings = read_sheet_drawings(file_path)
+            charts = extract_charts(file_path, EXTRACT_OUTPUT_FOLDER, drawings)
+            images = extract_images(file_path, EXTRACT_OUTPUT_FOLDER, drawings)
+        file_drawings_cache[file_id] = {'charts': charts, 'images': images}
+    return file_drawings_cache[file_id]
+
+def highlighted_base_name(file_id, version):
+    """Name (without extension) of one highlighted version of an upload"""
+    return f"{file_id}_highlighted.v{version}"
+
+def highlight_pointer_path(file_id):
+    return os.path.join(WOPI_PUBLIC_FOLDER, f"{file_id}_highlighted.current.json")
+
+def publish_drawing_sidecars(base_name, drawings):
+    """
+    Write <base_name>.charts.json / .images.json next to a served workbook,
+    so the Node highlighter uses this file's anchors instead of the global charts.json
+    """
+    for kind in ('charts', 'images'):
+        sidecar_path = os.path.join(WOPI_PUBLIC_FOLDER, f"{base_name}.{kind}.json")
+        with atomic_output(sidecar_path) as tmp_path:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(drawings[kind], f, ensure_ascii=False)
+
+def write_highlight_pointer(file_id, version):
+    """Atomically point {file_id}_highlighted.current.json at a highlighted version"""
+    pointer = {
+        'file_id': file_id,
+        'version': version,
+        'filename': f"{highlighted_base_name(file_id, version)}.xlsx",
+        'published': time.time()
+    }
+    with atomic_output(highlight_pointer_path(file_id)) as tmp_path:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(pointer, f)
+
+def remove_highlighted_version(file_id, version):
+    base_name = highlighted_base_name(file_id, version)
+    paths = [os.path.join(UPLOAD_FOLDER, f"{base_name}.xlsx"), os.path.join(WOPI_PUBLIC_FOLDER, f"{base_name}.xlsx")]
+    paths += [os.path.join(WOPI_PUBLIC_FOLDER, f"{base_name}.{kind}.json") for kind in ('charts', 'images')]
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def publish_highlighted(file_id, original_file_path, drawings, write_output):
+    """
+    Produce a new highlighted version of an upload and publish it to the WOPI directory.
+    write_output(tmp_path) writes it and returns the highlighter's {'success', 'error'};
+    if it writes nothing there was nothing to highlight and the original is served as is.
+
+    Every call writes its own numbered file, so concurrent highlights of the same upload
+    run in parallel and each caller gets back the complete file it asked for. Once
+    published, the version becomes current (unless a newer one finished first) and
+    versions beyond HIGHLIGHT_VERSIONS_KEPT are deleted.
+    Returns (highlighted_filename, error).
+    """
+    version = highlight_versions.reserve(file_id)
+    base_name = highlighted_base_name(file_id, version)
+    highlighted_filename = f"{base_name}.xlsx"
+    highlighted_file_path = os.path.join(UPLOAD_FOLDER, highlighted_filename)
+
+    # Ensure WOPI public directory exists
+    os.makedirs(WOPI_PUBLIC_FOLDER, exist_ok=True)
+    wopi_file_path = os.path.join(WOPI_PUBLIC_FOLDER, highlighted_filename)
+
+    # In direct mode the highlighter writes straight into the served location
+    if WOPI_DELIVERY_MODE == 'direct':
+        highlighted_file_path = wopi_file_path
+
+    print(f"Original file path: {original_file_path}")
+    print(f"Highlighted file path: {highlighted_file_path}")
+
+    # Write to a temporary name and rename into place, so the original is never
+    # touched and readers never see a partial file
+    tmp_path = temp_path_for(highlighted_file_path)
+    try:
+        highlight_result = write_output(tmp_path)
+        if not highlight_result['success']:
+            return None, highlight_result['error']
+
+        if not os.path.exists(tmp_path):
+            # Nothing to highlight; serve an unmodified copy of the original
+            publish_file(original_file_path, tmp_path, mode='copy')
+
+        commit_output(tmp_path, highlighted_file_path)
+    finally:
+        discard_output(tmp_path)
+
+    if highlighted_file_path != wopi_file_path:
+        with metrics.stage('copy'):
+            method = publish_file(highlighted_file_path, wopi_file_path, mode=WOPI_DELIVERY_MODE)
+        print(f"Published highlighted file to WOPI directory via {method}: {wopi_file_path}")
+
+    # Verify the file exists after publishing
+    if not os.path.exists(wopi_file_path):
+        return None, 'Failed to publish highlighted file to WOPI directory'
+    publish_drawing_sidecars(base_name, drawings)
+
+    is_current, stale = highlight_versions.publish(
+        file_id, version, on_current=lambda current: write_highlight_pointer(file_id, current))
+    if not is_current:
+        metrics.inc('highlight_versions_superseded_total', help_text='Highlighted versions finished after a newer one')
+    for stale_version in stale:
+        remove_highlighted_version(file_id, stale_version)
+    return highlighted_filename, None
+
+def build_file_search_index(file_id, data, previous_index=None, refreshed_sheets=()):
+    """
+    Build, persist and cache the search index for an uploaded file. With previous_index
+    (an earlier version of the same workbook) only refreshed_sheets are re-indexed.
+    """
+    if previous_index is not None:
+        index = search_index.update_search_index(previous_index, data, refreshed_sheets)
+    else:
+        index = search_index.build_search_index(data)
+    index_path = os.path.join(EXTRACT_OUTPUT_FOLDER, f"{extraction_base_name(file_id)}_search_index.json")
+    search_index.save_search_index(index, index_path)
+    file_search_index_cache[file_id] = index
+    corpus.add_file(file_id, index)
+    return index
+
+def load_file_search_index(file_id):
+    """Return the search index for an uploaded file, rebuilding it if it is missing or stale"""
+    metrics.record_cache('search_index', file_id in file_search_index_cache)
+    if file_id not in file_search_index_cache:
+        index_path = os.path.join(EXTRACT_OUTPUT_FOLDER, f"{extraction_base_name(file_id)}_search_index.json")
+        index = search_index.load_search_index(index_path) if os.path.exists(index_path) else None
+        if index is None:
+            return build_file_search_index(file_id, load_extracted_data(file_id))
+        file_search_index_cache[file_id] = index
+        if file_id not in corpus:
+            corpus.add_file(file_id, index)
+    return file_search_index_cache[file_id]
+
+def build_file_tables(file_id, data, previous_tables=None, refreshed_sheets=()):
+    """
+    Detect, persist and cache the tables of an uploaded file. With previous_tables
+    (an earlier version of the same workbook) only refreshed_sheets are detected again.
+    """
+    tables = table_detect.detect_tables(data, previous_tables, refreshed_sheets)
+    tables_path = os.path.join(EXTRACT_OUTPUT_FOLDER, f"{extraction_base_name(file_id)}_tables.json")
+    table_detect.save_tables(tables, tables_path)
+    file_tables_cache[file_id] = tables
+    return tables
+
+def load_file_tables(file_id):
+    """Return the detected tables for an uploaded file, detecting them again if missing or stale"""
+    metrics.record_cache('tables', file_id in file_tables_cache)
+    if file_id not in file_tables_cache:
+        tables_path = os.path.join(EXTRACT_OUTPUT_FOLDER, f"{extraction_base_name(file_id)}_tables.json")
+        tables = table_detect.load_tables(tables_path) if os.path.exists(tables_path) else None
+        if tables is None:
+            return build_file_tables(file_id, load_extracted_data(file_id))
+        file_tables_cache[file_id] = tables
+    return file_tables_cache[file_id]
+
+def load_prompt_context(file_id):
+    """
+    Return the workbook context prefix of /qna prompts for an uploaded file. It is built
+    once and reused verbatim, so every prompt about the file starts with the same bytes.
+    """
+    context = file_prompt_context_cache.get(file_id)
+    metrics.record_cache('prompt_context', context is not None)
+    if context is None:
+        from llm_call import build_context_prefix
+        context = build_context_prefix(
+            load_extracted_data(file_id),
+            load_file_styles(file_id),
+            load_file_drawings(file_id),
+            load_file_tables(file_id)
+        )
+        file_prompt_context_cache.put(file_id, context)
+    return context
+
+def load_merged_map(file_id):
+    """Return the precomputed merged-cell coordinate map for an uploaded file"""
+    metrics.record_cache('merged_map', file_id in file_merged_map_cache)
+    if file_id not in file_merged_map_cache:
+        file_merged_map_cache[file_id] = xl_json_helper.build_merged_map(load_extracted_data(file_id))
+    return file_merged_map_cache[file_id]
+
+def search_cells_by_value(data, search_term, index=None):
     """Search for cells containing specific value"""
-    results = []
-    search_term = search_term.lower()
-    
-    for worksheet_name, cells in data.items():
-        for cell_coord, cell_data in cells.items():
-            if search_term in str(cell_data.get('value', '')).lower():
-                results.append({
-                    'worksheet': worksheet_name,
-                    'coordinate': cell_coord,
-                    'value': cell_data.get('value'),
-                    'formula': cell_data.get('formula')
-                })
-    
-    return results
+    if index is None:
+        index = search_index.build_search_index(data)
+
+    found = search_index.search(index, data, search_term, page_size=sys.maxsize)
+    return [
+        {key: result[key] for key in ('worksheet', 'coordinate', 'value', 'formula')}
+        for result in found['results']
+    ]
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """
     Upload Excel file endpoint
-    Accepts: multipart/form-data with 'file' field
+    Accepts: multipart/form-data with 'file' field and optional 'previous_file_id'
     Returns: JSON with file_id for subsequent queries
+    Re-uploading a workbook (same filename, or previous_file_id) only re-extracts and
+    re-indexes the sheets whose content changed; 'extraction' reports which ones.
+    The file is streamed to disk while it arrives (see UploadRequest); oversized
+    uploads get 413 and anything that isn't an .xlsx package 400, before parsing.
     """
+    file = None
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
@@ -77,107 +622,375 @@ def upload_file():
         filename = secure_filename(file.filename)
         file_path = os.path.join(UPLOAD_FOLDER, f"{file_id}_{filename}")
         
-        # Save the uploaded file
-        file.save(file_path)
+        # The upload already sits in a temp file; check the package and move it into place
+        with metrics.stage('save'):
+            size, sha256 = file.stream.finish()
+            validate_ooxml_package(file.stream.path, MAX_UNCOMPRESSED_BYTES,
+                                   MAX_COMPRESSION_RATIO, MAX_ZIP_ENTRIES)
+            commit_output(file.stream.path, file_path)
         
+        # Very large workbooks are streamed to disk rather than held in memory
+        streaming = worksheet_bytes(file_path) > STREAMING_EXTRACT_BYTES
+
+        # Previous version of the same workbook, whose unchanged sheets can be reused
+        # (not when streaming, as reuse needs the previous data in memory)
+        previous_id = request.form.get('previous_file_id') or latest_upload_ids.get(filename)
+        if streaming or not use_upload(previous_id) or 'sheet_hashes' not in file_data_cache[previous_id]:
+            previous_id = None
+
         # Extract cell content
-        extract_cell_content(file_path, EXTRACT_OUTPUT_FOLDER)
+        from xl_extract import extract_incremental
+        with metrics.stage('extract'):
+            if previous_id:
+                extraction = extract_incremental(file_path, EXTRACT_OUTPUT_FOLDER, load_extracted_data(previous_id),
+                                                 file_data_cache[previous_id]['sheet_hashes'])
+            else:
+                extraction = extract_incremental(file_path, EXTRACT_OUTPUT_FOLDER, streaming=streaming)
+        extracted_data = extraction['data']
+        if streaming:
+            metrics.inc('streaming_extractions_total', help_text='Uploads extracted in streaming mode')
+        if extraction['formulas']:
+            for outcome in ('evaluated', 'failed'):
+                metrics.inc('formulas_computed_total', extraction['formulas'][outcome],
+                            help_text='Formulas without a cached result, by whether they could be computed',
+                            outcome=outcome)
         
         # Cache the data for quick access
-        file_data_cache[file_id] = {
-            'filename': filename,
-            'file_path': file_path
-        }
+        with registry_lock:
+            file_data_cache[file_id] = {
+                'filename': filename,
+                'file_path': file_path,
+                'size': size,
+                'sha256': sha256,
+                'sheet_hashes': extraction['sheet_hashes'],
+                'streaming': streaming
+            }
+            use_upload(file_id)
+        file_drawings_cache[file_id] = {'charts': extraction['charts'], 'images': extraction['images']}
+
+        # Build the cell search index and detect tables alongside the extraction; streamed
+        # extractions are loaded (and indexed) on first use instead
+        if not streaming:
+            cache_extracted_data(file_id, extracted_data)
+            file_styles_cache[file_id] = extraction['styles']
+            with metrics.stage('index'):
+                if previous_id:
+                    build_file_search_index(file_id, extracted_data, load_file_search_index(previous_id), extraction['refreshed'])
+                else:
+                    build_file_search_index(file_id, extracted_data)
+            with metrics.stage('tables'):
+                if previous_id:
+                    build_file_tables(file_id, extracted_data, load_file_tables(previous_id), extraction['refreshed'])
+                else:
+                    build_file_tables(file_id, extracted_data)
+
+        if previous_id in file_merged_map_cache:
+            previous_map = file_merged_map_cache[previous_id]
+            file_merged_map_cache[file_id] = {
+                sheet_name: previous_map[sheet_name] if sheet_name in extraction['reused'] and sheet_name in previous_map
+                else xl_json_helper.build_sheet_merged_map(cells)
+                for sheet_name, cells in extracted_data.items() if sheet_name != 'schema'
+            }
         
         # Store this as the original file ID
         original_file_ids[file_id] = file_id
+        with registry_lock:
+            latest_upload_ids[filename] = file_id
         
         print(f"File uploaded successfully. ID: {file_id}, Path: {file_path}")
-        print(f"Current cache: {file_data_cache}")
+        with registry_lock:
+            print(f"Current cache: {file_data_cache}")
         
         return jsonify({
             'success': True,
             'file_id': file_id,
             'filename': filename,
+            'size': size,
+            'sha256': sha256,
+            'extraction': {
+                'mode': 'incremental' if previous_id else ('streaming' if streaming else 'full'),
+                'previous_file_id': previous_id,
+                'refreshed': extraction['refreshed'],
+                'reused': extraction['reused'],
+                'removed': extraction['removed'],
+                'formulas': extraction['formulas']
+            },
             'message': 'File uploaded and processed successfully'
         }), 200
         
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return jsonify({'error': f'File too large. The limit is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB'}), 413
+    except InvalidUpload as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error in upload_file: {str(e)}")
         return jsonify({'error': f'Error processing file: {str(e)}'}), 500
+    finally:
+        # No-op once the temp file has been renamed into place
+        if file is not None and isinstance(file.stream, HashingFileStream):
+            file.stream.discard()
+
+def resolve_question(data):
+    """
+    Validate a /qna-style request body and find its conversation.
+    Returns (file_id, question, session, None), session being None for a new
+    conversation, or (None, None, None, error_response).
+    """
+    if not data:
+        print("No JSON data provided")
+        return None, None, None, (jsonify({'error': 'No JSON data provided'}), 400)
+
+    file_id = data.get('file_id')
+    question = data.get('question', '').strip()
+    session_id = data.get('session_id')
+    print(f"File ID: {file_id}, Session: {session_id}, Question: {question}")
+    with registry_lock:
+        print(f"Current cache: {file_data_cache}")
+
+    session = None
+    if session_id:
+        session = qna_sessions.get(session_id)
+        if session is None:
+            return None, None, None, (jsonify({'error': 'Session not found or expired. Start a new one by omitting session_id.'}), 404)
+        if file_id and file_id != session.file_id:
+            return None, None, None, (jsonify({'error': 'session_id belongs to a different file'}), 400)
+        file_id = session.file_id
+
+    if not file_id or not question:
+        print("Missing file_id or question")
+        return None, None, None, (jsonify({'error': 'file_id and question are required'}), 400)
+
+    # Check if file exists in cache
+    if not use_upload(file_id):
+        print(f"File {file_id} not found in cache")
+        return None, None, None, (jsonify({'error': 'File not found. Please upload the file first.'}), 404)
+
+    model = data.get('model')
+    if model and not model_router.is_known_model(model):
+        return None, None, None, (jsonify({'error': f"Unknown model: {model}. Known models: {', '.join(model_router.MODELS)}"}), 400)
+
+    return file_id, question, session, None
+
+def answer_question(file_id, question, session, model=None):
+    """Ask the LLM within a session; returns llm_call.analyze_in_session's result"""
+    print("Loading extracted data...")
+    # Load the workbook context shared by every prompt about this file
+    with metrics.stage('load'):
+        context_prefix = load_prompt_context(file_id)
+    print("Calling LLM analysis...")
+
+    # Analyze data using LLM
+    from llm_call import analyze_in_session
+    result = analyze_in_session(context_prefix, question, session.history(), session.summary(), model, session.model)
+    print("LLM result:", result)
+
+    if result['success']:
+        session.add_turn(question, result['raw_response'], result['usage'])
+        # An explicit model only applies to its own request
+        if result['routing']['reason'] != 'override':
+            session.pin_model(result['routing']['model'])
+    return result
+
+def coalesced_answer(file_id, question, session, model=None):
+    """
+    answer_question, with identical requests in flight at the same time sharing one
+    LLM call: the first runs it and the duplicates arriving meanwhile wait for its
+    result. A session of None starts a new conversation, which the duplicates join.
+    Returns (result, session, shared).
+    """
+    def lead():
+        leader_session = session or qna_sessions.create(file_id)
+        return answer_question(file_id, question, leader_session, model), leader_session
+
+    if not COALESCE_QNA:
+        return lead() + (False,)
+
+    key = (file_id, session.session_id if session else None, ' '.join(question.split()), model or None)
+    (result, answer_session), shared = qna_flights.do(key, lead)
+    metrics.inc('qna_coalesce_total', help_text='/qna answers by whether they ran the LLM call (leader) '
+                'or shared a concurrent identical request\'s (shared)', role='shared' if shared else 'leader')
+    return result, answer_session, shared
+
+def answer_response(question, session, result, coalesced=False):
+    """JSON body for a successful answer"""
+    response = {
+        'success': True,
+        'question': question,
+        'answer': result['answer'],
+        'session_id': session.session_id,
+        'usage': {**result['usage'], 'session': session.to_dict()['usage']},
+        'routing': result['routing'],
+        'coalesced': coalesced
+    }
+
+    if result['error']:  # Add warning if JSON parsing failed
+        response['warning'] = result['error']
+    return response
 
 @app.route('/qna', methods=['POST'])
 def ask_question():
     """
     Ask question about Excel content endpoint
-    Accepts: JSON with file_id and question
-    Returns: JSON with answer based on question type
+    Accepts: JSON with file_id and question, and optional session_id to continue a
+             conversation (file_id may then be omitted) and model to override routing
+    Returns: JSON with answer based on question type, the session_id for follow-up
+             questions, token usage (this request and the session so far), the
+             model routing decision and whether the answer was shared with an
+             identical request in flight at the same time (coalesced)
     """
     try:
         print("Received QnA request")
         data = request.get_json()
         print("Request data:", data)
-        
-        if not data:
-            print("No JSON data provided")
-            return jsonify({'error': 'No JSON data provided'}), 400
-        
-        file_id = data.get('file_id')
-        question = data.get('question', '').strip()
-        print(f"File ID: {file_id}, Question: {question}")
-        print(f"Current cache: {file_data_cache}")
-        
-        if not file_id or not question:
-            print("Missing file_id or question")
-            return jsonify({'error': 'file_id and question are required'}), 400
-        
-        # Check if file exists in cache
-        if file_id not in file_data_cache:
-            print(f"File {file_id} not found in cache")
-            return jsonify({'error': 'File not found. Please upload the file first.'}), 404
-        
-        print("Loading extracted data...")
-        # Load extracted Excel data and analyze with LLM
-        if file_id not in file_extracted_data_cache:
-            json_path = os.path.join(EXTRACT_OUTPUT_FOLDER, f"{file_id}_{file_data_cache[file_id]['filename'].split('.')[0]}_cell_content.json")
-            print(f"Loading JSON from: {json_path}")
-            file_extracted_data_cache[file_id] = json.load(open(json_path))
-        
-        file_extracted_data = file_extracted_data_cache[file_id]
-        print("Calling LLM analysis...")
-        
-        # Analyze data using LLM
-        result = analyze_excel_data(file_extracted_data, question)
-        print("LLM result:", result)
+
+        file_id, question, session, error = resolve_question(data)
+        if error:
+            return error
+
+        result, session, coalesced = coalesced_answer(file_id, question, session, data.get('model'))
         
         if result['success']:
-            response = {
-                'success': True,
-                'question': question,
-                'answer': result['answer']
-            }
-            
-            if result['error']:  # Add warning if JSON parsing failed
-                response['warning'] = result['error']
-            
             print("Sending successful response")
-            return jsonify(response), 200
+            return jsonify(answer_response(question, session, result, coalesced)), 200
         else:
             print("LLM analysis failed")
             return jsonify({
                 'error': result['error'],
-                'fallback_message': 'LLM analysis failed'
+                'fallback_message': 'LLM analysis failed',
+                'session_id': session.session_id
             }), 500
 
     except Exception as e:
         print("Error in ask_question:", str(e))
         return jsonify({'error': f'Error processing question: {str(e)}'}), 500
 
+def timed_prepare_highlight(original_file_path, drawings):
+    """prepare_highlight on a worker thread; returns (prepared, seconds)"""
+    from excel_highlighter import prepare_highlight
+    start = time.perf_counter()
+    prepared = prepare_highlight(original_file_path, drawings['charts'], drawings['images'])
+    return prepared, time.perf_counter() - start
+
+@app.route('/qna/highlight', methods=['POST'])
+def ask_and_highlight():
+    """
+    Answer a question and highlight the cells its answer attributes, in one call.
+    The workbook is loaded for highlighting while the LLM is answering, so once the
+    answer arrives only the borders and the save remain.
+    Accepts: JSON like /qna, plus optional sheet_name for attributions without a sheet
+    Returns: JSON like /qna, plus the highlighted WOPI filename, the cells highlighted per
+             sheet and the attributed cells skipped because their sheet doesn't exist. If
+             highlighting fails, the answer is still returned, with a warning.
+    """
+    future = None
+    try:
+        print("Received QnA + highlight request")
+        data = request.get_json()
+
+        file_id, question, session, error = resolve_question(data)
+        if error:
+            return error
+
+        original_file_path = file_data_cache[file_id]['file_path']
+        if not os.path.exists(original_file_path):
+            return jsonify({'error': 'Original file not found on server'}), 404
+        disk_reaper.touch(original_file_path)
+
+        drawings = load_file_drawings(file_id)
+        future = highlight_executor.submit(timed_prepare_highlight, original_file_path, drawings)
+
+        result, session, coalesced = coalesced_answer(file_id, question, session, data.get('model'))
+        if not result['success']:
+            print("LLM analysis failed")
+            return jsonify({
+                'error': result['error'],
+                'fallback_message': 'LLM analysis failed',
+                'session_id': session.session_id
+            }), 500
+
+        # The answer is returned from here on; a failed highlight only adds a warning
+        response = answer_response(question, session, result, coalesced)
+        response.update({'file_id': file_id, 'filename': None, 'highlighted': {}, 'skipped': []})
+        try:
+            from llm_call import attributed_cells
+            sheet_names = [name for name in load_extracted_data(file_id) if name != 'schema']
+            cells_by_sheet = attributed_cells(result['answer'], sheet_names, data.get('sheet_name') or sheet_names[0],
+                                              response['skipped'])
+
+            with metrics.stage('prepare_wait'):
+                prepared, prepare_seconds = future.result()
+            metrics.record_stage('prepare', prepare_seconds)
+
+            from excel_highlighter import apply_highlights, save_highlighted
+
+            def write_output(tmp_path):
+                if not cells_by_sheet:
+                    return {'success': True, 'error': None}
+                # The first attributed sheet is applied last, so it ends up active
+                for sheet_name, cells in reversed(list(cells_by_sheet.items())):
+                    applied = apply_highlights(prepared['workbook'], sheet_name, cells,
+                                               prepared['special_ranges'].get(sheet_name.lower(), []))
+                    if not applied['success']:
+                        return applied
+                return save_highlighted(prepared['workbook'], tmp_path)
+
+            highlighted_filename, error = publish_highlighted(file_id, original_file_path, drawings, write_output)
+        except Exception as e:
+            error = str(e)
+        if error:
+            print(f"Highlighting failed in ask_and_highlight: {error}")
+            highlight_warning = f"Cells could not be highlighted: {error}"
+            response['warning'] = f"{response['warning']}; {highlight_warning}" if response.get('warning') else highlight_warning
+        else:
+            response.update({'filename': highlighted_filename, 'highlighted': cells_by_sheet})
+        return jsonify(response), 200
+
+    except Exception as e:
+        print(f"Error in ask_and_highlight: {str(e)}")
+        return jsonify({'error': f'Error processing question: {str(e)}'}), 500
+    finally:
+        # Don't leave a preparation queued for an answer that failed
+        if future is not None:
+            future.cancel()
+
+@app.route('/llm/models', methods=['GET'])
+def llm_models():
+    """
+    Models available to /qna and how requests are routed between them
+    Returns: JSON with the routing thresholds and targets, model prices and per-model latency/token stats
+    """
+    try:
+        return jsonify({'success': True, **model_router.routing_config()}), 200
+    except Exception as e:
+        print(f"Error in llm_models: {str(e)}")
+        return jsonify({'error': f'Error reading model routing: {str(e)}'}), 500
+
+@app.route('/sessions/<session_id>', methods=['GET', 'DELETE'])
+def manage_session(session_id):
+    """
+    Inspect (GET) or end (DELETE) a /qna conversation
+    Returns: JSON with the session's file, turn count and cached/uncached prompt token usage
+    """
+    try:
+        if request.method == 'DELETE':
+            if not qna_sessions.delete(session_id):
+                return jsonify({'error': 'Session not found or expired'}), 404
+            return jsonify({'success': True, 'session_id': session_id}), 200
+
+        session = qna_sessions.get(session_id)
+        if session is None:
+            return jsonify({'error': 'Session not found or expired'}), 404
+        return jsonify({'success': True, **session.to_dict()}), 200
+
+    except Exception as e:
+        print(f"Error in manage_session: {str(e)}")
+        return jsonify({'error': f'Error processing session request: {str(e)}'}), 500
+
 @app.route('/highlight', methods=['POST'])
 def highlight_excel():
     """
     Highlight specific cells in an Excel file and return the modified file.
-    Only two files are kept per upload: the original and the latest highlighted version.
+    Each call publishes a new numbered version; see publish_highlighted.
     """
     try:
         data = request.get_json()
@@ -193,7 +1006,7 @@ def highlight_excel():
             return jsonify({'error': 'file_id is required'}), 400
 
         # Use the original uploaded file
-        if file_id not in file_data_cache:
+        if not use_upload(file_id):
             return jsonify({'error': 'Original file not found. Please upload the file first.'}), 404
 
         original_info = file_data_cache[file_id]
@@ -202,67 +1015,459 @@ def highlight_excel():
 
         if not os.path.exists(original_file_path):
             return jsonify({'error': 'Original file not found on server'}), 404
+        disk_reaper.touch(original_file_path)
 
-        # Always use the same highlighted filename for this file_id
-        highlighted_filename = f"{file_id}_highlighted.xlsx"
-        highlighted_file_path = os.path.join(UPLOAD_FOLDER, highlighted_filename)
+        from excel_highlighter import highlight_excel_cells
+        drawings = load_file_drawings(file_id)
+        highlighted_filename, error = publish_highlighted(
+            file_id,
+            original_file_path,
+            drawings,
+            lambda tmp_path: highlight_excel_cells(
+                original_file_path,
+                sheet_name,
+                cell_ranges,
+                tmp_path,
+                charts_data=drawings['charts'],
+                images_data=drawings['images']
+            )
+        )
+        if error:
+            return jsonify({'error': error}), 500
 
-        print(f"Original file path: {original_file_path}")
-        print(f"Highlighted file path: {highlighted_file_path}")
+        return jsonify({
+            'success': True,
+            'file_id': file_id,
+            'filename': highlighted_filename,
+            'message': 'Highlights applied successfully'
+        }), 200
 
-        # Only ever delete or overwrite the highlighted file, never the original
-        if os.path.exists(highlighted_file_path):
-            try:
-                os.remove(highlighted_file_path)
-            except Exception as e:
-                print(f"Warning: Could not remove old highlighted file {highlighted_filename}: {e}")
+    except Exception as e:
+        print(f"Error in highlight_excel: {str(e)}")
+        return jsonify({'error': f'Error processing highlight request: {str(e)}'}), 500
 
-        # Overwrite the highlighted file every time
-        highlight_result = highlight_excel_cells(
-            original_file_path,
-            sheet_name,
-            cell_ranges,
-            highlighted_file_path
+
+@app.route('/highlight/current', methods=['GET'])
+def current_highlight():
+    """
+    Return the current highlighted version of an upload
+    Accepts: file_id query arg
+    Returns: JSON with the version number and its WOPI filename
+    """
+    try:
+        file_id = request.args.get('file_id')
+        if not file_id:
+            return jsonify({'error': 'file_id is required'}), 400
+        if not use_upload(file_id):
+            return jsonify({'error': 'File not found. Please upload the file first.'}), 404
+
+        # The pointer file also survives a restart of this process
+        try:
+            with open(highlight_pointer_path(file_id), encoding='utf-8') as f:
+                pointer = json.load(f)
+        except FileNotFoundError:
+            return jsonify({'error': 'No highlighted version published for this file'}), 404
+
+        return jsonify({'success': True, **pointer}), 200
+
+    except Exception as e:
+        print(f"Error in current_highlight: {str(e)}")
+        return jsonify({'error': f'Error reading highlighted version: {str(e)}'}), 500
+
+
+@app.route('/preview', methods=['GET', 'POST'])
+def preview_region():
+    """
+    Render the cells around some ranges as an HTML table, from the extracted data
+    (no workbook is loaded, so this is much faster than /highlight + the WOPI viewer)
+    Accepts: JSON body or query args with file_id and either cell_ranges (like /highlight,
+             or a /qna attribution list) with optional sheet_name, or answer (a /qna answer
+             array, whose attributions are previewed); optional padding and
+             format ('json' or 'html' for a standalone page)
+    Returns: JSON with the rendered regions and their HTML, or the HTML page itself
+    """
+    try:
+        params = request.get_json(silent=True) or request.args
+
+        file_id = params.get('file_id')
+        cell_ranges = params.get('cell_ranges')
+        answer = params.get('answer')
+        output_format = params.get('format', 'json')
+
+        if not file_id or not (cell_ranges or answer):
+            return jsonify({'error': 'file_id and cell_ranges or answer are required'}), 400
+
+        if not use_upload(file_id):
+            return jsonify({'error': 'File not found. Please upload the file first.'}), 404
+
+        try:
+            padding = min(max(int(params.get('padding', region_preview.DEFAULT_PADDING)), 0), 20)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'padding must be an integer'}), 400
+
+        with metrics.stage('load'):
+            data = load_extracted_data(file_id)
+        sheet_names = [name for name in data if name != 'schema']
+        # Case-insensitive, like the highlighter
+        sheet_name = params.get('sheet_name') or sheet_names[0]
+        sheet_name = next((name for name in sheet_names if name.lower() == sheet_name.lower()), sheet_name)
+        if sheet_name not in data:
+            return jsonify({'error': f"Worksheet not found: {sheet_name}"}), 400
+
+        from llm_call import attributed_cells
+        if not answer:
+            if isinstance(cell_ranges, str):
+                cell_ranges = cell_ranges.split(',')
+            answer = [{'attribution': list(cell_ranges)}]
+        skipped = []
+        ranges_by_sheet = attributed_cells(answer, sheet_names, sheet_name, skipped)
+
+        if skipped:
+            return jsonify({'error': f"Worksheet not found: {skipped[0].rsplit('!', 1)[0]}"}), 400
+        if not ranges_by_sheet:
+            return jsonify({'error': 'No valid cell ranges given'}), 400
+
+        with metrics.stage('render'):
+            preview = region_preview.render_preview(data, ranges_by_sheet, padding, load_merged_map(file_id))
+
+        if output_format == 'html':
+            page = f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"></head><body>{preview['html']}</body></html>"
+            return Response(page, mimetype='text/html')
+
+        return jsonify({
+            'success': True,
+            'file_id': file_id,
+            'regions': preview['regions'],
+            'html': preview['html']
+        }), 200
+
+    except Exception as e:
+        print(f"Error in preview_region: {str(e)}")
+        return jsonify({'error': f'Error rendering preview: {str(e)}'}), 500
+
+
+@app.route('/search', methods=['GET', 'POST'])
+def search_cells():
+    """
+    Search cell values (and optionally formula text) of an uploaded file
+    Accepts: JSON body or query args with file_id, q, and optional
+             sheets (list or comma-separated), fields ('value', 'formula' or both),
+             match ('substring' or 'token'), page, page_size
+    Returns: JSON with total match count and one page of matching cells
+    """
+    try:
+        params = request.get_json(silent=True) or request.args
+
+        file_id = params.get('file_id')
+        query = str(params.get('q', '')).strip()
+
+        if not file_id or not query:
+            return jsonify({'error': 'file_id and q are required'}), 400
+
+        if not use_upload(file_id):
+            return jsonify({'error': 'File not found. Please upload the file first.'}), 404
+
+        sheets = params.get('sheets')
+        if isinstance(sheets, str):
+            sheets = [s.strip() for s in sheets.split(',') if s.strip()]
+
+        fields = params.get('fields', 'value')
+        if isinstance(fields, str):
+            fields = [f.strip() for f in fields.split(',') if f.strip()]
+        if not fields or any(f not in search_index.SEARCH_FIELDS for f in fields):
+            return jsonify({'error': f"fields must be any of {', '.join(search_index.SEARCH_FIELDS)}"}), 400
+
+        match = params.get('match', 'substring')
+        if match not in ('substring', 'token'):
+            return jsonify({'error': "match must be 'substring' or 'token'"}), 400
+
+        try:
+            page = max(1, int(params.get('page', 1)))
+            page_size = min(SEARCH_MAX_PAGE_SIZE, max(1, int(params.get('page_size', 50))))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'page and page_size must be integers'}), 400
+
+        start = time.perf_counter()
+        found = search_index.search(
+            load_file_search_index(file_id),
+            load_extracted_data(file_id),
+            query,
+            sheets=sheets,
+            fields=fields,
+            match=match,
+            page=page,
+            page_size=page_size
         )
 
-        if not highlight_result['success']:
-            return jsonify({'error': highlight_result['error']}), 500
+        return jsonify({
+            'success': True,
+            'file_id': file_id,
+            'query': query,
+            'took_ms': round((time.perf_counter() - start) * 1000, 3),
+            **found
+        }), 200
+
+    except Exception as e:
+        print(f"Error in search_cells: {str(e)}")
+        return jsonify({'error': f'Error searching cells: {str(e)}'}), 500
+
+@app.route('/corpus/search', methods=['GET', 'POST'])
+def search_corpus():
+    """
+    Search cell values across every uploaded file
+    Accepts: JSON body or query args with q, and optional match ('token' or 'prefix'),
+             group_by ('cell' or 'file'), latest_only (only the latest upload of each
+             filename, default true), page, page_size
+    Returns: JSON with total match and file counts and one page of matching cells
+             (file_id, filename, worksheet, coordinate, value) or files
+    """
+    try:
+        params = request.get_json(silent=True) or request.args
 
-        # Ensure WOPI public directory exists
-        wopi_public_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'Frontend', 'server', 'public')
-        os.makedirs(wopi_public_dir, exist_ok=True)
+        query = str(params.get('q', '')).strip()
+        if not query:
+            return jsonify({'error': 'q is required'}), 400
 
-        # Copy new highlighted file to WOPI public dir
-        wopi_file_path = os.path.join(wopi_public_dir, highlighted_filename)
-        shutil.copy2(highlighted_file_path, wopi_file_path)
-        print(f"Copied highlighted file to WOPI directory: {wopi_file_path}")
+        match = params.get('match', 'token')
+        if match not in corpus_index.MATCH_MODES:
+            return jsonify({'error': f"match must be any of {', '.join(corpus_index.MATCH_MODES)}"}), 400
 
-        # Verify the file exists after copying
-        if not os.path.exists(wopi_file_path):
-            return jsonify({'error': 'Failed to copy highlighted file to WOPI directory'}), 500
+        group_by = params.get('group_by', 'cell')
+        if group_by not in corpus_index.GROUP_BY:
+            return jsonify({'error': f"group_by must be any of {', '.join(corpus_index.GROUP_BY)}"}), 400
+
+        latest_only = str(params.get('latest_only', 'true')).lower() in ('1', 'true', 'yes')
+
+        try:
+            page = max(1, int(params.get('page', 1)))
+            page_size = min(SEARCH_MAX_PAGE_SIZE, max(1, int(params.get('page_size', 50))))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'page and page_size must be integers'}), 400
+
+        start = time.perf_counter()
+        with registry_lock:
+            latest_ids = set(latest_upload_ids.values())
+        found = corpus.search(
+            query,
+            match=match,
+            files=latest_ids if latest_only else None,
+            group_by=group_by,
+            page=page,
+            page_size=page_size
+        )
+
+        # Only the cells on this page are looked up in their extractions
+        cells = found['results'] if group_by == 'cell' else [cell for group in found['results'] for cell in group['cells']]
+        for result in found['results']:
+            info = file_data_cache.get(result['file_id'])
+            result['filename'] = info['filename'] if info else None
+        for cell in cells:
+            if not use_upload(cell['file_id']):
+                cell['value'] = None
+                continue
+            cell_data = load_extracted_data(cell['file_id']).get(cell['worksheet'], {}).get(cell['coordinate'])
+            cell['value'] = cell_data[0] if cell_data else None
+
+        return jsonify({
+            'success': True,
+            'query': query,
+            'took_ms': round((time.perf_counter() - start) * 1000, 3),
+            **found
+        }), 200
+
+    except Exception as e:
+        print(f"Error in search_corpus: {str(e)}")
+        return jsonify({'error': f'Error searching uploaded files: {str(e)}'}), 500
+
+@app.route('/cells', methods=['GET', 'POST'])
+def get_cells():
+    """
+    Fetch rectangular cell ranges of an uploaded file as dense 2-D arrays
+    Accepts: JSON body or query args with file_id, ranges (list or comma-separated,
+             e.g. "A1:D10,'Sheet 2'!B3") and optional sheet_name for unqualified ranges
+    Returns: JSON with one entry per range: worksheet, range, values, formulas, merged
+    """
+    try:
+        params = request.get_json(silent=True) or request.args
+
+        file_id = params.get('file_id')
+        ranges = params.get('ranges')
+        sheet_name = params.get('sheet_name')
+
+        if isinstance(ranges, str):
+            ranges = [r.strip() for r in ranges.split(',') if r.strip()]
+
+        if not file_id or not ranges:
+            return jsonify({'error': 'file_id and ranges are required'}), 400
+
+        if len(ranges) > MAX_RANGES_PER_REQUEST:
+            return jsonify({'error': f'At most {MAX_RANGES_PER_REQUEST} ranges per request'}), 400
+
+        if not use_upload(file_id):
+            return jsonify({'error': 'File not found. Please upload the file first.'}), 404
+
+        try:
+            results = xl_json_helper.get_ranges(
+                load_extracted_data(file_id),
+                ranges,
+                worksheet_name=sheet_name,
+                merged_map=load_merged_map(file_id)
+            )
+        except (KeyError, ValueError) as e:
+            return jsonify({'error': str(e).strip('"\'')}), 400
 
         return jsonify({
             'success': True,
             'file_id': file_id,
-            'filename': highlighted_filename,
-            'message': 'Highlights applied successfully'
+            'ranges': results
         }), 200
 
     except Exception as e:
-        print(f"Error in highlight_excel: {str(e)}")
-        return jsonify({'error': f'Error processing highlight request: {str(e)}'}), 500
+        print(f"Error in get_cells: {str(e)}")
+        return jsonify({'error': f'Error fetching cells: {str(e)}'}), 500
 
+@app.route('/tables', methods=['GET', 'POST'])
+def get_tables():
+    """
+    List the tables detected in an uploaded file
+    Accepts: JSON body or query args with file_id, optional sheet_name and
+             include_values (also return the per-column values and formulas)
+    Returns: JSON with each table's id, sheet, range, header row, columns, headers and types
+    """
+    try:
+        params = request.get_json(silent=True) or request.args
+
+        file_id = params.get('file_id')
+        sheet_name = params.get('sheet_name')
+        include_values = str(params.get('include_values', 'false')).lower() in ('1', 'true', 'yes')
+
+        if not file_id:
+            return jsonify({'error': 'file_id is required'}), 400
+
+        if not use_upload(file_id):
+            return jsonify({'error': 'File not found. Please upload the file first.'}), 404
+
+        tables = load_file_tables(file_id)
+        if sheet_name is not None and sheet_name not in tables['sheets']:
+            return jsonify({'error': f"Worksheet not found: {sheet_name}"}), 400
+
+        found = [
+            table if include_values else {key: value for key, value in table.items() if key not in ('values', 'formulas')}
+            for table in table_detect.all_tables(tables)
+            if sheet_name is None or table['sheet'] == sheet_name
+        ]
+
+        return jsonify({
+            'success': True,
+            'file_id': file_id,
+            'tables': found
+        }), 200
+
+    except Exception as e:
+        print(f"Error in get_tables: {str(e)}")
+        return jsonify({'error': f'Error fetching tables: {str(e)}'}), 500
+
+@app.route('/export', methods=['GET', 'POST'])
+def export_cells():
+    """
+    Download the extracted cells of a sheet, or of the whole workbook, as NDJSON or CSV
+    (one record per cell: sheet, cell, row, column, value, formula; see bulk_export)
+    Accepts: JSON body or query args with file_id and optional sheet_name (every sheet
+             when omitted) and format ('ndjson', the default, or 'csv')
+    Returns: a chunked attachment, generated while it is sent: cells come from the
+             in-memory extraction if there is one, else straight from the extraction
+             file, which is never loaded as a whole. The file is opened and the first
+             chunk produced before the response starts, so a missing or unreadable
+             extraction is an error status rather than a cut-off download.
+    """
+    try:
+        params = request.get_json(silent=True) or request.args
+
+        file_id = params.get('file_id')
+        sheet_name = params.get('sheet_name')
+        output_format = params.get('format', 'ndjson')
+
+        if not file_id:
+            return jsonify({'error': 'file_id is required'}), 400
+
+        if output_format not in bulk_export.FORMATS:
+            return jsonify({'error': f"Unknown format: {output_format}. Known formats: {', '.join(bulk_export.FORMATS)}"}), 400
+
+        if not use_upload(file_id):
+            return jsonify({'error': 'File not found. Please upload the file first.'}), 404
+
+        # Sheet names in workbook order, known without loading the extraction
+        sheet_names = list(file_data_cache[file_id]['sheet_hashes'])
+        sheets = None
+        if sheet_name:
+            # Case-insensitive, like the highlighter
+            sheets = [name for name in sheet_names if name.lower() == sheet_name.lower()][:1]
+            if not sheets:
+                return jsonify({'error': f"Worksheet not found: {sheet_name}"}), 400
+
+        extraction_file = None
+        if file_id not in file_extracted_data_cache:
+            json_path = extraction_json_path(file_id)
+            if file_data_cache[file_id].get('streaming') and not os.path.exists(json_path):
+                # Too large to hold in memory: rebuilt on disk and exported from there
+                json_path = restore_streamed_extraction(file_id)
+            try:
+                # Open now: once open, the reaper or a re-extraction replacing the file
+                # can't cut the export short
+                extraction_file = open(json_path, encoding='utf-8')
+                disk_reaper.touch(file_data_cache[file_id]['file_path'])
+                disk_reaper.touch(json_path)
+            except FileNotFoundError:
+                pass
+        if extraction_file is None:
+            # Reloaded (or re-extracted) if it isn't on disk any more
+            cells = bulk_export.iter_data_cells(load_extracted_data(file_id), sheets)
+        else:
+            cells = bulk_export.iter_file_cells(extraction_file, sheets)
+
+        try:
+            if output_format == 'csv':
+                chunks = bulk_export.csv_chunks(bulk_export.iter_records(cells))
+            else:
+                chunks = bulk_export.ndjson_chunks(bulk_export.iter_records(cells))
+            first_chunk = next(chunks, '')
+        except Exception:
+            if extraction_file is not None:
+                extraction_file.close()
+            raise
+        metrics.inc('exports_total', help_text='Bulk cell exports by format and scope',
+                    format=output_format, scope='sheet' if sheets else 'workbook')
+
+        mimetype, extension = bulk_export.FORMATS[output_format]
+        download_name = extraction_base_name(file_id) + (f"_{secure_filename(sheets[0])}" if sheets else '')
+        response = Response(stream_with_context(itertools.chain([first_chunk], chunks)), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename="{download_name}.{extension}"'
+        })
+        if extraction_file is not None:
+            response.call_on_close(extraction_file.close)
+        return response
+
+    except Exception as e:
+        print(f"Error in export_cells: {str(e)}")
+        return jsonify({'error': f'Error exporting cells: {str(e)}'}), 500
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'service': 'Excel API'}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus-style metrics: latency and prompt-size histograms, cache counters"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/files', methods=['GET'])
 def list_files():
     """List all uploaded files"""
     files_info = []
-    for file_id, info in file_data_cache.items():
+    with registry_lock:
+        uploads = list(file_data_cache.items())
+    for file_id, info in uploads:
         files_info.append({
             'file_id': file_id,
             'filename': info['filename'],
@@ -274,5 +1479,8 @@ def list_files():
         'files': files_info
     }), 200
 
+if os.getenv('API_PRELOAD') == '1':
+    warmup()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""
+Cold-start benchmark for the Python entry points.
+
+Starts a fresh interpreter per run and reports the wall time to import each entry
+point, plus a `python -X importtime` breakdown of the most expensive top-level imports.
+
+Usage: python bench_startup.py [--runs 5] [--top 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+FRONTEND_DIR = os.path.join(os.path.dirname(BACKEND_DIR), 'Frontend')
+
+# name -> (directory put on sys.path, code to run)
+TARGETS = {
+    'interpreter': (BACKEND_DIR, 'pass'),
+    'api_server': (BACKEND_DIR, 'import api_server'),
+    'api_server+warmup': (BACKEND_DIR, 'import api_server; api_server.warmup()'),
+    'frontend_server_app': (os.path.join(FRONTEND_DIR, 'server'), 'import app'),
+    'frontend_server_app+warmup': (os.path.join(FRONTEND_DIR, 'server'), 'import app; app.warmup()'),
+    'wopi_viewer_app': (os.path.join(FRONTEND_DIR, 'wopi-viewer'), 'import app'),
+}
+
+
+def run_target(path, code, workdir, extra_args=()):
+    env = dict(os.environ, PYTHONPATH=path, PYTHONDONTWRITEBYTECODE='1')
+    env.pop('API_PRELOAD', None)
+    wrapped = f"import time; _t = time.perf_counter(); {code}; print(time.perf_counter() - _t)"
+    completed = subprocess.run(
+        [sys.executable, *extra_args, '-c', wrapped],
+        cwd=workdir, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Failed to run {code!r}: {completed.stderr}")
+    return completed
+
+
+def import_breakdown(stderr_text, top):
+    """Parse -X importtime output into the slowest imports down to depth 1 (cumulative ms)"""
+    rows = []
+    for line in stderr_text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '', 1).split('|')]
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue
+        # Nesting is shown by leading spaces: one for top-level imports, two more per level.
+        # Depth 1 shows what each entry point itself pulls in.
+        raw_name = line.split('|')[-1]
+        depth = (len(raw_name) - len(raw_name.lstrip(' ')) - 1) // 2
+        if depth <= 1:
+            rows.append({'module': name, 'depth': depth, 'cumulative_ms': round(cumulative_us / 1000, 2)})
+
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    report = {}
+    # api_server creates its data folders relative to the cwd; keep them out of the tree
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, (path, code) in TARGETS.items():
+            samples = []
+            for _ in range(args.runs):
+                completed = run_target(path, code, workdir)
+                samples.append(float(completed.stdout.strip().splitlines()[-1]) * 1000)
+
+            profiled = run_target(path, code, workdir, extra_args=('-X', 'importtime'))
+            report[name] = {
+                'import_ms_p50': round(statistics.median(samples), 2),
+                'import_ms_min': round(min(samples), 2),
+                'slowest_imports': import_breakdown(profiled.stderr, args.top),
+            }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""
+Backend Micro-benchmark Suite
+
+Times the backend hot paths (extraction, highlighting, prompt building and cell
+lookups) on synthetic workbooks from workbook_generator, records peak memory per
+stage, and compares the results against a stored baseline.
+
+Usage: python benchmark.py [--profiles small,medium] [--stages extract,highlight]
+           [--repeat 3] [--no-memory] [--save-baseline] [--baseline benchmark_baseline.json]
+           [--tolerance 0.25]
+       python benchmark.py --memory-ceiling [--ceiling-rows 100000] [--ceiling-mb 200]
+       python benchmark.py --bytes-per-cell [--profiles small,medium,large]
+
+Exits with status 1 when any stage is slower (or uses more memory) than the
+baseline by more than the tolerance.
+
+--memory-ceiling instead checks that streaming extraction runs in bounded memory:
+it extracts a generated million-cell sheet (and one a tenth of its size) in child
+processes and fails if peak RSS exceeds the ceiling or grows with the sheet.
+
+--bytes-per-cell reports the memory a loaded extraction takes per cell, as plain
+dicts and as compact_data.CompactSheets, with the time of a cell lookup in each, and
+the size of the /qna workbook context that is cached next to it (also per cell).
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout, redirect_stderr
+
+from workbook_generator import generate_workbook
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+BASELINE_VERSION = 1
+
+# Workbook shapes; every stage runs against each selected profile
+PROFILES = {
+    'small': dict(rows=200, cols=8, sheets=1, merged_density=0.02, formula_ratio=0.1, charts=1, images=1),
+    'medium': dict(rows=2000, cols=10, sheets=2, merged_density=0.01, formula_ratio=0.1, charts=2, images=1),
+    'large': dict(rows=20000, cols=12, sheets=2, merged_density=0.001, formula_ratio=0.1, charts=2, images=1),
+}
+
+# Memory ceiling check: peak RSS may grow by at most this much from the small sheet to the full one
+CEILING_COLS = 10
+MAX_RSS_GROWTH_MB = 32
+
+# Runs one streaming extraction and prints the process's peak RSS in MB
+STREAMING_CHILD = """
+import resource, sys
+from contextlib import redirect_stdout
+from xl_extract import extract_cell_content_streaming
+with redirect_stdout(sys.stderr):
+    extract_cell_content_streaming(sys.argv[1], sys.argv[2])
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+"""
+
+LOOKUPS_PER_RUN = 1000
+HIGHLIGHT_RANGES = 'B2,C5:D9,A3,B20:B40'
+QUESTION = 'Which rows have the highest totals and how do they compare to the average?'
+
+
+def bench_extract(context):
+    from xl_extract import extract_cell_content
+    extract_cell_content(context['workbook_path'], context['work_dir'])
+
+
+def bench_highlight(context):
+    from excel_highlighter import highlight_excel_cells
+    result = highlight_excel_cells(context['workbook_path'], 'Sheet1', HIGHLIGHT_RANGES,
+                                   os.path.join(context['work_dir'], 'highlighted.xlsx'))
+    if not result['success']:
+        raise RuntimeError(result['error'])
+
+
+def bench_prompt_build(context):
+    from llm_call import build_analysis_prompt
+    build_analysis_prompt(context['data'], QUESTION)
+
+
+def bench_get_cell_content(context):
+    from xl_json_helper import get_cell_content
+    data = context['data']
+    for sheet_name, coordinate in context['lookups']:
+        get_cell_content(data, sheet_name, coordinate)
+
+
+# name -> function(context); each call is one measured run
+STAGES = {
+    'extract': bench_extract,
+    'highlight': bench_highlight,
+    'prompt_build': bench_prompt_build,
+    'get_cell_content': bench_get_cell_content,
+}
+
+
+def prepare_context(profile_name, work_dir):
+    """Generate the profile's workbook and the extracted data the later stages read"""
+    from xl_extract import extract_cell_content
+
+    workbook_path = os.path.join(work_dir, f'bench_{profile_name}.xlsx')
+    with redirect_stdout(sys.stderr):
+        summary = generate_workbook(workbook_path, **PROFILES[profile_name])
+    with redirect_stdout(None), redirect_stderr(None):
+        data = extract_cell_content(workbook_path, work_dir)
+
+    rng = random.Random(0)
+    coordinates = [(sheet, coord) for sheet, cells in data.items() if sheet != 'schema' for coord in cells]
+    lookups = [rng.choice(coordinates) for _ in range(LOOKUPS_PER_RUN)] if coordinates else []
+
+    return {
+        'profile': profile_name,
+        'summary': summary,
+        'workbook_path': workbook_path,
+        'work_dir': work_dir,
+        'data': data,
+        'lookups': lookups,
+    }
+
+
+def measure(stage_fn, context, repeat, with_memory):
+    """Return median wall time over `repeat` runs and, optionally, peak traced memory"""
+    samples = []
+    with redirect_stdout(None), redirect_stderr(None):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            stage_fn(context)
+            samples.append(time.perf_counter() - start)
+
+        peak_mb = None
+        if with_memory:
+            # Separate run: tracemalloc slows allocation-heavy code too much to time under it
+            tracemalloc.start()
+            try:
+                stage_fn(context)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            peak_mb = round(peak / (1024 * 1024), 3)
+
+    return {
+        'seconds': round(statistics.median(samples), 5),
+        'peak_mb': peak_mb,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """List every metric that regressed beyond the tolerance"""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        for metric in ('seconds', 'peak_mb'):
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            ratio = after / before
+            current.setdefault('vs_baseline', {})[metric] = round(ratio, 3)
+            if ratio > 1 + tolerance:
+                regressions.append(f"{key} {metric}: {before} -> {after} ({ratio:.2f}x)")
+    return regressions
+
+
+def streaming_peak_rss(workbook_path, work_dir):
+    """Peak RSS in MB of a fresh process running a streaming extraction"""
+    completed = subprocess.run(
+        [sys.executable, '-c', STREAMING_CHILD, workbook_path, work_dir],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Streaming extraction failed: {completed.stderr.strip()[-2000:]}")
+    return round(float(completed.stdout.strip().splitlines()[-1]), 1)
+
+
+def check_memory_ceiling(rows, ceiling_mb):
+    """Extract a 1/10 and a full-size generated sheet in streaming mode and compare peak RSS"""
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for label, sheet_rows in (('tenth', max(rows // 10, 1)), ('full', rows)):
+            workbook_path = os.path.join(work_dir, f'ceiling_{label}.xlsx')
+            with redirect_stdout(sys.stderr):
+                summary = generate_workbook(workbook_path, rows=sheet_rows, cols=CEILING_COLS, write_only=True)
+            start = time.perf_counter()
+            peak_mb = streaming_peak_rss(workbook_path, work_dir)
+            results[label] = {'cells': summary['cells'], 'peak_rss_mb': peak_mb,
+                              'seconds': round(time.perf_counter() - start, 2)}
+            print(f"  streaming {label}: {results[label]}", file=sys.stderr)
+
+    failures = []
+    if results['full']['peak_rss_mb'] > ceiling_mb:
+        failures.append(f"peak RSS {results['full']['peak_rss_mb']} MB exceeds the {ceiling_mb} MB ceiling")
+    growth = results['full']['peak_rss_mb'] - results['tenth']['peak_rss_mb']
+    if growth > MAX_RSS_GROWTH_MB:
+        failures.append(f"peak RSS grew by {growth:.1f} MB with sheet size (limit {MAX_RSS_GROWTH_MB} MB)")
+    return results, failures
+
+
+def traced_bytes(build):
+    """Bytes still allocated by what build() returns, while it is alive"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current
+
+
+def lookup_microseconds(data, lookups):
+    from xl_json_helper import get_cell_content
+    start = time.perf_counter()
+    for sheet_name, coordinate in lookups:
+        get_cell_content(data, sheet_name, coordinate)
+    return round((time.perf_counter() - start) / max(len(lookups), 1) * 1e6, 2)
+
+
+def measure_bytes_per_cell(profiles):
+    """Memory per cell of each profile's extraction, loaded as dicts and compacted"""
+    from compact_data import compact_workbook
+    from llm_call import build_context_prefix
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for profile_name in profiles:
+            context = prepare_context(profile_name, work_dir)
+            json_path = os.path.join(work_dir, f'bench_{profile_name}_cell_content.json')
+            cells = sum(len(sheet) for name, sheet in context['data'].items() if name != 'schema')
+
+            def load():
+                with open(json_path, encoding='utf-8') as f:
+                    return json.load(f)
+
+            dict_bytes = traced_bytes(load)
+            compact_bytes = traced_bytes(lambda: compact_workbook(load()))
+            compact = compact_workbook(load())
+            prompt_context_bytes = sys.getsizeof(build_context_prefix(compact))
+            results[profile_name] = {
+                'cells': cells,
+                'dict_bytes_per_cell': round(dict_bytes / cells, 1),
+                'compact_bytes_per_cell': round(compact_bytes / cells, 1),
+                'reduction': round(dict_bytes / compact_bytes, 2),
+                'prompt_context_bytes_per_cell': round(prompt_context_bytes / cells, 1),
+                'dict_lookup_us': lookup_microseconds(context['data'], context['lookups']),
+                'compact_lookup_us': lookup_microseconds(compact, context['lookups']),
+            }
+            print(f"  {profile_name}: {results[profile_name]}", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', default='small,medium')
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--memory-ceiling', action='store_true')
+    parser.add_argument('--ceiling-rows', type=int, default=100000)
+    parser.add_argument('--ceiling-mb', type=float, default=200)
+    parser.add_argument('--bytes-per-cell', action='store_true')
+    args = parser.parse_args()
+
+    if args.bytes_per_cell:
+        profiles = [p.strip() for p in args.profiles.split(',') if p.strip()]
+        print(json.dumps({'results': measure_bytes_per_cell(profiles)}, indent=2))
+        return 0
+
+    if args.memory_ceiling:
+        results, failures = check_memory_ceiling(args.ceiling_rows, args.ceiling_mb)
+        print(json.dumps({'results': results, 'failures': failures}, indent=2))
+        return 1 if failures else 0
+
+    profiles = [p.strip() for p in args.profiles.split(',') if p.strip()]
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = [p for p in profiles if p not in PROFILES] + [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"Unknown profiles/stages: {', '.join(unknown)}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for profile_name in profiles:
+            context = prepare_context(profile_name, work_dir)
+            print(f"Profile {profile_name}: {context['summary']}", file=sys.stderr)
+            for stage_name in stages:
+                key = f"{profile_name}.{stage_name}"
+                results[key] = measure(STAGES[stage_name], context, args.repeat, not args.no_memory)
+                print(f"  {key}: {results[key]}", file=sys.stderr)
+
+    regressions = []
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f).get('results', {})
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'version': BASELINE_VERSION, 'results': baseline}, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f).get('results', {}), args.tolerance)
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one", file=sys.stderr)
+
+    print(json.dumps({'results': results, 'regressions': regressions}, indent=2))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
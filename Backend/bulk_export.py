@@ -0,0 +1,205 @@
+"""
+Bulk Export Module
+
+Streams the extracted cells of a workbook (see xl_extract) as NDJSON or CSV, one
+record per cell:
+
+    sheet, cell, row, column, value, formula
+
+'cell' is the key as extracted ('B7', or 'B7:C7' for a merged range, whose row and
+column are its top-left cell's), so both formats have the same fixed columns whether
+one sheet or the whole workbook is exported.
+
+Everything is generated lazily, a chunk at a time, from either the in-memory
+extraction or the extraction file on disk. The file is read with an incremental
+parser, so memory use doesn't grow with the size of the sheet and the first chunk
+goes out as soon as the first cells are read - a streamed extraction of a very large
+workbook is never loaded as a whole.
+"""
+
+import csv
+import io
+import json
+import re
+from json.encoder import encode_basestring
+
+from xl_json_helper import parse_cell, parse_range
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+FIELDS = ('sheet', 'cell', 'row', 'column', 'value', 'formula')
+
+# Output is yielded in pieces of about this size rather than a line at a time
+CHUNK_BYTES = 64 * 1024
+# Extraction files are read this much at a time
+READ_BYTES = 64 * 1024
+
+_decode = json.JSONDecoder().raw_decode
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+# The separator before a key, the key (without escapes) and the colon after it
+_KEY = re.compile(r'[ \t\r\n]*(,?)[ \t\r\n]*"([^"\\]*)"[ \t\r\n]*:')
+
+
+class _JsonReader:
+    """Pull parser over a file holding JSON objects: keys and values one at a time"""
+
+    def __init__(self, f):
+        self._f = f
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        # Whether the object being read has had no key yet (no comma before the next one)
+        self._first = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        chunk = self._f.read(READ_BYTES)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Next non-whitespace character, '' at the end of the file"""
+        while True:
+            pos = self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if pos < len(self._buffer):
+                return self._buffer[pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Malformed extraction file: expected {char!r} at offset {self._pos}")
+        self._pos += 1
+
+    def begin_object(self):
+        self._expect('{')
+        self._first = True
+
+    def next_key(self):
+        """The next key of the object being read, or None once it is closed"""
+        # Fast path for the usual plain key that is entirely in the buffer
+        match = _KEY.match(self._buffer, self._pos)
+        if match is not None and bool(match.group(1)) != self._first:
+            self._pos = match.end()
+            self._first = False
+            return match.group(2)
+
+        char = self._peek()
+        if char == '}':
+            self._pos += 1
+            self._first = False
+            return None
+        if not self._first:
+            self._expect(',')
+        self._first = False
+        key = self.value()
+        self._expect(':')
+        return key
+
+    def value(self):
+        """Decode one complete value; the buffer is refilled until it holds all of it"""
+        self._peek()
+        while True:
+            try:
+                value, end = _decode(self._buffer, self._pos)
+                # A value running up to the end of the buffer (a number) may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise ValueError(f"Malformed extraction file at offset {self._pos}")
+            self._fill()
+
+
+def iter_file_cells(f, sheets=None):
+    """
+    Yield (sheet_name, key, [value, formula]) from an extraction file open for reading
+    (text, UTF-8), one cell at a time, for the sheets in `sheets` (all when None);
+    stops reading once those have been read. Closing the file is up to the caller.
+    """
+    wanted = None if sheets is None else set(sheets)
+    reader = _JsonReader(f)
+    reader.begin_object()
+    while True:
+        sheet_name = reader.next_key()
+        if sheet_name is None:
+            return
+        if sheet_name == 'schema':
+            reader.value()
+            continue
+        reader.begin_object()
+        while True:
+            key = reader.next_key()
+            if key is None:
+                break
+            cell = reader.value()
+            if wanted is None or sheet_name in wanted:
+                yield sheet_name, key, cell
+        if wanted is not None:
+            wanted.discard(sheet_name)
+            if not wanted:
+                return
+
+
+def iter_data_cells(data, sheets=None):
+    """Yield (sheet_name, key, [value, formula]) from in-memory extracted data (dicts or CompactSheets)"""
+    for sheet_name in (sheets if sheets is not None else data):
+        if sheet_name == 'schema':
+            continue
+        for key, cell in data[sheet_name].items():
+            yield sheet_name, key, cell
+
+
+def iter_records(cells):
+    """(sheet, cell, row, column, value, formula) tuples for (sheet_name, key, cell) triples"""
+    for sheet_name, key, (value, formula) in cells:
+        if ':' in key:
+            _, row, col, _, _ = parse_range(key)
+        else:
+            row, col = parse_cell(key)
+        yield sheet_name, key, row, col, value, formula
+
+
+def _chunks(lines):
+    """Join lines into pieces of about CHUNK_BYTES"""
+    parts, size = [], 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield ''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield ''.join(parts)
+
+
+def ndjson_chunks(records):
+    """NDJSON, one object per record"""
+    # Every field is a string (or None) or a row/column number, so it is formatted directly
+    template = '{"sheet": %s, "cell": %s, "row": %d, "column": %d, "value": %s, "formula": %s}\n'
+    return _chunks(template % (encode_basestring(sheet_name), encode_basestring(key), row, col,
+                               'null' if value is None else encode_basestring(value),
+                               'null' if formula is None else encode_basestring(formula))
+                   for sheet_name, key, row, col, value, formula in records)
+
+
+def csv_chunks(records):
+    """CSV with a header line; a missing value or formula is an empty field"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\r\n')
+    writer.writerow(FIELDS)
+    for record in records:
+        writer.writerow(record)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
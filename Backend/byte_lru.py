@@ -0,0 +1,66 @@
+"""
+Byte LRU Module
+
+A cache bounded by the memory its values take rather than by their number. Putting a
+value in evicts the least recently used ones until the total fits max_bytes again
+(the newest value is always kept, even when it alone is larger).
+
+Used for the /qna workbook contexts, whose size varies with the workbook by orders of
+magnitude, so a count limit would either waste memory or hold almost nothing.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+class ByteLRU:
+    """Values by key, least recently used first; safe to use from several threads"""
+
+    def __init__(self, max_bytes, sizeof=sys.getsizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            return self._bytes
@@ -0,0 +1,208 @@
+"""
+Compact Extraction Module
+
+In-memory form of an extraction ({'schema', sheet: {coordinate: [value, formula]}})
+that keeps the cached /qna data small. As plain dicts every cell costs a key string,
+a dict slot, a two-element list and two value strings - a few hundred bytes for a
+cell holding a short number. A CompactSheet stores instead, per cell:
+
+    key      - row and column packed into one integer (array 'Q')
+    value    - id of an interned string (array 'I')
+    formula  - id of an interned string, 0 for none (array 'I')
+
+with each distinct string stored once, UTF-8 encoded, in a buffer shared by all
+sheets of the workbook. Merged-range keys ('B7:C7') are kept as strings; there are few.
+
+A CompactSheet is a read-only Mapping with the same keys, order and [value, formula]
+items as the dict it was built from, so existing readers (get, items, `in`, len,
+iteration) work unchanged; json.dumps needs default=json_default.
+"""
+
+import bisect
+from array import array
+from collections.abc import Mapping, ItemsView, ValuesView
+from functools import lru_cache
+
+from xl_json_helper import parse_cell, column_index, column_letter
+
+# Excel has at most 16384 columns (14 bits) and 1048576 rows
+COL_BITS = 14
+COL_MASK = (1 << COL_BITS) - 1
+# Set on keys that refer to a merged range (the rest is its index in the merged list)
+MERGED_FLAG = 1 << 40
+
+
+@lru_cache(maxsize=None)
+def _letters(col):
+    return column_letter(col)
+
+
+@lru_cache(maxsize=None)
+def _column(letters):
+    return column_index(letters)
+
+
+def _pack(key):
+    """Packed key of a coordinate as the extraction writes it ('B7'); parse_cell for anything else"""
+    digits = len(key.rstrip('0123456789'))
+    letters = key[:digits]
+    if letters.isalpha() and letters.isupper() and digits < len(key) and key[digits] != '0':
+        return int(key[digits:]) << COL_BITS | _column(letters)
+    row, col = parse_cell(key)
+    return row << COL_BITS | col
+
+
+class StringTable:
+    """Interned strings stored once in a UTF-8 buffer; id 0 stands for None"""
+
+    __slots__ = ('_ids', '_buffer', '_offsets')
+
+    def __init__(self):
+        self._ids = {}
+        self._buffer = bytearray()
+        # String i spans _buffer[_offsets[i]:_offsets[i + 1]]
+        self._offsets = array('Q', [0, 0])
+
+    def intern(self, text):
+        if text is None:
+            return 0
+        string_id = self._ids.get(text)
+        if string_id is None:
+            string_id = len(self._offsets) - 1
+            self._buffer += text.encode('utf-8')
+            self._offsets.append(len(self._buffer))
+            self._ids[text] = string_id
+        return string_id
+
+    def freeze(self):
+        """Drop the build-time index and trim the buffer; no strings can be added afterwards"""
+        self._ids = None
+        self._buffer = bytes(self._buffer)
+
+    def get(self, string_id):
+        if not string_id:
+            return None
+        return self._buffer[self._offsets[string_id]:self._offsets[string_id + 1]].decode('utf-8')
+
+    def __len__(self):
+        return len(self._offsets) - 2
+
+    def nbytes(self):
+        return len(self._buffer) + self._offsets.itemsize * len(self._offsets)
+
+
+class _ItemsView(ItemsView):
+    def __iter__(self):
+        return self._mapping._iter_items()
+
+
+class _ValuesView(ValuesView):
+    def __iter__(self):
+        return (cell for _, cell in self._mapping._iter_items())
+
+
+class CompactSheet(Mapping):
+    """One sheet's cells, read like {coordinate or merged range: [value, formula]}"""
+
+    __slots__ = ('_strings', '_keys', '_values', '_formulas', '_sorted', '_positions', '_merged', '_merged_positions')
+
+    def __init__(self, cells, strings):
+        self._strings = strings
+        self._keys = array('Q')
+        self._values = array('I')
+        self._formulas = array('I')
+        self._merged = []
+        self._merged_positions = {}
+
+        for key, (value, formula) in cells.items():
+            if ':' in key:
+                self._merged_positions[key] = len(self._keys)
+                self._keys.append(MERGED_FLAG | len(self._merged))
+                self._merged.append(key)
+            else:
+                self._keys.append(_pack(key))
+            self._values.append(strings.intern(value))
+            self._formulas.append(strings.intern(formula))
+
+        # Single-cell keys in sorted order, with their positions, for lookups
+        order = sorted((packed, position) for position, packed in enumerate(self._keys) if not packed & MERGED_FLAG)
+        self._sorted = array('Q', (packed for packed, _ in order))
+        self._positions = array('I', (position for _, position in order))
+
+    def _key(self, packed):
+        if packed & MERGED_FLAG:
+            return self._merged[packed & ~MERGED_FLAG]
+        return f"{_letters(packed & COL_MASK)}{packed >> COL_BITS}"
+
+    def _cell(self, position):
+        return [self._strings.get(self._values[position]), self._strings.get(self._formulas[position])]
+
+    def _position(self, key):
+        if not isinstance(key, str):
+            return None
+        if ':' in key:
+            return self._merged_positions.get(key)
+        try:
+            packed = _pack(key)
+        except ValueError:
+            return None
+        i = bisect.bisect_left(self._sorted, packed)
+        if i == len(self._sorted) or self._sorted[i] != packed:
+            return None
+        # Only the exact spelling is a key ('b4' and '$B$4' aren't, as in the dict)
+        if self._key(packed) != key:
+            return None
+        return self._positions[i]
+
+    def __getitem__(self, key):
+        position = self._position(key)
+        if position is None:
+            raise KeyError(key)
+        return self._cell(position)
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def __iter__(self):
+        return (self._key(packed) for packed in self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _iter_items(self):
+        for position, packed in enumerate(self._keys):
+            yield self._key(packed), self._cell(position)
+
+    def items(self):
+        return _ItemsView(self)
+
+    def values(self):
+        return _ValuesView(self)
+
+    def __repr__(self):
+        return f"<CompactSheet {len(self)} cells>"
+
+    def nbytes(self):
+        """Bytes held by this sheet's arrays (the shared string buffer not included)"""
+        arrays = (self._keys, self._values, self._formulas, self._sorted, self._positions)
+        return sum(a.itemsize * len(a) for a in arrays) + sum(len(key) for key in self._merged)
+
+
+def compact_workbook(data):
+    """
+    Compact an extraction; returns {'schema', sheet: CompactSheet} with the schema as is.
+    Sheets that are already compact are rebuilt, so the whole workbook shares one string table.
+    """
+    strings = StringTable()
+    compacted = {}
+    for sheet_name, cells in data.items():
+        compacted[sheet_name] = cells if sheet_name == 'schema' else CompactSheet(cells, strings)
+    strings.freeze()
+    return compacted
+
+
+def json_default(obj):
+    """default= for json.dump(s) of data holding CompactSheets (encodes them like the dict)"""
+    if isinstance(obj, CompactSheet):
+        return dict(obj.items())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
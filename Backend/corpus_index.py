@@ -0,0 +1,198 @@
+"""
+Corpus Search Index Module
+
+A process-wide token index over the cell values of every uploaded workbook, so a
+term (a supplier, product or account code) can be looked up across all files at
+once instead of one extraction at a time.
+
+Postings are built from each file's search index (see search_index) rather than
+from the workbook, and map a token to the cells holding it in each file:
+
+    token -> {file_id: [(sheet_position, coordinate), ...]}
+
+with every posting list sorted in sheet order. Files are added when their search
+index is built and removed when the upload is dropped, so the corpus always mirrors
+the registered uploads; queries never open a workbook or an extraction.
+"""
+
+import bisect
+import threading
+
+from search_index import tokenize, cell_sort_key
+
+MATCH_MODES = ('token', 'prefix')
+GROUP_BY = ('cell', 'file')
+
+# Cells listed per file when results are grouped by file
+CELLS_PER_FILE_GROUP = 5
+
+
+class CorpusIndex:
+    """Token postings for a set of files; safe to update and query from several threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}
+        # file_id -> sheet names, in the order files were added
+        self._files = {}
+        # file_id -> tokens it has postings under, for removal
+        self._file_tokens = {}
+        self._sorted_tokens = None
+
+    def __contains__(self, file_id):
+        return file_id in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'tokens': len(self._postings),
+                'postings': sum(len(files) for files in self._postings.values()),
+            }
+
+    def add_file(self, file_id, index):
+        """Add (or replace) a file from its search index ({'sheets': {sheet: {'value': section}}})"""
+        sheets = list(index['sheets'])
+        file_postings = {}
+        for sheet_position, sheet_name in enumerate(sheets):
+            section = index['sheets'][sheet_name].get('value')
+            if section is None:
+                continue
+            for token, text_ids in section['tokens'].items():
+                cells = file_postings.setdefault(token, [])
+                for text_id in text_ids:
+                    cells.extend((sheet_position, coordinate) for coordinate in section['cells'][text_id])
+
+        for cells in file_postings.values():
+            cells.sort(key=_posting_sort_key)
+
+        with self._lock:
+            self._remove(file_id)
+            self._files[file_id] = sheets
+            self._file_tokens[file_id] = list(file_postings)
+            for token, cells in file_postings.items():
+                self._postings.setdefault(token, {})[file_id] = cells
+            self._sorted_tokens = None
+
+    def remove_file(self, file_id):
+        with self._lock:
+            self._remove(file_id)
+
+    def _remove(self, file_id):
+        if file_id not in self._files:
+            return
+        for token in self._file_tokens.pop(file_id):
+            files = self._postings.get(token)
+            if files is None:
+                continue
+            files.pop(file_id, None)
+            if not files:
+                del self._postings[token]
+        del self._files[file_id]
+        self._sorted_tokens = None
+
+    def _prefix_postings(self, prefix):
+        """Postings of every token starting with prefix, merged per file"""
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._postings)
+        tokens = self._sorted_tokens
+        merged = {}
+        for i in range(bisect.bisect_left(tokens, prefix), len(tokens)):
+            if not tokens[i].startswith(prefix):
+                break
+            for file_id, cells in self._postings[tokens[i]].items():
+                merged.setdefault(file_id, set()).update(cells)
+        return {file_id: sorted(cells, key=_posting_sort_key) for file_id, cells in merged.items()}
+
+    def _matches(self, query, match, files):
+        """[(file_id, sheet names, [(sheet_position, coordinate)])] of cells holding every query token"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        groups = []
+        for position, token in enumerate(tokens):
+            if match == 'prefix' and position == len(tokens) - 1:
+                postings = self._prefix_postings(token)
+            else:
+                postings = self._postings.get(token)
+            if not postings:
+                return []
+            groups.append(postings)
+
+        groups.sort(key=len)
+        candidates = set(groups[0]).intersection(*groups[1:])
+        if files is not None:
+            candidates.intersection_update(files)
+
+        matches = []
+        for file_id, sheets in self._files.items():
+            if file_id not in candidates:
+                continue
+            lists = sorted((group[file_id] for group in groups), key=len)
+            cells = lists[0]
+            if len(lists) > 1:
+                others = [set(other) for other in lists[1:]]
+                cells = [cell for cell in cells if all(cell in other for other in others)]
+            if cells:
+                matches.append((file_id, sheets, cells))
+        return matches
+
+    def search(self, query, match='token', files=None, group_by='cell', page=1, page_size=50):
+        """
+        Find the cells whose value contains every word of the query, across all files.
+
+        match:    'token' (whole words) or 'prefix' (the last word may be a prefix)
+        files:    optional set of file_ids to restrict to
+        group_by: 'cell' pages through matching cells; 'file' through matching files,
+                  each with its match count and first few cells
+        Returns {'total', 'total_files', 'page', 'page_size', 'results'}, where a cell
+        result is {file_id, worksheet, coordinate}.
+        """
+        with self._lock:
+            matches = self._matches(query.lower(), match, files)
+
+        total = sum(len(cells) for _, _, cells in matches)
+        start = (page - 1) * page_size
+        results = []
+
+        if group_by == 'file':
+            for file_id, sheets, cells in matches[start:start + page_size]:
+                results.append({
+                    'file_id': file_id,
+                    'matches': len(cells),
+                    'cells': [_cell_result(file_id, sheets, cell) for cell in cells[:CELLS_PER_FILE_GROUP]],
+                })
+        else:
+            # Skip whole files until the page starts, so only the page's cells are built
+            skipped = 0
+            for file_id, sheets, cells in matches:
+                if skipped + len(cells) <= start:
+                    skipped += len(cells)
+                    continue
+                offset = max(0, start - skipped)
+                for cell in cells[offset:offset + page_size - len(results)]:
+                    results.append(_cell_result(file_id, sheets, cell))
+                skipped += len(cells)
+                if len(results) >= page_size:
+                    break
+
+        return {
+            'total': total,
+            'total_files': len(matches),
+            'page': page,
+            'page_size': page_size,
+            'results': results,
+        }
+
+
+def _posting_sort_key(cell):
+    return cell[0], cell_sort_key(cell[1])
+
+
+def _cell_result(file_id, sheets, cell):
+    sheet_position, coordinate = cell
+    return {'file_id': file_id, 'worksheet': sheets[sheet_position], 'coordinate': coordinate}
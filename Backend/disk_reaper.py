@@ -0,0 +1,221 @@
+"""
+Disk Reaper Module
+
+Keeps the upload, extraction and WOPI output directories within per-directory disk
+budgets. A background thread periodically evicts files that outlived their TTL, files
+no registered upload refers to any more, and - when a directory is still over budget -
+the least recently used files.
+
+The reaper only decides what to delete. Which files are still referenced, and what to
+do when a referenced file goes (drop the upload from the registry, or simply let the
+extraction be regenerated on the next request), is supplied by the caller.
+"""
+
+import os
+import threading
+import time
+
+import metrics
+
+# Files used this recently are never evicted, so in-flight requests keep their inputs
+MIN_AGE_SECONDS = 60
+
+# Hidden temp files (partial uploads, unpublished outputs) older than this are leftovers
+STALE_TEMP_SECONDS = 6 * 3600
+
+_access_lock = threading.Lock()
+_last_access = {}
+
+
+class DirectoryPolicy:
+    """
+    Limits for one directory. max_bytes/ttl_seconds/orphan_ttl_seconds of None disable
+    that rule; `manages(filename)` restricts the reaper to the files it owns there.
+    With `since` (a timestamp), files created before then are left alone: their inode
+    change time (st_ctime) is used, as a copy or link can carry an older mtime.
+    """
+
+    def __init__(self, name, path, max_bytes=None, ttl_seconds=None, orphan_ttl_seconds=None, manages=None,
+                 since=None):
+        self.name = name
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.orphan_ttl_seconds = orphan_ttl_seconds
+        self.manages = manages or (lambda filename: True)
+        self.since = since
+
+
+def touch(path):
+    """Record a use of path, for LRU ordering (mtime is the fallback)"""
+    with _access_lock:
+        _last_access[os.path.abspath(path)] = time.time()
+
+
+def forget(path):
+    with _access_lock:
+        _last_access.pop(os.path.abspath(path), None)
+
+
+def scan_directory(policy):
+    """Return (entries, stale_temp_paths) for the managed files of a directory"""
+    entries, stale = [], []
+    if not os.path.isdir(policy.path):
+        return entries, stale
+
+    now = time.time()
+    with _access_lock:
+        accessed = dict(_last_access)
+
+    with os.scandir(policy.path) as iterator:
+        for entry in iterator:
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+            if policy.since is not None and stat.st_ctime < policy.since:
+                continue
+            if entry.name.startswith('.'):
+                if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                    stale.append(entry.path)
+                continue
+            if not policy.manages(entry.name):
+                continue
+
+            path = os.path.abspath(entry.path)
+            entries.append({
+                'path': path,
+                'name': entry.name,
+                'size': stat.st_size,
+                'last_used': max(stat.st_mtime, accessed.get(path, 0)),
+            })
+    return entries, stale
+
+
+def plan_evictions(entries, policy, is_referenced, now=None):
+    """
+    Choose what to delete from one directory; returns [(entry, reason)].
+    Reasons: 'ttl' (unused for ttl_seconds), 'orphan' (unreferenced for
+    orphan_ttl_seconds) and 'budget' (LRU, unreferenced files first).
+    """
+    now = time.time() if now is None else now
+    evictions = []
+    kept = []
+
+    for entry in entries:
+        idle = now - entry['last_used']
+        referenced = is_referenced(entry['path'])
+        entry['referenced'] = referenced
+        if idle < MIN_AGE_SECONDS:
+            kept.append(entry)
+        elif policy.ttl_seconds is not None and idle > policy.ttl_seconds:
+            evictions.append((entry, 'ttl'))
+        elif not referenced and policy.orphan_ttl_seconds is not None and idle > policy.orphan_ttl_seconds:
+            evictions.append((entry, 'orphan'))
+        else:
+            kept.append(entry)
+
+    if policy.max_bytes is not None:
+        total = sum(entry['size'] for entry in kept)
+        if total > policy.max_bytes:
+            candidates = sorted(
+                (entry for entry in kept if now - entry['last_used'] >= MIN_AGE_SECONDS),
+                key=lambda entry: (entry['referenced'], entry['last_used'])
+            )
+            for entry in candidates:
+                if total <= policy.max_bytes:
+                    break
+                evictions.append((entry, 'budget'))
+                total -= entry['size']
+
+    return evictions
+
+
+def reap_directory(policy, is_referenced, on_evict=None, now=None):
+    """Apply a policy to its directory; returns {'evicted', 'freed_bytes', 'temp_removed'}"""
+    entries, stale = scan_directory(policy)
+    result = {'evicted': 0, 'freed_bytes': 0, 'temp_removed': 0}
+
+    for path in stale:
+        try:
+            os.remove(path)
+            result['temp_removed'] += 1
+        except OSError:
+            pass
+
+    for entry, reason in plan_evictions(entries, policy, is_referenced, now):
+        try:
+            os.remove(entry['path'])
+        except FileNotFoundError:
+            # Already removed along with an evicted upload
+            forget(entry['path'])
+            continue
+        except OSError as e:
+            print(f"Warning: Could not evict {entry['path']}: {e}")
+            continue
+
+        forget(entry['path'])
+        result['evicted'] += 1
+        result['freed_bytes'] += entry['size']
+        metrics.inc('disk_evictions_total', help_text='Files removed by the disk reaper',
+                    directory=policy.name, reason=reason)
+        metrics.inc('disk_evicted_bytes_total', entry['size'], help_text='Bytes freed by the disk reaper',
+                    directory=policy.name)
+        if on_evict is not None:
+            on_evict(entry['path'], reason)
+
+    return result
+
+
+class DiskReaper:
+    """
+    Runs reap_directory over a set of policies on a background thread.
+    The thread is started lazily by ensure_started() (and restarted in a forked
+    child), never at import, so pre-forking servers don't inherit a dead thread.
+    """
+
+    def __init__(self, get_policies, is_referenced, on_evict=None, interval_seconds=300):
+        self.get_policies = get_policies
+        self.is_referenced = is_referenced
+        self.on_evict = on_evict
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def ensure_started(self):
+        if not self.interval_seconds or self.interval_seconds <= 0:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='disk-reaper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        """Reap every directory once; returns {policy_name: result}"""
+        results = {}
+        for policy in self.get_policies():
+            results[policy.name] = reap_directory(policy, self.is_referenced, self.on_evict)
+        return results
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                results = self.run_once()
+                freed = sum(result['freed_bytes'] for result in results.values())
+                if freed:
+                    print(f"Disk reaper freed {freed / (1024 * 1024):.1f} MB: {results}")
+            except Exception as e:
+                print(f"Error in disk reaper: {str(e)}")
@@ -15,14 +15,17 @@ import sys
 import os
 import json
 import copy
+import time
+import metrics
 
 
-def highlight_cells(workbook, sheet_name, cell_addresses_json, merged_cells_data_json, charts_data_json, images_data_json, output_filepath):
+def apply_highlights(workbook, sheet_name, cell_addresses, special_ranges):
     """
-    Adds borders to multiple specified cells/ranges in an Excel file and saves a new copy.
-    Preserves all original formatting including background colors, charts, and images.
-    Only modifies the border properties of specified cells.
+    Add borders to cells/ranges of one sheet of a loaded workbook and make it the active,
+    scrolled-to sheet. An address inside one of special_ranges (merged cells, chart or
+    image anchors) highlights that whole range. Only border properties are modified.
     """
+    apply_start = time.perf_counter()
     try:
         # Try to get the specified sheet (case-insensitive)
         sheet_name_lower = sheet_name.lower()
@@ -43,45 +46,18 @@ def highlight_cells(workbook, sheet_name, cell_addresses_json, merged_cells_data
         # Make this sheet active in the workbook
         workbook.active = worksheet
 
-        cell_addresses_to_process = json.loads(cell_addresses_json)
-        merged_cells_data = json.loads(merged_cells_data_json)
-        charts_data = json.loads(charts_data_json)
-        images_data = json.loads(images_data_json)
-        
         # Create border style with a nice blue color (RGB: 0, 120, 212)
         blue_side = Side(style='thick', color='0078D4')
 
         processed_ranges_for_highlight = set()
-
-        # Get all ranges from merged cells, charts, and images for the specified sheet
-        all_special_ranges = []
-
-        # Process merged cells (case-insensitive sheet name comparison)
-        for sheet_info in merged_cells_data.get("merged_cells", []):
-            if sheet_info.get("sheet_name", "").lower() == sheet_name_lower:
-                for merged_cell in sheet_info.get("merged_cells", []):
-                    all_special_ranges.append(merged_cell.get("range"))
-
-        # Process charts - using the correct JSON structure (case-insensitive)
-        for sheet_info in charts_data.get("charts", []):
-            if sheet_info.get("sheet_name", "").lower() == sheet_name_lower:
-                for chart in sheet_info.get("charts_on_sheet", []):
-                    if "coords" in chart:
-                        all_special_ranges.append(chart["coords"])
-
-        # Process images - using the correct JSON structure (case-insensitive)
-        for sheet_info in images_data.get("images", []):
-            if sheet_info.get("sheet_name", "").lower() == sheet_name_lower:
-                for image in sheet_info.get("images_on_sheet", []):
-                    if "coords" in image:
-                        all_special_ranges.append(image["coords"])
+        all_special_ranges = special_ranges
 
         if not all_special_ranges:
             print(f"Note: No special ranges found for sheet '{actual_sheet_name}' in provided JSON.", file=sys.stderr)
 
         first_highlighted_cell_coords = None # To store the first highlighted cell for setting active_cell
 
-        for input_address in cell_addresses_to_process:
+        for input_address in cell_addresses:
             input_address = input_address.strip().upper()
 
             if not input_address:
@@ -195,94 +171,120 @@ def highlight_cells(workbook, sheet_name, cell_addresses_json, merged_cells_data
         else:
             print("No cells were highlighted, not setting active cell.", file=sys.stdout)
 
-        # Save the modified workbook while preserving all formatting
-        workbook.save(output_filepath)
+        metrics.record_stage('apply', time.perf_counter() - apply_start)
+        return {'success': True, 'error': None}
+    except Exception as e:
+        print(f"Error processing Excel file: {e}", file=sys.stderr)
+        return {'success': False, 'error': f'Error processing Excel file: {str(e)}'}
+
+
+def save_highlighted(workbook, output_filepath):
+    """Save the modified workbook while preserving all formatting"""
+    try:
+        with metrics.stage('save'):
+            workbook.save(output_filepath)
         print(f"Successfully created bordered file: {output_filepath}")
-        
         return {'success': True, 'error': None}
-    except json.JSONDecodeError as e:
-        print(f"Error: Invalid JSON provided: {e}", file=sys.stderr)
-        return {'success': False, 'error': f'Invalid JSON provided: {str(e)}'}
     except Exception as e:
         print(f"Error processing Excel file: {e}", file=sys.stderr)
         return {'success': False, 'error': f'Error processing Excel file: {str(e)}'}
 
 
-def highlight_excel_cells(input_file_path, sheet_name, cell_ranges, output_file_path):
+def highlight_cells(workbook, sheet_name, cell_addresses_json, merged_cells_data_json, charts_data_json, images_data_json, output_filepath):
+    """
+    Adds borders to multiple specified cells/ranges in an Excel file and saves a new copy.
+    Preserves all original formatting including background colors, charts, and images.
+    Only modifies the border properties of specified cells.
+    """
+    try:
+        sheet_name_lower = sheet_name.lower()
+        cell_addresses_to_process = json.loads(cell_addresses_json)
+        merged_cells_data = json.loads(merged_cells_data_json)
+        charts_data = json.loads(charts_data_json)
+        images_data = json.loads(images_data_json)
+
+        # Get all ranges from merged cells, charts, and images for the specified sheet
+        all_special_ranges = []
+
+        # Process merged cells (case-insensitive sheet name comparison)
+        for sheet_info in merged_cells_data.get("merged_cells", []):
+            if sheet_info.get("sheet_name", "").lower() == sheet_name_lower:
+                for merged_cell in sheet_info.get("merged_cells", []):
+                    all_special_ranges.append(merged_cell.get("range"))
+
+        # Process charts and images - using the correct JSON structure (case-insensitive)
+        all_special_ranges += _drawing_ranges(charts_data, images_data).get(sheet_name_lower, [])
+    except json.JSONDecodeError as e:
+        print(f"Error: Invalid JSON provided: {e}", file=sys.stderr)
+        return {'success': False, 'error': f'Invalid JSON provided: {str(e)}'}
+
+    result = apply_highlights(workbook, sheet_name, cell_addresses_to_process, all_special_ranges)
+    if not result['success']:
+        return result
+    return save_highlighted(workbook, output_filepath)
+
+
+def _drawing_ranges(charts_data, images_data):
+    """{lowercased sheet name: [coords]} of the charts and images in the extraction layouts"""
+    ranges = {}
+    for sheet_info in (charts_data or {}).get("charts", []):
+        ranges.setdefault(sheet_info.get("sheet_name", "").lower(), []).extend(
+            chart["coords"] for chart in sheet_info.get("charts_on_sheet", []) if "coords" in chart
+        )
+    for sheet_info in (images_data or {}).get("images", []):
+        ranges.setdefault(sheet_info.get("sheet_name", "").lower(), []).extend(
+            image["coords"] for image in sheet_info.get("images_on_sheet", []) if "coords" in image
+        )
+    return ranges
+
+
+def prepare_highlight(input_file_path, charts_data=None, images_data=None):
+    """
+    The slow, answer-independent half of highlighting: load the workbook and collect
+    every sheet's special ranges. Returns {'workbook', 'special_ranges': {lowercased
+    sheet name: [range]}} for apply_highlights(); it can run while the cells to
+    highlight are still unknown.
+    charts_data/images_data are the upload-time extractions (xl_extract.extract_charts /
+    extract_images); without them chart and image anchors are derived from the workbook.
+    """
+    # Load workbook with data_only=False to preserve all formatting
+    with metrics.stage('load'):
+        workbook = openpyxl.load_workbook(input_file_path, data_only=False)
+
+    special_ranges = _drawing_ranges(charts_data, images_data)
+    for worksheet in workbook.worksheets:
+        ranges = special_ranges.setdefault(worksheet.title.lower(), [])
+        ranges += [merged_range.coord for merged_range in worksheet.merged_cells.ranges]
+
+        # Anchor markers are zero-based
+        if charts_data is None:
+            ranges += [f"{get_column_letter(chart.anchor._from.col + 1)}{chart.anchor._from.row + 1}" for chart in worksheet._charts]
+        if images_data is None:
+            ranges += [f"{get_column_letter(img.anchor._from.col + 1)}{img.anchor._from.row + 1}" for img in worksheet._images]
+
+    return {'workbook': workbook, 'special_ranges': special_ranges}
+
+
+def highlight_excel_cells(input_file_path, sheet_name, cell_ranges, output_file_path, charts_data=None, images_data=None):
     """
     Wrapper function for the main highlighting functionality.
-    Converts simple parameters to the format expected by highlight_cells function.
+    Loads the workbook (see prepare_highlight), highlights the comma-separated
+    cell_ranges on one sheet and saves the result to output_file_path.
     Preserves all original Excel formatting.
     """
     try:
-        # Load workbook with data_only=False to preserve all formatting
-        workbook = openpyxl.load_workbook(input_file_path, data_only=False)
-        
-        # Prepare cell ranges as JSON array
+        # Prepare cell ranges as an array
         cell_ranges_array = [r.strip() for r in cell_ranges.split(',') if r.strip()]
         if not cell_ranges_array:
             return {'success': True, 'error': None}  # No cells to highlight
-            
-        cell_addresses_json = json.dumps(cell_ranges_array)
-        
-        # Get real data from the excel file using openpyxl
-        worksheet = workbook[sheet_name]
-        merged_cells_data = {
-            "merged_cells": [
-                {
-                    "sheet_name": sheet_name,
-                    "merged_cells": [
-                        {
-                            "range": merged_range.coord
-                        } for merged_range in worksheet.merged_cells.ranges
-                    ]
-                }
-            ]
-        }
-        
-        # Get charts data
-        charts_data = {
-            "charts": [
-                {
-                    "sheet_name": sheet_name,
-                    "charts_on_sheet": [
-                        {
-                            "coords": f"{get_column_letter(chart.anchor._from.col)}{chart.anchor._from.row}"
-                        } for chart in worksheet._charts
-                    ]
-                }
-            ]
-        }
-        
-        # Get images data
-        images_data = {
-            "images": [
-                {
-                    "sheet_name": sheet_name,
-                    "images_on_sheet": [
-                        {
-                            "coords": f"{get_column_letter(img.anchor._from.col)}{img.anchor._from.row}"
-                        } for img in worksheet._images
-                    ]
-                }
-            ]
-        }
-        
-        # Convert to JSON strings
-        merged_cells_json = json.dumps(merged_cells_data)
-        charts_json = json.dumps(charts_data)
-        images_json = json.dumps(images_data)
-        
-        # Call the main highlighting function
-        return highlight_cells(
-            workbook,
-            sheet_name,
-            cell_addresses_json,
-            merged_cells_json,
-            charts_json,
-            images_json,
-            output_file_path
-        )
+
+        prepared = prepare_highlight(input_file_path, charts_data, images_data)
+        workbook = prepared['workbook']
+        result = apply_highlights(workbook, sheet_name, cell_ranges_array,
+                                  prepared['special_ranges'].get(sheet_name.lower(), []))
+        if not result['success']:
+            return result
+        return save_highlighted(workbook, output_file_path)
     except Exception as e:
         print(f"Error in highlight_excel_cells: {e}", file=sys.stderr)
-        return {'success': False, 'error': f'Error in highlight_excel_cells: {str(e)}'} 
\ No newline at end of file
+        return {'success': False, 'error': f'Error in highlight_excel_cells: {str(e)}'}
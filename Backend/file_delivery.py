@@ -0,0 +1,184 @@
+"""
+File Delivery Module
+
+Publishes generated workbooks into the directory served by the WOPI server.
+Every write goes to a hidden temporary name in the destination directory and is
+moved into place with an atomic rename, so readers only ever see either the
+previous complete file or the new complete file.
+
+Outputs that several requests can regenerate at once (highlighted workbooks) are
+numbered: every request writes its own version and OutputVersions tracks which one is
+current, so concurrent writers never replace a file a reader was just given.
+"""
+
+import os
+import sys
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+
+# How a highlighted file reaches the WOPI public directory:
+#   direct - the highlighter writes straight into the served location
+#   link   - write into Excel_files, then hardlink/reflink into the served location
+#   copy   - write into Excel_files, then copy into the served location
+DELIVERY_MODES = ('direct', 'link', 'copy')
+
+# Linux FICLONE ioctl (copy-on-write clone on btrfs/xfs/overlayfs)
+FICLONE = 0x40049409
+
+
+def temp_path_for(target_path):
+    """Return a hidden, unique temporary path next to target_path"""
+    directory, name = os.path.split(target_path)
+    root, ext = os.path.splitext(name)
+    # Keep the real extension so libraries that sniff it (openpyxl) still work
+    return os.path.join(directory, f".{root}.{uuid.uuid4().hex}.tmp{ext}")
+
+
+@contextmanager
+def atomic_output(target_path):
+    """
+    Yield a temporary path to write to; on success it is renamed over target_path.
+    On failure the temporary file is removed and target_path is left untouched.
+    """
+    tmp_path = temp_path_for(target_path)
+    try:
+        yield tmp_path
+        commit_output(tmp_path, target_path)
+    except BaseException:
+        discard_output(tmp_path)
+        raise
+
+
+def commit_output(tmp_path, target_path):
+    """Flush a finished temporary file and atomically rename it over target_path"""
+    _fsync_file(tmp_path)
+    os.replace(tmp_path, target_path)
+
+
+def discard_output(tmp_path):
+    """Remove a temporary file that will not be published"""
+    _remove_quietly(tmp_path)
+
+
+def publish_file(src_path, dest_path, mode='link'):
+    """
+    Make src_path available at dest_path without exposing a partial file.
+
+    mode='link' tries a hardlink, then a reflink, then falls back to copying.
+    mode='copy' always copies. Returns the method actually used.
+    """
+    if os.path.abspath(src_path) == os.path.abspath(dest_path):
+        return 'none'
+
+    tmp_path = temp_path_for(dest_path)
+    try:
+        method = None
+        if mode == 'link':
+            method = _try_hardlink(src_path, tmp_path) or _try_reflink(src_path, tmp_path)
+        if method is None:
+            shutil.copy2(src_path, tmp_path)
+            _fsync_file(tmp_path)
+            method = 'copy'
+        os.replace(tmp_path, dest_path)
+        return method
+    except BaseException:
+        discard_output(tmp_path)
+        raise
+
+
+class OutputVersions:
+    """
+    Version numbers of a regenerated output, per key (e.g. upload ID).
+
+    reserve() hands out a fresh number without holding any lock while the version is
+    written, so writers for the same key run in parallel. publish() then records the
+    finished version and makes it current unless a newer one already is; the `keep`
+    newest versions (and the one just published) are kept, older ones are returned
+    for the caller to delete.
+    """
+
+    def __init__(self, keep=3):
+        self.keep = max(1, keep)
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _entry(self, key):
+        with self._lock:
+            return self._entries.setdefault(key, {'next': 1, 'current': None, 'published': [], 'lock': threading.Lock()})
+
+    def reserve(self, key):
+        entry = self._entry(key)
+        with entry['lock']:
+            version = entry['next']
+            entry['next'] += 1
+        return version
+
+    def publish(self, key, version, on_current=None):
+        """
+        Record a finished version. If it becomes current, on_current(version) runs under
+        the key's lock, so pointer updates are applied in version order.
+        Returns (is_current, stale_versions).
+        """
+        entry = self._entry(key)
+        with entry['lock']:
+            entry['published'].append(version)
+            is_current = entry['current'] is None or version > entry['current']
+            if is_current:
+                entry['current'] = version
+                if on_current is not None:
+                    on_current(version)
+            newest = sorted(entry['published'], reverse=True)
+            stale = [v for v in newest[self.keep:] if v != version]
+            entry['published'] = [v for v in entry['published'] if v not in stale]
+        return is_current, stale
+
+    def current(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry['current'] if entry else None
+
+    def drop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+def _try_hardlink(src_path, tmp_path):
+    try:
+        os.link(src_path, tmp_path)
+        return 'hardlink'
+    except OSError:
+        # Different filesystem (EXDEV) or links not supported
+        return None
+
+
+def _try_reflink(src_path, tmp_path):
+    try:
+        import fcntl
+    except ImportError:
+        return None
+
+    try:
+        with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(src_path, tmp_path)
+        return 'reflink'
+    except OSError:
+        _remove_quietly(tmp_path)
+        return None
+
+
+def _fsync_file(path):
+    try:
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+    except OSError as e:
+        print(f"Warning: Could not fsync {path}: {e}", file=sys.stderr)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,859 @@
+"""
+Formula Evaluation Module
+
+Computes formula results a workbook doesn't carry. Cell values are read with
+data_only=True, i.e. the results Excel cached when it last saved the file; files
+written by tools that don't calculate (openpyxl, pandas and most exporters) have the
+formulas but no results, and their formula cells would come out empty.
+
+evaluate_missing() fills those values in from the rest of the extraction:
+
+    - the references of every formula are read first, and the formula cells are
+      evaluated in dependency order (after every formula cell their references
+      reach), each once, its result stored for the formulas that follow
+    - a formula is parsed into a tree of Python closures when its turn comes
+    - each sheet is read once into typed values per column, with their numbers in
+      numpy arrays; a range is a few array slices, the recent ones memoized, so range functions
+      (SUM, AVERAGE, MIN, MAX, COUNT, VLOOKUP) work on whole arrays, not cell by cell
+
+Supported: numbers, strings, booleans and error literals; + - * / ^ % & and the
+comparisons; cell and range references, absolute or relative, whole columns (A:C)
+and other sheets (Sheet2!A1, 'My sheet'!A1:B5); SUM, AVERAGE, MIN, MAX, COUNT,
+COUNTA, IF, IFERROR, AND, OR, NOT, ROUND, ABS, ISBLANK and VLOOKUP. A formula using anything
+else (other functions, defined names, structured references), part of a circular
+reference or depending on such a formula is left unevaluated.
+"""
+
+import math
+import operator
+import re
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+import numpy as np
+
+from table_detect import FLOAT_PATTERN, parse_number
+from xl_json_helper import parse_cell, column_index
+
+ERROR_CODES = ('#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A')
+
+# Largest range materialized for one reference
+MAX_RANGE_CELLS = 1000000
+# Ranges kept memoized; formulas filled down a column mostly read distinct ranges,
+# so holding every one would cost memory for little reuse
+RANGE_CACHE_SIZE = 256
+
+_SHEET = r"(?:'(?:[^']|'')+'|[A-Za-z_][\w.]*)!"
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<string>"(?:[^"]|"")*")
+      | (?P<error>\#(?:NULL!|DIV/0!|VALUE!|REF!|NAME\?|NUM!|N/A))
+      | (?P<cells>(?:SHEET)?\$?[A-Za-z]{1,3}\$?\d+(?::\$?[A-Za-z]{1,3}\$?\d+)?)(?![\w(!])
+      | (?P<columns>(?:SHEET)?\$?[A-Za-z]{1,3}:\$?[A-Za-z]{1,3})(?![\w(!])
+      | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<function>[A-Za-z_][\w.]*)(?=\s*\()
+      | (?P<bool>TRUE|FALSE)(?![\w(])
+      | (?P<op><>|<=|>=|[-+*/^&=<>%(),])
+    )""".replace('SHEET', _SHEET), re.VERBOSE | re.IGNORECASE)
+
+# Sheet prefixes of references, quoted or not
+SHEET_PREFIX_PATTERN = re.compile(r"'((?:[^']|'')+)'!|([A-Za-z_][\w.]*)!")
+
+COMPARISON_OPS = {'=': operator.eq, '<>': operator.ne, '<': operator.lt,
+                  '>': operator.gt, '<=': operator.le, '>=': operator.ge}
+
+
+class FormulaError(Exception):
+    """A formula that can't be evaluated here (syntax or function not supported)"""
+
+
+class XLError(Exception):
+    """An Excel error value (#DIV/0!, #VALUE!, ...): raised while evaluating, stored as a cell's value"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class RangeValue:
+    """
+    A range's numbers as a float grid (rows x columns, NaN where a cell holds no number)
+    and the first error value it holds, if any; its values column by column are only
+    gathered (from the sheet's columns) when a function asks for them
+    """
+
+    __slots__ = ('_sources', '_top', 'grid', 'numbers', 'error', '_columns', '_index')
+
+    def __init__(self, sources, top, grid, error=None):
+        # The sheet's _Column (None where it has no cells) for each column of the range, from row top
+        self._sources = sources
+        self._top = top
+        self.grid = grid
+        self.numbers = grid[~np.isnan(grid)]
+        self.error = error
+        self._columns = None
+        self._index = None
+
+    def __len__(self):
+        return self.grid.size
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            height = self.grid.shape[0]
+            self._columns = []
+            for source in self._sources:
+                values = source.values[self._top:self._top + height] if source is not None else []
+                self._columns.append(values + [None] * (height - len(values)))
+        return self._columns
+
+    def values(self):
+        return (value for column in self.columns for value in column)
+
+    def first_match(self, value):
+        """Row of the first exact (case-insensitive) match of value in the first column, or None"""
+        if self._index is None:
+            self._index = {}
+            for row, cell in enumerate(self.columns[0]):
+                self._index.setdefault(_match_key(cell), row)
+        return self._index.get(_match_key(value))
+
+
+class _Column:
+    """A sheet column's typed values by row (index 0 unused), with their numbers and errors as arrays"""
+
+    __slots__ = ('values', 'numbers', 'errors')
+
+    def __init__(self, values):
+        self.values = values
+        self.numbers = np.fromiter((value if type(value) in (int, float) else math.nan for value in values),
+                                   dtype=float, count=len(values))
+        self.errors = np.fromiter((type(value) is XLError for value in values), dtype=bool, count=len(values))
+
+    def set(self, row, value):
+        self.values[row] = value
+        self.numbers[row] = value if type(value) in (int, float) else math.nan
+        self.errors[row] = type(value) is XLError
+
+
+def _match_key(value):
+    if isinstance(value, bool):
+        return ('bool', value)
+    if isinstance(value, (int, float)):
+        return ('number', float(value))
+    if isinstance(value, str):
+        return ('text', value.lower())
+    return (None, None)
+
+
+@lru_cache(maxsize=None)
+def _column(letters):
+    return column_index(letters)
+
+
+def cell_position(key):
+    """(row, column) of a cell key, or of the top-left cell of a merged-range key ('B7:C8')"""
+    ref = key.partition(':')[0]
+    # Keys as the extraction writes them ('B7') skip the regex
+    letters = ref.rstrip('0123456789')
+    if letters.isalpha() and letters.isupper() and len(letters) < len(ref) and ref[len(letters)] != '0':
+        return int(ref[len(letters):]), _column(letters)
+    return parse_cell(ref)
+
+
+def _typed(text):
+    """An extracted (string) cell value as a number, bool, error or string"""
+    if text is None:
+        return None
+    if text and text[0] in '0123456789+-.':
+        number = parse_number(text)
+        if number is not None:
+            return number
+    if text in ('True', 'False'):
+        return text == 'True'
+    if text in ERROR_CODES:
+        return XLError(text)
+    return text
+
+
+def cell_text(value):
+    """A result as the extraction stores values: the way openpyxl reads what Excel caches"""
+    if type(value) is XLError:
+        return value.code
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return str(value)
+
+
+# Coercions and operators, Excel style
+
+def _scalar(value):
+    if isinstance(value, RangeValue):
+        # A single-cell range stands for its cell; anything larger needs an array formula
+        if len(value) != 1:
+            raise XLError('#VALUE!')
+        value = value.columns[0][0]
+        if type(value) is XLError:
+            raise XLError(value.code)
+    return value
+
+
+def _number(value):
+    if type(value) in (int, float):
+        return value
+    value = _scalar(value)
+    if value is None:
+        return 0
+    if isinstance(value, (bool, int, float)):
+        return int(value) if isinstance(value, bool) else value
+    if FLOAT_PATTERN.match(value.strip()):
+        return float(value)
+    raise XLError('#VALUE!')
+
+
+def _text(value):
+    value = _scalar(value)
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        return cell_text(value) if value.is_integer() else format(value, '.15g').upper()
+    return str(value)
+
+
+def _truth(value):
+    value = _scalar(value)
+    if value is None:
+        return False
+    if isinstance(value, str):
+        if value.upper() in ('TRUE', 'FALSE'):
+            return value.upper() == 'TRUE'
+        raise XLError('#VALUE!')
+    return bool(value)
+
+
+def _checked(result):
+    if math.isinf(result) or math.isnan(result):
+        raise XLError('#NUM!')
+    return result
+
+
+def _add(a, b):
+    return _number(a) + _number(b)
+
+
+def _subtract(a, b):
+    return _number(a) - _number(b)
+
+
+def _multiply(a, b):
+    return _checked(_number(a) * _number(b))
+
+
+def _divide(a, b):
+    divisor = _number(b)
+    if divisor == 0:
+        raise XLError('#DIV/0!')
+    return _checked(_number(a) / divisor)
+
+
+def _power(a, b):
+    base, exponent = _number(a), _number(b)
+    if base == 0 and exponent < 0:
+        raise XLError('#DIV/0!')
+    try:
+        return _checked(math.pow(base, exponent))
+    except (ValueError, OverflowError):
+        raise XLError('#NUM!')
+
+
+def _concat(a, b):
+    return _text(a) + _text(b)
+
+
+def _rank(value):
+    # Excel orders numbers before text before booleans; text compares case-insensitively
+    if isinstance(value, bool):
+        return (2, value)
+    if isinstance(value, str):
+        return (1, value.lower())
+    return (0, value)
+
+
+def _compare(compare):
+    def apply(a, b):
+        a, b = _scalar(a), _scalar(b)
+        # An empty cell is 0, "" or FALSE, whichever the other side is
+        if a is None:
+            a = b.__class__() if isinstance(b, (str, bool)) else 0
+        if b is None:
+            b = a.__class__() if isinstance(a, (str, bool)) else 0
+        return compare(_rank(a), _rank(b))
+    return apply
+
+
+BINARY_OPS = {'+': _add, '-': _subtract, '*': _multiply, '/': _divide, '^': _power, '&': _concat}
+BINARY_OPS.update({op: _compare(compare) for op, compare in COMPARISON_OPS.items()})
+PRECEDENCE = {'&': 2, '+': 3, '-': 3, '*': 4, '/': 4, '^': 5}
+PRECEDENCE.update({op: 1 for op in COMPARISON_OPS})
+
+
+# Functions; each takes its argument thunks, so IF and friends evaluate only what they need
+
+def _numbers(args):
+    """The numbers among function arguments: a range's numeric cells, scalar arguments coerced"""
+    arrays, scalars = [], []
+    for arg in args:
+        value = arg()
+        if isinstance(value, RangeValue):
+            if value.error is not None:
+                raise XLError(value.error.code)
+            arrays.append(value.numbers)
+        else:
+            scalars.append(_number(value))
+    if scalars:
+        arrays.append(np.array(scalars, dtype=float))
+    return np.concatenate(arrays) if len(arrays) > 1 else (arrays[0] if arrays else np.empty(0))
+
+
+def _sum(args):
+    return _checked(float(np.sum(_numbers(args))))
+
+
+def _average(args):
+    numbers = _numbers(args)
+    if not numbers.size:
+        raise XLError('#DIV/0!')
+    return _checked(float(np.mean(numbers)))
+
+
+def _min(args):
+    numbers = _numbers(args)
+    return float(np.min(numbers)) if numbers.size else 0
+
+
+def _max(args):
+    numbers = _numbers(args)
+    return float(np.max(numbers)) if numbers.size else 0
+
+
+def _count(args):
+    count = 0
+    for arg in args:
+        try:
+            value = arg()
+        except XLError:
+            continue
+        if isinstance(value, RangeValue):
+            count += value.numbers.size
+        elif value is not None and not isinstance(value, str):
+            count += 1
+        elif isinstance(value, str) and FLOAT_PATTERN.match(value.strip()):
+            count += 1
+    return count
+
+
+def _counta(args):
+    count = 0
+    for arg in args:
+        try:
+            value = arg()
+        except XLError:
+            count += 1
+            continue
+        if isinstance(value, RangeValue):
+            count += sum(1 for cell in value.values() if cell is not None)
+        elif value is not None:
+            count += 1
+    return count
+
+
+def _arity(name, args, least, most):
+    if not least <= len(args) <= most:
+        raise FormulaError(f"{name} takes {least} to {most} arguments")
+
+
+def _if(args):
+    _arity('IF', args, 2, 3)
+    if _truth(args[0]()):
+        return args[1]()
+    return args[2]() if len(args) == 3 else False
+
+
+def _iferror(args):
+    _arity('IFERROR', args, 2, 2)
+    try:
+        return _scalar(args[0]())
+    except XLError:
+        return args[1]()
+
+
+def _logical(args):
+    values = []
+    for arg in args:
+        value = arg()
+        if isinstance(value, RangeValue):
+            if value.error is not None:
+                raise XLError(value.error.code)
+            values += [bool(cell) for cell in value.values() if cell is not None and not isinstance(cell, str)]
+        elif value is not None:
+            values.append(_truth(value))
+    if not values:
+        raise XLError('#VALUE!')
+    return values
+
+
+def _and(args):
+    return all(_logical(args))
+
+
+def _or(args):
+    return any(_logical(args))
+
+
+def _not(args):
+    _arity('NOT', args, 1, 1)
+    return not _truth(args[0]())
+
+
+def _round(args):
+    _arity('ROUND', args, 1, 2)
+    number = _number(args[0]())
+    digits = int(_number(args[1]())) if len(args) == 2 else 0
+    # Halves round away from zero, on the decimal value shown rather than the binary one
+    rounded = Decimal(repr(float(number))).quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP)
+    return float(rounded)
+
+
+def _abs(args):
+    _arity('ABS', args, 1, 1)
+    return abs(_number(args[0]()))
+
+
+def _approximate_row(table, value):
+    """Last row whose first-column value is <= value, as Excel's sorted lookup finds it"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        rows = np.flatnonzero(table.grid[:, 0] <= value)
+        return int(rows[-1]) if rows.size else None
+    if isinstance(value, str):
+        keys = [(row, cell.lower()) for row, cell in enumerate(table.columns[0]) if isinstance(cell, str)]
+        position = bisect_right([key for _, key in keys], value.lower())
+        return keys[position - 1][0] if position else None
+    return table.first_match(value)
+
+
+def _wildcard_row(table, pattern):
+    """First row whose first-column text matches pattern (* and ?, ~ escaping them)"""
+    parts = []
+    escaped = False
+    for char in pattern:
+        if escaped or char not in '*?~':
+            parts.append(re.escape(char))
+            escaped = False
+        elif char == '~':
+            escaped = True
+        else:
+            parts.append('.*' if char == '*' else '.')
+    regex = re.compile(''.join(parts), re.IGNORECASE | re.DOTALL)
+    return next((row for row, cell in enumerate(table.columns[0])
+                 if isinstance(cell, str) and regex.fullmatch(cell)), None)
+
+
+def _isblank(args):
+    _arity('ISBLANK', args, 1, 1)
+    try:
+        return _scalar(args[0]()) is None
+    except XLError:
+        return False
+
+
+def _vlookup(args):
+    _arity('VLOOKUP', args, 3, 4)
+    value = _scalar(args[0]())
+    table = args[1]()
+    if not isinstance(table, RangeValue):
+        raise XLError('#N/A')
+    column = int(_number(args[2]()))
+    approximate = _truth(args[3]()) if len(args) == 4 else True
+    if column < 1:
+        raise XLError('#VALUE!')
+    if column > len(table.columns):
+        raise XLError('#REF!')
+    if value is None:
+        raise XLError('#N/A')
+
+    if approximate:
+        row = _approximate_row(table, value)
+    elif isinstance(value, str) and ('*' in value or '?' in value):
+        row = _wildcard_row(table, value)
+    else:
+        row = table.first_match(value)
+    if row is None:
+        raise XLError('#N/A')
+
+    result = table.columns[column - 1][row]
+    if type(result) is XLError:
+        raise XLError(result.code)
+    return 0 if result is None else result
+
+
+FUNCTIONS = {
+    'SUM': _sum, 'AVERAGE': _average, 'MIN': _min, 'MAX': _max, 'COUNT': _count, 'COUNTA': _counta,
+    'IF': _if, 'IFERROR': _iferror, 'AND': _and, 'OR': _or, 'NOT': _not,
+    'ROUND': _round, 'ABS': _abs, 'ISBLANK': _isblank, 'VLOOKUP': _vlookup,
+}
+
+
+def tokenize(formula):
+    """[(kind, text)] of a formula, with or without its leading '='"""
+    text = formula[1:] if formula.startswith('=') else formula
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if not match:
+            raise FormulaError(f"Can't parse formula at: {text[position:position + 20]}")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+def referenced_sheets(formula):
+    """Names of the sheets a formula refers to explicitly (Sheet2!A1, 'My sheet'!B2)"""
+    return {(quoted.replace("''", "'") if quoted else plain)
+            for quoted, plain in SHEET_PREFIX_PATTERN.findall(formula)}
+
+
+class _Parser:
+    """
+    Precedence climbing over a formula's tokens, building closures. Precedence, loosest
+    first: comparisons, &, + -, * /, ^, unary minus, %; binary operators are left-associative.
+    """
+
+    def __init__(self, evaluator, sheet_name, tokens):
+        self.evaluator = evaluator
+        self.sheet_name = sheet_name
+        self.tokens = tokens
+        self.position = 0
+        # (sheet, min_row, min_col, max_row, max_col) of every reference
+        self.refs = []
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, text):
+        kind, token = self.take()
+        if kind != 'op' or token != text:
+            raise FormulaError(f"Expected '{text}'")
+
+    def parse(self):
+        node = self.binary()
+        if self.position != len(self.tokens):
+            raise FormulaError(f"Unexpected '{self.peek()[1]}'")
+        return node
+
+    def binary(self, least=1):
+        node = self.unary()
+        while True:
+            kind, token = self.peek()
+            precedence = PRECEDENCE.get(token) if kind == 'op' else None
+            if precedence is None or precedence < least:
+                return node
+            self.take()
+            right = self.binary(precedence + 1)
+            node = (lambda operation, left, right: lambda: operation(left(), right()))(BINARY_OPS[token], node, right)
+
+    def unary(self):
+        kind, token = self.peek()
+        if kind == 'op' and token in ('-', '+'):
+            self.take()
+            operand = self.unary()
+            return (lambda: -_number(operand())) if token == '-' else (lambda: _number(operand()))
+        node = self.primary()
+        while self.peek() == ('op', '%'):
+            self.take()
+            node = (lambda inner: lambda: _number(inner()) / 100)(node)
+        return node
+
+    def primary(self):
+        kind, token = self.take()
+        if kind == 'number':
+            value = int(token) if token.isdigit() else float(token)
+            return lambda: value
+        if kind == 'string':
+            value = token[1:-1].replace('""', '"')
+            return lambda: value
+        if kind == 'bool':
+            value = token.upper() == 'TRUE'
+            return lambda: value
+        if kind == 'error':
+            code = token.upper()
+            def error():
+                raise XLError(code)
+            return error
+        if kind in ('cells', 'columns'):
+            return self.reference(kind, token)
+        if kind == 'function':
+            return self.function(token)
+        if (kind, token) == ('op', '('):
+            node = self.binary()
+            self.expect(')')
+            return node
+        raise FormulaError(f"Unexpected '{token}'" if token else "Unexpected end of formula")
+
+    def reference(self, kind, token):
+        evaluator = self.evaluator
+        sheet_name, bounds, single = evaluator.resolve(self.sheet_name, kind, token)
+        self.refs.append((sheet_name,) + bounds)
+        if single:
+            row, col = bounds[:2]
+            return lambda: evaluator.value(sheet_name, row, col)
+        return lambda: evaluator.range(sheet_name, bounds)
+
+    def function(self, name):
+        name = name.upper()
+        if name.startswith('_XLFN.'):
+            name = name[len('_XLFN.'):]
+        function = FUNCTIONS.get(name)
+        if function is None:
+            raise FormulaError(f"Unsupported function: {name}")
+
+        self.expect('(')
+        args = []
+        if self.peek() != ('op', ')'):
+            while True:
+                # An omitted argument (IF(A1,,1)) reads as an empty cell
+                args.append((lambda: None) if self.peek() in (('op', ','), ('op', ')')) else self.binary())
+                if self.peek() != ('op', ','):
+                    break
+                self.take()
+        self.expect(')')
+        return lambda: function(args)
+
+
+class WorkbookEvaluator:
+    """
+    Reads cell values from an extraction for formulas. Each sheet is read once, into
+    typed values per column with their numbers in numpy arrays, so a range is a few
+    array slices; ranges are memoized, as are the results stored back as they're computed.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.sheet_names = {name.lower(): name for name in data if name != 'schema'}
+        self._columns = {}
+        self._max_rows = {}
+        self._ranges = OrderedDict()
+
+    def compile(self, sheet_name, formula):
+        """(closure computing the formula's value, references it reads); FormulaError if unsupported"""
+        parser = _Parser(self, sheet_name, tokenize(formula))
+        return parser.parse(), parser.refs
+
+    def references(self, sheet_name, formula):
+        """The (sheet, min_row, min_col, max_row, max_col) a formula reads, without compiling it"""
+        refs = []
+        for kind, token in tokenize(formula):
+            if kind in ('cells', 'columns'):
+                ref_sheet, bounds, _ = self.resolve(sheet_name, kind, token)
+                refs.append((ref_sheet,) + bounds)
+        return refs
+
+    def resolve(self, sheet_name, kind, token):
+        """(sheet, (min_row, min_col, max_row, max_col), single cell?) of a reference token"""
+        sheet_part, _, ref = token.rpartition('!')
+        if sheet_part:
+            # Sheets are named case-insensitively
+            quoted = sheet_part.startswith("'")
+            name = sheet_part[1:-1].replace("''", "'") if quoted else sheet_part
+            sheet_name = self.sheet_names.get(name.lower())
+            if sheet_name is None:
+                raise FormulaError(f"Unknown sheet: {name}")
+
+        start, _, end = ref.partition(':')
+        if kind == 'columns':
+            first, last = column_index(start.replace('$', '')), column_index(end.replace('$', ''))
+            return sheet_name, (1, min(first, last), self.max_row(sheet_name), max(first, last)), False
+        (first_row, first_col), (last_row, last_col) = parse_cell(start), parse_cell(end or start)
+        bounds = (min(first_row, last_row), min(first_col, last_col), max(first_row, last_row), max(first_col, last_col))
+        return sheet_name, bounds, not end
+
+    def columns(self, sheet_name):
+        """A sheet's cells as {column index: _Column}; a merged range's value is at its top-left cell"""
+        columns = self._columns.get(sheet_name)
+        if columns is None:
+            by_column = {}
+            for key, cell in self.data[sheet_name].items():
+                row, col = cell_position(key)
+                by_column.setdefault(col, []).append((row, cell[0]))
+            columns = self._columns[sheet_name] = {}
+            for col, cells in by_column.items():
+                values = [None] * (max(row for row, _ in cells) + 1)
+                for row, text in cells:
+                    values[row] = _typed(text)
+                columns[col] = _Column(values)
+        return columns
+
+    def max_row(self, sheet_name):
+        """Last row holding a value, where whole-column references end"""
+        if sheet_name not in self._max_rows:
+            self._max_rows[sheet_name] = max((len(column.values) - 1 for column in self.columns(sheet_name).values()),
+                                             default=1)
+        return self._max_rows[sheet_name]
+
+    def value(self, sheet_name, row, col):
+        column = self.columns(sheet_name).get(col)
+        value = column.values[row] if column is not None and row < len(column.values) else None
+        if type(value) is XLError:
+            raise XLError(value.code)
+        return value
+
+    def store(self, sheet_name, row, col, value):
+        """Record a computed value; its cell is in the extraction, so its column exists once read"""
+        columns = self._columns.get(sheet_name)
+        if columns is not None:
+            columns[col].set(row, value)
+
+    def range(self, sheet_name, bounds):
+        key = (sheet_name, bounds)
+        value = self._ranges.get(key)
+        if value is not None:
+            self._ranges.move_to_end(key)
+        else:
+            min_row, min_col, max_row, max_col = bounds
+            height, width = max_row - min_row + 1, max_col - min_col + 1
+            if height * width > MAX_RANGE_CELLS:
+                raise FormulaError(f"Range too large: {height} x {width} cells")
+
+            sheet_columns = self.columns(sheet_name)
+            sources = [sheet_columns.get(col) for col in range(min_col, max_col + 1)]
+            grid = np.full((height, width), math.nan)
+            error = None
+            for index, column in enumerate(sources):
+                if column is None:
+                    continue
+                numbers = column.numbers[min_row:max_row + 1]
+                grid[:len(numbers), index] = numbers
+                errors = np.flatnonzero(column.errors[min_row:max_row + 1])
+                if error is None and errors.size:
+                    error = column.values[min_row + errors[0]]
+            value = self._ranges[key] = RangeValue(sources, min_row, grid, error)
+            if len(self._ranges) > RANGE_CACHE_SIZE:
+                self._ranges.popitem(last=False)
+        return value
+
+
+def _evaluation_order(dependencies):
+    """Indices of the formulas with each one after its dependencies; those on a cycle are left out"""
+    dependents = [[] for _ in dependencies]
+    waiting = [len(depends_on) for depends_on in dependencies]
+    for index, depends_on in enumerate(dependencies):
+        for other in depends_on:
+            dependents[other].append(index)
+
+    ready = deque(index for index, count in enumerate(waiting) if count == 0)
+    order = []
+    while ready:
+        index = ready.popleft()
+        order.append(index)
+        for dependent in dependents[index]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+    return order
+
+
+def evaluate_missing(data):
+    """
+    Compute every formula cell of an extraction ({'schema', sheet: {key: [value, formula]}})
+    whose value is None, in place. Cells that can't be evaluated (see the module
+    docstring) are removed, as the extraction leaves out cells without a value.
+    Returns {'evaluated': count, 'failed': count}.
+    """
+    pending = []
+    for sheet_name, cells in data.items():
+        if sheet_name == 'schema':
+            continue
+        for key, (value, formula) in cells.items():
+            if value is None and formula:
+                row, col = cell_position(key)
+                pending.append((sheet_name, key, formula, row, col))
+    if not pending:
+        return {'evaluated': 0, 'failed': 0}
+    return _evaluate(data, pending)
+
+
+def _evaluate(data, pending):
+    """evaluate_missing() for the pending [(sheet, key, formula, row, col)] formula cells"""
+    evaluator = WorkbookEvaluator(data)
+    # Only the references for now: each formula is compiled when its turn comes, so
+    # thousands of compiled formulas are never held at once
+    references = []
+    failed = set()
+    for index, (sheet_name, _, formula, _, _) in enumerate(pending):
+        try:
+            references.append(evaluator.references(sheet_name, formula))
+        except FormulaError:
+            references.append(())
+            failed.add(index)
+
+    # Pending cells by sheet and column, as sorted rows and their indices, to find the
+    # ones a range covers
+    located = {}
+    for index, (sheet_name, _, _, row, col) in enumerate(pending):
+        located.setdefault(sheet_name, {}).setdefault(col, []).append((row, index))
+    for columns in located.values():
+        for col, cells in columns.items():
+            cells.sort()
+            columns[col] = ([row for row, _ in cells], [index for _, index in cells])
+
+    dependencies = []
+    for refs in references:
+        depends_on = set()
+        for sheet_name, min_row, min_col, max_row, max_col in refs:
+            columns = located.get(sheet_name, {})
+            for col in (range(min_col, max_col + 1) if max_col - min_col < len(columns) else columns):
+                if col in columns and min_col <= col <= max_col:
+                    rows, indices = columns[col]
+                    depends_on.update(indices[bisect_left(rows, min_row):bisect_right(rows, max_row)])
+        # Most formulas depend on a handful of cells; a tuple is a fraction of a set's size
+        dependencies.append(tuple(depends_on))
+    del references, located
+
+    order = _evaluation_order(dependencies)
+    failed.update(set(range(len(pending))) - set(order))
+
+    evaluated = 0
+    for index in order:
+        if index in failed:
+            continue
+        sheet_name, key, formula, row, col = pending[index]
+        if any(other in failed for other in dependencies[index]):
+            failed.add(index)
+            continue
+        try:
+            value = _scalar(evaluator.compile(sheet_name, formula)[0]())
+        except XLError as error:
+            value = error
+        except (FormulaError, ArithmeticError, ValueError, TypeError):
+            failed.add(index)
+            continue
+        if value is None:
+            value = 0
+        evaluator.store(sheet_name, row, col, value)
+        data[sheet_name][key] = [cell_text(value), formula]
+        evaluated += 1
+
+    for index in failed:
+        sheet_name, key = pending[index][:2]
+        del data[sheet_name][key]
+    return {'evaluated': evaluated, 'failed': len(failed)}
@@ -1,155 +1,413 @@
-import requests
 import json
 import os
+import threading
+import time
+import metrics
+from file_delivery import atomic_output
+from model_router import DEFAULT_MODEL, choose_model, estimate_tokens, model_stats
+from xl_json_helper import group_cells_by_style, parse_range
+from table_detect import all_tables, cells_outside_tables
+from compact_data import json_default
 
 api_key = os.getenv("DMG_API_KEY")
+# Chat-completions endpoint; point it at a local stub for load tests (see load_test.py)
+api_url = os.getenv("LLM_API_URL", "https://dmg-stg.dcai.corp.adobe.com/chat/completions")
 
+# Running token totals per model, updated after every call; concurrent requests
+# update it one at a time, and readers never see a half-written file
+USAGE_FILE = 'token_usage.json'
+_usage_lock = threading.Lock()
 
-def make_llm_call(prompt):
-    url = "https://dmg-stg.dcai.corp.adobe.com/chat/completions"
+# Cells listed per style in the prompt; the style table itself is always complete
+MAX_STYLE_CELLS_IN_PROMPT = 200
+
+ANSWER_INSTRUCTIONS = """Instructions:
+- Analyze the Excel data and answer the user's question.
+- When cell styles are given, use them to identify cells by formatting (e.g. "the red cells") and present values with their number format (e.g. 0.25 with 0.00% as 25.00%).
+- If multiple insights or observations are relevant, list each separately.
+- Each answer should include an "answer" field with plain text (no markdown), and if applicable, an "attribution" field listing all relevant cell coordinates.
+- The response must be a valid JSON array of objects.
+- Use this exact format for each item:
+[
+  {
+    "answer": "A detailed summary/insight about the findings in plain text"
+  },
+  {
+    "answer": "First insight here in plain text",
+    "attribution": ["sheet_name", "cell1", "cell2"]
+  }
+]
+
+- If attribution is not applicable, only include the "answer" field for that item.
+- Do not use markdown formatting or backticks in the response.
+- The output must be directly usable as JSON.
+- Return only the JSON array, nothing else."""
+
+
+def make_llm_call(prompt, model=None):
+    return make_chat_call([{"role": "user", "content": prompt}], model)
+
+
+def make_chat_call(messages, model=None):
+    # Imported here so importing this module (e.g. for prompt building) stays cheap
+    import requests
+
+    url = api_url
     headers = {
         "api-key": api_key,
         "Content-Type": "application/json"
     }
     data = {
-        "model": "gpt-4o-mini",
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ],
+        "model": model or DEFAULT_MODEL,
+        "messages": messages,
         "max_tokens": 4000
     }
     
-    response = requests.post(
-        url,
-        headers=headers,
-        json=data
-    )
-    
-    response_json = response.json()
+    start = time.perf_counter()
+    try:
+        response = requests.post(
+            url,
+            headers=headers,
+            json=data
+        )
+        response_json = response.json()
+    except Exception:
+        model_stats.record(data['model'], time.perf_counter() - start, ok=False)
+        raise
+    elapsed = time.perf_counter() - start
     
     # Extract token usage information and write to JSON file
     if 'usage' in response_json:
         usage = response_json['usage']
         model = data['model']  # Get current model from request data
+        model_stats.record(model, elapsed, usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+
+        metrics.record_prompt_tokens(usage.get('prompt_tokens', 0), model)
+        metrics.record_prompt_cache(cached_prompt_tokens(usage), usage.get('prompt_tokens', 0), model)
 
         print(f"Token Usage:")
-        print(f"  Prompt tokens: {usage.get('prompt_tokens', 'N/A')}")
+        print(f"  Prompt tokens: {usage.get('prompt_tokens', 'N/A')} ({cached_prompt_tokens(usage)} cached)")
         print(f"  Completion tokens: {usage.get('completion_tokens', 'N/A')}")
         print(f"  Total tokens: {usage.get('total_tokens', 'N/A')}")
+
+        # Bookkeeping only: a failure here must not lose the answer
+        try:
+            record_token_usage(model, usage)
+        except Exception as e:
+            print(f"Warning: Could not update {USAGE_FILE}: {e}")
         
+        # Add usage info to the response for API consumers
+        # response_json['token_usage'] = {
+        #     'prompt_tokens': usage.get('prompt_tokens', 0),
+        #     'completion_tokens': usage.get('completion_tokens', 0),
+        #     'total_tokens': usage.get('total_tokens', 0)
+        # }
+    else:
+        model_stats.record(data['model'], elapsed, ok='choices' in response_json)
+        print("No usage information available in response")
+    
+    return response_json
+
+
+def record_token_usage(model, usage):
+    """Add a call's prompt and completion tokens to the model's totals in USAGE_FILE"""
+    with _usage_lock:
         # Load existing usage data if file exists
-        usage_file = 'token_usage.json'
-        if os.path.exists(usage_file):
-            with open(usage_file, 'r') as f:
+        if os.path.exists(USAGE_FILE):
+            with open(USAGE_FILE, 'r') as f:
                 all_models_usage = json.load(f)
         else:
             all_models_usage = {}
-            
+
         # Initialize model usage if not exists
         if model not in all_models_usage:
             all_models_usage[model] = {
                 'prompt_tokens': 0,
                 'completion_tokens': 0
             }
-            
+
         # Update usage for current model
         all_models_usage[model]['prompt_tokens'] += usage.get('prompt_tokens', 0)
         all_models_usage[model]['completion_tokens'] += usage.get('completion_tokens', 0)
-        
+
         # Write updated usage to file
-        with open(usage_file, 'w') as f:
-            json.dump(all_models_usage, f, indent=2)
-        
-        # Add usage info to the response for API consumers
-        # response_json['token_usage'] = {
-        #     'prompt_tokens': usage.get('prompt_tokens', 0),
-        #     'completion_tokens': usage.get('completion_tokens', 0),
-        #     'total_tokens': usage.get('total_tokens', 0)
-        # }
-    else:
-        print("No usage information available in response")
-    
-    return response_json
+        with atomic_output(USAGE_FILE) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(all_models_usage, f, indent=2)
 
-def analyze_excel_data(excel_data, question):
+
+def cached_prompt_tokens(usage):
+    """Prompt tokens the provider served from its prompt cache (0 when it doesn't report any)"""
+    details = usage.get('prompt_tokens_details') or {}
+    return details.get('cached_tokens') or 0
+
+def build_style_section(style_info):
+    """Prompt section describing cell formatting, or '' when the workbook has none worth noting"""
+    if not style_info or not style_info.get('styles'):
+        return ''
+    grouped = group_cells_by_style(style_info, MAX_STYLE_CELLS_IN_PROMPT)
+    return f"""
+Cell Styles (JSON format):
+"styles" maps a style ID to its formatting (font, fill color as RRGGBB, number_format); "cells" lists the cells using each style ID per sheet. Cells not listed have default formatting.
+{json.dumps({'styles': style_info['styles'], 'cells': grouped}, separators=(',', ':'))}
+"""
+
+def build_drawing_section(drawings):
+    """Prompt section listing charts and images with where they sit, or '' when there are none"""
+    if not drawings:
+        return ''
+    items = []
+    for sheet_info in drawings.get('charts', {}).get('charts', []):
+        for chart in sheet_info['charts_on_sheet']:
+            items.append({
+                'sheet': sheet_info['sheet_name'],
+                'chart': chart.get('type'),
+                'title': chart.get('title'),
+                'coords': chart.get('coords'),
+                'series': [
+                    {key: series[key] for key in ('title', 'title_ref', 'categories_ref', 'values_ref') if series.get(key)}
+                    for series in chart.get('series', [])
+                ],
+            })
+    for sheet_info in drawings.get('images', {}).get('images', []):
+        for image in sheet_info['images_on_sheet']:
+            items.append({
+                'sheet': sheet_info['sheet_name'],
+                'image': image.get('filename'),
+                'description': image.get('description') or image.get('name'),
+                'coords': image.get('coords'),
+            })
+    if not items:
+        return ''
+    return f"""
+Charts and Images (JSON format):
+Each entry gives the sheet and the cell range the object covers; chart series list the cell ranges they plot.
+{json.dumps(items, separators=(',', ':'))}
+"""
+
+def compact_table(table):
+    """A table as prompt rows: [row_number, value per column], plus its formulas by column"""
+    rows = [
+        [table['first_row'] + i] + [column[i] for column in table['values']]
+        for i in range(table['row_count'])
+    ]
+    entry = {
+        'sheet': table['sheet'],
+        'range': table['range'],
+        'columns': [
+            {'column': letter, 'header': header, 'type': kind}
+            for letter, header, kind in zip(table['columns'], table['headers'], table['types'])
+        ],
+        'rows': rows,
+    }
+    formulas = {
+        letter: {table['first_row'] + i: formula for i, formula in enumerate(column) if formula}
+        for letter, column in zip(table['columns'], table['formulas']) if column
+    }
+    if formulas:
+        entry['formulas'] = formulas
+    return entry
+
+
+def build_data_section(excel_data, tables=None):
+    """
+    The workbook content: detected tables in compact row form plus the remaining cells,
+    or the plain extraction when there are no tables
+    """
+    found = all_tables(tables) if tables else []
+    if not found:
+        return f"""Excel Data (JSON format):
+{json.dumps(excel_data, indent=2, default=json_default)}
+"""
+    return f"""Excel Tables (JSON format):
+Each table lists its columns (column letter, header, type). Every row is [row_number, one value per column]; the cell holding a value is its column letter followed by the row number. "formulas" maps a column letter to {{row_number: formula}} for calculated cells.
+{json.dumps([compact_table(table) for table in found], separators=(',', ':'), ensure_ascii=False)}
+
+Other Cells (JSON format, cells outside the tables as {{sheet: {{coordinate: [value, formula]}}}}):
+{json.dumps(cells_outside_tables(excel_data, tables), separators=(',', ':'), ensure_ascii=False)}
+"""
+
+
+def build_analysis_prompt(excel_data, question, style_info=None, drawings=None, tables=None):
+    """Build the structured analysis prompt for a question about extracted Excel data"""
+    return f"""
+You are an expert at analyzing Excel spreadsheet data. Below is the extracted content from an Excel file in JSON format, followed by a user's question.
+
+{build_data_section(excel_data, tables)}{build_style_section(style_info)}{build_drawing_section(drawings)}
+User Question: {question}
+
+{ANSWER_INSTRUCTIONS}
+
+Answer:
+"""
+
+def build_context_prefix(excel_data, style_info=None, drawings=None, tables=None):
+    """
+    System message opening every conversation about a workbook: the fixed instructions,
+    then the workbook content. It depends on nothing but the file, so it is byte-identical
+    across questions and sessions and the provider's prompt cache can reuse it.
+    """
+    return f"""You are an expert at analyzing Excel spreadsheet data. Below is the extracted content from an Excel file in JSON format. The user will ask questions about it; earlier questions and answers of the conversation may precede the latest question.
+
+{ANSWER_INSTRUCTIONS}
+
+{build_data_section(excel_data, tables)}{build_style_section(style_info)}{build_drawing_section(drawings)}"""
+
+
+def build_session_messages(context_prefix, question, history=(), summary=None):
+    """
+    Chat messages for a question in a conversation: the cacheable context prefix, a
+    summary of older turns, the recent turns verbatim and finally the new question
+    """
+    messages = [{"role": "system", "content": context_prefix}]
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of earlier questions in this conversation:\n{summary}"})
+    for turn in history:
+        messages.append({"role": "user", "content": turn['question']})
+        messages.append({"role": "assistant", "content": turn['answer']})
+    messages.append({"role": "user", "content": question})
+    return messages
+
+
+def attributed_cells(answer, sheet_names, default_sheet, skipped=None):
+    """
+    Collect the cells an answer attributes, as {sheet_name: [cell_or_range]} in order of
+    first mention. An attribution is ["sheet_name", "cell1", ...]; without a leading sheet
+    name its cells belong to default_sheet, and 'Sheet!A1' references name their own.
+    Cells on a sheet that isn't in sheet_names are left out, and appended to `skipped`
+    (as 'Sheet!A1') when a list is given.
+    """
+    sheets_by_lower = {name.lower(): name for name in sheet_names}
+    default_sheet = sheets_by_lower.get(default_sheet.lower(), default_sheet) if default_sheet else default_sheet
+    cells = {}
+    if not isinstance(answer, list):
+        return cells
+    for item in answer:
+        attribution = item.get('attribution') if isinstance(item, dict) else None
+        if not isinstance(attribution, list) or not attribution:
+            continue
+        refs = [str(ref).strip() for ref in attribution if ref]
+        sheet_name = default_sheet
+        if refs and refs[0].lower() in sheets_by_lower:
+            sheet_name = sheets_by_lower[refs.pop(0).lower()]
+        for ref in refs:
+            try:
+                ref_sheet, min_row, min_col, max_row, max_col = parse_range(ref)
+            except ValueError:
+                continue
+            target = sheets_by_lower.get(ref_sheet.lower(), ref_sheet) if ref_sheet else sheet_name
+            address = ref.rsplit('!', 1)[-1].replace('$', '').upper()
+            if target not in sheets_by_lower.values():
+                if skipped is not None and f"{target}!{address}" not in skipped:
+                    skipped.append(f"{target}!{address}")
+                continue
+            sheet_cells = cells.setdefault(target, [])
+            if address not in sheet_cells:
+                sheet_cells.append(address)
+    return cells
+
+
+def _parse_answer(llm_response):
+    """Turn an LLM response into the analyze_* result dict"""
+    raw_answer = llm_response['choices'][0]['message']['content']
+
+    # Try to parse the response as JSON
+    try:
+        with metrics.stage('parse'):
+            parsed_answer = json.loads(raw_answer.strip())
+        print(parsed_answer)
+        return {
+            'success': True,
+            'answer': parsed_answer,
+            'raw_response': raw_answer,
+            'error': None
+        }
+    except json.JSONDecodeError:
+        # If JSON parsing fails, return raw text
+        print("JSON parsing failed")
+        print(raw_answer)
+        return {
+            'success': True,
+            'answer': raw_answer,
+            'raw_response': raw_answer,
+            'error': 'Response was not in expected JSON format'
+        }
+
+
+def analyze_excel_data(excel_data, question, style_info=None, drawings=None, tables=None, model=None):
     """
     Analyze Excel data using LLM with structured prompt
     
     Args:
         excel_data (dict): The extracted Excel data in JSON format
         question (str): User's question about the data
+        style_info (dict): Optional style table and per-cell style IDs (see xl_extract.extract_style_info)
+        drawings (dict): Optional {'charts', 'images'} metadata (see xl_extract.extract_charts / extract_images)
+        tables (dict): Optional detected tables (see table_detect.detect_tables), sent in compact form
+        model (str): Optional model to use instead of the routed one (see model_router)
     
     Returns:
-        dict: Contains 'success', 'answer', 'raw_response', and 'error' fields
+        dict: Contains 'success', 'answer', 'raw_response', 'error' and 'routing' fields
     """
     try:
         # Create structured prompt
-        prompt = f"""
-You are an expert at analyzing Excel spreadsheet data. Below is the extracted content from an Excel file in JSON format, followed by a user's question.
+        with metrics.stage('prompt_build'):
+            prompt = build_analysis_prompt(excel_data, question, style_info, drawings, tables)
+        metrics.record_prompt_size(len(prompt))
+        routing = choose_model(estimate_tokens(len(prompt)), question, model)
+        
+        # Make LLM call
+        with metrics.stage('llm'):
+            llm_response = make_llm_call(prompt, routing['model'])
+        result = _parse_answer(llm_response)
+        result['routing'] = routing
+        return result
+            
+    except Exception as e:
+        return {
+            'success': False,
+            'answer': None,
+            'raw_response': None,
+            'error': f'Error in LLM analysis: {str(e)}'
+        }
 
-Excel Data (JSON format):
-{json.dumps(excel_data, indent=2)}
 
-User Question: {question}
+def analyze_in_session(context_prefix, question, history=(), summary=None, model=None, session_model=None):
+    """
+    Answer a question within a conversation (see build_session_messages), with the
+    conversation's model (session_model) unless model overrides it
 
-Instructions:
-- Analyze the Excel data and answer the user's question.
-- If multiple insights or observations are relevant, list each separately.
-- Each answer should include an "answer" field with plain text (no markdown), and if applicable, an "attribution" field listing all relevant cell coordinates.
-- The response must be a valid JSON array of objects.
-- Use this exact format for each item:
-[
-  {{
-    "answer": "A detailed summary/insight about the findings in plain text"
-  }},
-  {{
-    "answer": "First insight here in plain text",
-    "attribution": ["sheet_name", "cell1", "cell2"]
-  }}
-]
+    Returns:
+        dict: Like analyze_excel_data, plus 'usage' with the provider's token counts
+              ('prompt_tokens', 'cached_tokens', 'completion_tokens')
+    """
+    try:
+        with metrics.stage('prompt_build'):
+            messages = build_session_messages(context_prefix, question, history, summary)
+        prompt_size = sum(len(message['content']) for message in messages)
+        metrics.record_prompt_size(prompt_size)
+        routing = choose_model(estimate_tokens(prompt_size), question, model, session_model)
 
-- If attribution is not applicable, only include the "answer" field for that item.
-- Do not use markdown formatting or backticks in the response.
-- The output must be directly usable as JSON.
-- Return only the JSON array, nothing else.
+        with metrics.stage('llm'):
+            llm_response = make_chat_call(messages, routing['model'])
+        result = _parse_answer(llm_response)
+        result['routing'] = routing
+
+        usage = llm_response.get('usage') or {}
+        result['usage'] = {
+            'prompt_tokens': usage.get('prompt_tokens', 0),
+            'cached_tokens': cached_prompt_tokens(usage),
+            'completion_tokens': usage.get('completion_tokens', 0),
+        }
+        return result
 
-Answer:
-"""
-        
-        # Make LLM call
-        llm_response = make_llm_call(prompt)
-        raw_answer = llm_response['choices'][0]['message']['content']
-        
-        # Try to parse the response as JSON
-        try:
-            parsed_answer = json.loads(raw_answer.strip())
-            print(parsed_answer)
-            return {
-                'success': True,
-                'answer': parsed_answer,
-                'raw_response': raw_answer,
-                'error': None
-            }
-        except json.JSONDecodeError:
-            # If JSON parsing fails, return raw text
-            print("JSON parsing failed")
-            print(raw_answer)
-            return {
-                'success': True,
-                'answer': raw_answer,
-                'raw_response': raw_answer,
-                'error': 'Response was not in expected JSON format'
-            }
-            
     except Exception as e:
         return {
             'success': False,
             'answer': None,
             'raw_response': None,
-            'error': f'Error in LLM analysis: {str(e)}'
+            'error': f'Error in LLM analysis: {str(e)}',
+            'usage': None
         }
 
 def main():
@@ -0,0 +1,345 @@
+"""
+End-to-end load test for the backend API.
+
+Starts api_server in a child process whose LLM calls go to a local stub of the
+chat-completions API (LLM_API_URL), then drives realistic user sessions against it:
+
+    upload a workbook -> ask a question -> ask follow-ups in the same session
+    -> highlight the cells the answer attributed
+
+Workbooks come from the recorded corpus in Excel_files (each distinct original once).
+Each concurrency level runs the given number of sessions with that many concurrent
+users, and the report gives throughput plus p50/p95/p99 latency per endpoint.
+
+The stub answers after a log-normally distributed delay, reports prompt tokens from
+the request size (with the repeated system prefix of a session counted as cached) and
+fails a configurable share of requests, so error handling is exercised too.
+
+Usage: python load_test.py [--concurrency 1,2,4,8] [--sessions 16] [--followups 1]
+           [--corpus Excel_files] [--max-file-mb 5]
+           [--llm-latency-ms 800] [--llm-latency-sigma 0.5] [--llm-completion-tokens 300]
+           [--llm-error-rate 0.0] [--output results.json]
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(BACKEND_DIR, 'Excel_files')
+
+ENDPOINTS = ('upload', 'qna', 'qna_followup', 'highlight')
+QUESTIONS = [
+    'What is the total of the largest column?',
+    'Which rows have the highest values?',
+    'Summarize the main figures on the first sheet.',
+    'Why are some values higher than others, and how do they compare to the average?',
+]
+FOLLOWUPS = [
+    'And which of those is the smallest?',
+    'Show me the cells behind that number.',
+]
+
+# Runs api_server on a given port with the reaper off, serving into a scratch WOPI folder
+SERVER_CHILD = """
+import sys
+import api_server
+api_server.WOPI_PUBLIC_FOLDER = sys.argv[2]
+api_server.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)
+"""
+SERVER_START_TIMEOUT = 60
+
+
+class StubSettings:
+    def __init__(self, latency_ms, latency_sigma, completion_tokens, error_rate):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.seen_prefixes = set()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+
+def make_stub_handler(settings):
+    class ChatCompletionsStub(BaseHTTPRequestHandler):
+        """Answers POST /chat/completions like the provider, after a simulated delay"""
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            messages = body.get('messages') or [{'content': ''}]
+
+            # Log-normal delay with the configured mean
+            sigma = settings.latency_sigma
+            delay = settings.latency_ms / 1000 * random.lognormvariate(0, sigma) / math.exp(sigma * sigma / 2)
+            time.sleep(delay)
+
+            with settings.lock:
+                settings.requests += 1
+                failed = random.random() < settings.error_rate
+                if failed:
+                    settings.errors += 1
+                prefix = hashlib.sha256(messages[0]['content'].encode('utf-8')).hexdigest()
+                cached = prefix in settings.seen_prefixes
+                settings.seen_prefixes.add(prefix)
+
+            if failed:
+                self._send(500, {'error': {'message': 'stub: simulated provider error'}})
+                return
+
+            prompt_tokens = sum(len(message['content']) for message in messages) // 4 + 1
+            cached_tokens = len(messages[0]['content']) // 4 if cached and len(messages) > 1 else 0
+            answer = [
+                {'answer': 'Stub summary of the findings.'},
+                {'answer': 'Stub insight with attribution.', 'attribution': ['A1', 'B2:B4']},
+            ]
+            self._send(200, {
+                'model': body.get('model'),
+                'choices': [{'message': {'role': 'assistant', 'content': json.dumps(answer)}}],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': settings.completion_tokens,
+                    'total_tokens': prompt_tokens + settings.completion_tokens,
+                    'prompt_tokens_details': {'cached_tokens': cached_tokens},
+                },
+            })
+
+        def _send(self, status, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ChatCompletionsStub
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_stub(settings):
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), make_stub_handler(settings))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/chat/completions"
+
+
+def start_api_server(llm_url, work_dir):
+    """Run api_server in a child process (cwd work_dir, so uploads stay out of the repo)"""
+    port = free_port()
+    wopi_dir = os.path.join(work_dir, 'public')
+    os.makedirs(wopi_dir, exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, LLM_API_URL=llm_url, DISK_REAPER_INTERVAL_SECONDS='0',
+               PYTHONDONTWRITEBYTECODE='1')
+    log = open(os.path.join(work_dir, 'api_server.log'), 'w')
+    process = subprocess.Popen([sys.executable, '-c', SERVER_CHILD, str(port), wopi_dir],
+                               cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"api_server exited with code {process.returncode}; see {log.name}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).ok:
+                return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"api_server did not start within {SERVER_START_TIMEOUT}s; see {log.name}")
+
+
+def load_corpus(corpus_dir, max_file_mb):
+    """Distinct original workbooks in corpus_dir (uploads are stored as {file_id}_{name})"""
+    workbooks = {}
+    for entry in sorted(os.scandir(corpus_dir), key=lambda e: e.name):
+        if not entry.is_file() or not entry.name.endswith('.xlsx') or '_highlighted' in entry.name:
+            continue
+        name = entry.name[37:] if len(entry.name) > 37 and entry.name[36] == '_' else entry.name
+        if name not in workbooks and entry.stat().st_size <= max_file_mb * 1024 * 1024:
+            with open(entry.path, 'rb') as f:
+                workbooks[name] = f.read()
+    return sorted(workbooks.items())
+
+
+def attributed_ranges(answer):
+    """'A1,B2:B4' from the first attributed item of a /qna answer"""
+    for item in answer if isinstance(answer, list) else []:
+        attribution = item.get('attribution') if isinstance(item, dict) else None
+        if attribution:
+            return ','.join(attribution)
+    return 'A1'
+
+
+class Recorder:
+    """Latencies and error counts per endpoint for one concurrency level"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = {endpoint: 0 for endpoint in ENDPOINTS}
+
+    def timed(self, endpoint, send):
+        start = time.perf_counter()
+        try:
+            response = send()
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok:
+                self.errors[endpoint] += 1
+        return response if ok else None
+
+
+def run_session(base_url, workbook, followups, recorder, rng):
+    """One user: upload, question, follow-ups, highlight; stops at the first failed step"""
+    name, content = workbook
+    http = requests.Session()
+
+    response = recorder.timed('upload', lambda: http.post(
+        f"{base_url}/upload", files={'file': (name, content)}))
+    if response is None:
+        return False
+    upload = response.json()
+    file_id = upload['file_id']
+    sheets = upload['extraction']['refreshed'] + upload['extraction']['reused']
+
+    response = recorder.timed('qna', lambda: http.post(
+        f"{base_url}/qna", json={'file_id': file_id, 'question': rng.choice(QUESTIONS)}))
+    if response is None:
+        return False
+    result = response.json()
+
+    for _ in range(followups):
+        response = recorder.timed('qna_followup', lambda: http.post(
+            f"{base_url}/qna", json={'session_id': result['session_id'], 'question': rng.choice(FOLLOWUPS)}))
+        if response is None:
+            return False
+        result = response.json()
+
+    body = {'file_id': file_id, 'sheet_name': sheets[0] if sheets else 'Sheet1',
+            'cell_ranges': attributed_ranges(result['answer'])}
+    response = recorder.timed('highlight', lambda: http.post(f"{base_url}/highlight", json=body))
+    return response is not None
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+
+def run_level(base_url, corpus, concurrency, sessions, followups, seed):
+    recorder = Recorder()
+    rngs = [random.Random(seed + i) for i in range(sessions)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        completed = list(pool.map(
+            lambda i: run_session(base_url, corpus[i % len(corpus)], followups, recorder, rngs[i]),
+            range(sessions)
+        ))
+    wall = time.perf_counter() - start
+
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        latencies = sorted(recorder.latencies[endpoint])
+        if not latencies:
+            continue
+        endpoints[endpoint] = {
+            'requests': len(latencies),
+            'errors': recorder.errors[endpoint],
+            'throughput_rps': round(len(latencies) / wall, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        }
+    return {
+        'concurrency': concurrency,
+        'sessions': sessions,
+        'completed_sessions': sum(completed),
+        'wall_seconds': round(wall, 2),
+        'sessions_per_second': round(sum(completed) / wall, 2),
+        'endpoints': endpoints,
+    }
+
+
+def print_level(level):
+    print(f"\nconcurrency {level['concurrency']}: {level['completed_sessions']}/{level['sessions']} sessions "
+          f"in {level['wall_seconds']}s ({level['sessions_per_second']} sessions/s)")
+    print(f"  {'endpoint':<14}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, row in level['endpoints'].items():
+        print(f"  {endpoint:<14}{row['requests']:>9}{row['errors']:>8}{row['throughput_rps']:>9}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,2,4,8')
+    parser.add_argument('--sessions', type=int, default=16, help='sessions per concurrency level')
+    parser.add_argument('--followups', type=int, default=1)
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--max-file-mb', type=float, default=5)
+    parser.add_argument('--llm-latency-ms', type=float, default=800)
+    parser.add_argument('--llm-latency-sigma', type=float, default=0.5)
+    parser.add_argument('--llm-completion-tokens', type=int, default=300)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.max_file_mb)
+    if not corpus:
+        print(f"No workbooks found in {args.corpus}")
+        sys.exit(1)
+    print(f"Corpus: {len(corpus)} workbooks from {args.corpus}")
+
+    settings = StubSettings(args.llm_latency_ms, args.llm_latency_sigma, args.llm_completion_tokens,
+                            args.llm_error_rate)
+    stub, llm_url = start_stub(settings)
+    levels = []
+    with tempfile.TemporaryDirectory(prefix='load-test-') as work_dir:
+        process, base_url = start_api_server(llm_url, work_dir)
+        try:
+            for concurrency in [int(c) for c in args.concurrency.split(',') if c.strip()]:
+                level = run_level(base_url, corpus, concurrency, args.sessions, args.followups, args.seed)
+                print_level(level)
+                levels.append(level)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            stub.shutdown()
+
+    print(f"\nLLM stub: {settings.requests} requests, {settings.errors} simulated errors")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'levels': levels}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
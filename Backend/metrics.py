@@ -0,0 +1,185 @@
+"""
+Metrics Module
+
+Per-request stage timing and process-wide Prometheus-style metrics.
+
+Stage timers are kept per thread, so code deep inside a request (prompt building,
+the LLM round trip, workbook save) can record a stage with `with metrics.stage('llm'):`
+without having the request passed in. api_server turns the recorded stages into a
+Server-Timing header and every observation also feeds the histograms served at /metrics.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'excel_api'
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROMPT_CHAR_BUCKETS = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000)
+PROMPT_TOKEN_BUCKETS = (250, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 200000)
+
+_local = threading.local()
+_lock = threading.Lock()
+
+# (name, help, type) registered on first use; values keyed by sorted label tuples
+_metadata = {}
+_counters = {}
+_histograms = {}
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1, help_text='', **labels):
+    """Increment a counter"""
+    with _lock:
+        _metadata.setdefault(name, (help_text, 'counter'))
+        key = (name, _label_key(labels))
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, help_text='', **labels):
+    """Record one observation in a histogram"""
+    with _lock:
+        _metadata.setdefault(name, (help_text, 'histogram'))
+        key = (name, _label_key(labels))
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+def record_cache(cache, hit):
+    inc('cache_requests_total', help_text='Cache lookups by cache and result',
+        cache=cache, result='hit' if hit else 'miss')
+
+
+def record_prompt_size(chars):
+    observe('prompt_size_chars', chars, buckets=PROMPT_CHAR_BUCKETS,
+            help_text='Size of prompts sent to the LLM in characters')
+
+
+def record_prompt_tokens(tokens, model):
+    observe('prompt_tokens', tokens, buckets=PROMPT_TOKEN_BUCKETS,
+            help_text='Prompt tokens reported by the LLM provider', model=model)
+
+
+def record_prompt_cache(cached_tokens, prompt_tokens, model):
+    """Split prompt tokens into those the provider served from its prompt cache and the rest"""
+    inc('prompt_tokens_total', cached_tokens, help_text='Prompt tokens by provider prompt-cache result',
+        model=model, cache='hit')
+    inc('prompt_tokens_total', max(prompt_tokens - cached_tokens, 0), help_text='Prompt tokens by provider prompt-cache result',
+        model=model, cache='miss')
+
+
+# --- Per-request stage timing ---
+
+def begin_request(endpoint):
+    _local.endpoint = endpoint
+    _local.stages = []
+    _local.started = time.perf_counter()
+
+
+def record_stage(name, seconds):
+    """Record a finished stage for the current request (no-op outside a request)"""
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        return
+    stages.append((name, seconds))
+    observe('stage_duration_seconds', seconds, help_text='Duration of request stages',
+            endpoint=_local.endpoint, stage=name)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def end_request(status):
+    """Finish the current request; returns [(stage, seconds)] including a 'total' entry"""
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        return []
+
+    total = time.perf_counter() - _local.started
+    observe('request_duration_seconds', total, help_text='Request latency by endpoint and status',
+            endpoint=_local.endpoint, status=status)
+
+    # Repeated stages (e.g. two loads) are reported once with their summed duration
+    merged = {}
+    for name, seconds in stages:
+        merged[name] = merged.get(name, 0.0) + seconds
+    _local.stages = None
+    return list(merged.items()) + [('total', total)]
+
+
+def server_timing_header(stages):
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages)
+
+
+# --- Exposition ---
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label_value(v)}"' for k, v in pairs) + '}'
+
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        for name in sorted(_metadata):
+            help_text, metric_type = _metadata[name]
+            full_name = f"{PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+
+            if metric_type == 'counter':
+                for (metric_name, label_key), value in sorted(_counters.items()):
+                    if metric_name == name:
+                        lines.append(f"{full_name}{_format_labels(label_key)} {value}")
+                continue
+
+            for (metric_name, label_key), histogram in sorted(_histograms.items(), key=lambda item: item[0]):
+                if metric_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{full_name}_bucket{_format_labels(label_key, [('le', bound)])} {cumulative}")
+                lines.append(f"{full_name}_bucket{_format_labels(label_key, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{full_name}_sum{_format_labels(label_key)} {histogram.total}")
+                lines.append(f"{full_name}_count{_format_labels(label_key)} {histogram.count}")
+
+    return '\n'.join(lines) + '\n'
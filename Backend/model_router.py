@@ -0,0 +1,220 @@
+"""
+Model Routing Module
+
+Picks the LLM model for each request instead of hardcoding one. Small prompts and
+simple questions go to the fast, cheap model; large prompts or complex questions
+escalate to stronger ones, as long as the estimated latency and cost of the stronger
+model stay within the configured targets.
+
+Every call's latency and token counts are recorded per model (ModelStats), and the
+latency estimates used for routing are corrected by what was actually observed, so
+routing follows how each model really performs here. A request can also name its
+model explicitly, which bypasses routing.
+
+Configuration (environment):
+    LLM_ROUTE_MODELS            models to route between, fastest/cheapest first
+    LLM_ESCALATE_PROMPT_TOKENS  prompts above this are "large" and escalate one level
+    LLM_LATENCY_TARGET_SECONDS  escalation stops where the estimate exceeds this (0 = no target)
+    LLM_COST_TARGET_USD         ... or where the estimated cost per request exceeds this (0 = no target)
+"""
+
+import os
+import re
+import threading
+
+import metrics
+
+# Known models: context window and USD price per million prompt/completion tokens,
+# with a prior latency model (seconds = base + per 1k prompt tokens) used until
+# calls have been observed
+MODELS = {
+    'gpt-4o-mini': {'context_tokens': 128000, 'prompt_price': 0.15, 'completion_price': 0.60,
+                    'base_seconds': 1.5, 'seconds_per_1k_prompt': 0.02},
+    'gpt-4.1-mini': {'context_tokens': 1047576, 'prompt_price': 0.40, 'completion_price': 1.60,
+                     'base_seconds': 2.0, 'seconds_per_1k_prompt': 0.03},
+    'gpt-4.1': {'context_tokens': 1047576, 'prompt_price': 2.00, 'completion_price': 8.00,
+                'base_seconds': 3.0, 'seconds_per_1k_prompt': 0.05},
+    'gemini-2.5-pro': {'context_tokens': 1048576, 'prompt_price': 1.25, 'completion_price': 10.00,
+                       'base_seconds': 8.0, 'seconds_per_1k_prompt': 0.06},
+}
+
+DEFAULT_MODEL = 'gpt-4o-mini'
+
+ROUTE_MODELS = [name.strip() for name in os.getenv('LLM_ROUTE_MODELS', 'gpt-4o-mini,gpt-4.1-mini,gpt-4.1').split(',')
+                if name.strip() in MODELS] or [DEFAULT_MODEL]
+ESCALATE_PROMPT_TOKENS = int(os.getenv('LLM_ESCALATE_PROMPT_TOKENS', '20000'))
+LATENCY_TARGET_SECONDS = float(os.getenv('LLM_LATENCY_TARGET_SECONDS', '30'))
+COST_TARGET_USD = float(os.getenv('LLM_COST_TARGET_USD', '0.10'))
+
+# Rough prompt size in tokens before the provider has counted it
+CHARS_PER_TOKEN = 4
+
+# Completion length assumed for cost estimates until a model has answered
+DEFAULT_COMPLETION_TOKENS = 600
+
+# Weight of the newest observation in the running averages
+EWMA_ALPHA = 0.2
+
+# Questions asking for reasoning over the data rather than a lookup
+COMPLEX_PATTERN = re.compile(
+    r'\b(why|explain|compare|comparison|versus|vs|trend|trends|correlat\w*|forecast\w*|predict\w*|'
+    r'anomal\w*|outlier\w*|reconcile|variance|driver\w*|impact|relationship\w*|across|between|'
+    r'recommend\w*|root cause|what if)\b',
+    re.IGNORECASE
+)
+COMPLEX_QUESTION_WORDS = 40
+
+
+def estimate_tokens(text_length):
+    """Approximate token count of a prompt with text_length characters"""
+    return text_length // CHARS_PER_TOKEN + 1
+
+
+def question_complexity(question):
+    """'complex' for questions that ask for analysis or are long, otherwise 'simple'"""
+    if COMPLEX_PATTERN.search(question) or len(question.split()) > COMPLEX_QUESTION_WORDS or question.count('?') > 1:
+        return 'complex'
+    return 'simple'
+
+
+def is_known_model(model):
+    return model in MODELS
+
+
+class ModelStats:
+    """Per-model call counts, latency and token usage; safe to update from several threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def record(self, model, seconds, prompt_tokens=0, completion_tokens=0, ok=True):
+        metrics.observe('llm_request_seconds', seconds, help_text='LLM call latency by model', model=model)
+        if not ok:
+            metrics.inc('llm_errors_total', help_text='Failed LLM calls by model', model=model)
+
+        with self._lock:
+            stats = self._models.setdefault(model, {
+                'requests': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                'total_seconds': 0.0, 'latency_ratio': 1.0, 'avg_completion_tokens': None,
+            })
+            stats['requests'] += 1
+            stats['total_seconds'] += seconds
+            if not ok:
+                stats['errors'] += 1
+                return
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+
+            # How far this model's latency is from its prior, as a running average
+            prior = prior_seconds(model, prompt_tokens)
+            stats['latency_ratio'] += EWMA_ALPHA * (seconds / prior - stats['latency_ratio'])
+            if stats['avg_completion_tokens'] is None:
+                stats['avg_completion_tokens'] = float(completion_tokens)
+            else:
+                stats['avg_completion_tokens'] += EWMA_ALPHA * (completion_tokens - stats['avg_completion_tokens'])
+
+    def get(self, model):
+        with self._lock:
+            stats = self._models.get(model)
+            return dict(stats) if stats else None
+
+    def snapshot(self):
+        with self._lock:
+            models = {model: dict(stats) for model, stats in self._models.items()}
+        for stats in models.values():
+            stats['avg_seconds'] = round(stats['total_seconds'] / stats['requests'], 3) if stats['requests'] else None
+        return models
+
+
+model_stats = ModelStats()
+
+
+def prior_seconds(model, prompt_tokens):
+    config = MODELS[model]
+    return config['base_seconds'] + config['seconds_per_1k_prompt'] * prompt_tokens / 1000
+
+
+def estimate_seconds(model, prompt_tokens):
+    """Expected latency: the prior, scaled by how this model has actually performed"""
+    stats = model_stats.get(model)
+    ratio = stats['latency_ratio'] if stats else 1.0
+    return prior_seconds(model, prompt_tokens) * ratio
+
+
+def estimate_cost(model, prompt_tokens):
+    config = MODELS[model]
+    stats = model_stats.get(model)
+    completion_tokens = DEFAULT_COMPLETION_TOKENS
+    if stats and stats['avg_completion_tokens'] is not None:
+        completion_tokens = stats['avg_completion_tokens']
+    return (prompt_tokens * config['prompt_price'] + completion_tokens * config['completion_price']) / 1e6
+
+
+def within_targets(model, prompt_tokens):
+    if LATENCY_TARGET_SECONDS and estimate_seconds(model, prompt_tokens) > LATENCY_TARGET_SECONDS:
+        return False
+    if COST_TARGET_USD and estimate_cost(model, prompt_tokens) > COST_TARGET_USD:
+        return False
+    return True
+
+
+def choose_model(prompt_tokens, question, override=None, pinned=None):
+    """
+    Pick the model for a prompt of prompt_tokens tokens answering question.
+    Returns {'model', 'reason', 'prompt_tokens', 'complexity', 'estimated_seconds', 'estimated_cost'}.
+
+    The fast model is the default; a large prompt and a complex question each escalate
+    one level. Models whose context window the prompt doesn't fit are skipped, and a
+    stronger model is only used while its estimated latency and cost meet the targets.
+    A pinned model (a conversation's, see sessions.Session.model) is kept as long as
+    the prompt fits its context window; an override always wins.
+    """
+    complexity = question_complexity(question)
+    if override:
+        model, reason = override, 'override'
+    elif pinned and MODELS[pinned]['context_tokens'] > prompt_tokens:
+        model, reason = pinned, 'session'
+    else:
+        large = prompt_tokens > ESCALATE_PROMPT_TOKENS
+        wanted = min(int(large) + int(complexity == 'complex'), len(ROUTE_MODELS) - 1)
+
+        # The smallest level whose context window fits the prompt
+        fits = next((level for level, name in enumerate(ROUTE_MODELS)
+                     if MODELS[name]['context_tokens'] > prompt_tokens), len(ROUTE_MODELS) - 1)
+        level = max(wanted, fits)
+        while level > fits and not within_targets(ROUTE_MODELS[level], prompt_tokens):
+            level -= 1
+
+        model = ROUTE_MODELS[level]
+        if level < wanted:
+            reason = 'targets'
+        elif level == fits and fits > wanted:
+            reason = 'context'
+        elif level == 0:
+            reason = 'default'
+        else:
+            reason = '+'.join(name for name, applies in (('large', large), ('complex', complexity == 'complex')) if applies)
+
+    metrics.inc('llm_route_total', help_text='Model routing decisions by model and reason', model=model, reason=reason)
+    return {
+        'model': model,
+        'reason': reason,
+        'prompt_tokens': prompt_tokens,
+        'complexity': complexity,
+        'estimated_seconds': round(estimate_seconds(model, prompt_tokens), 3),
+        'estimated_cost': round(estimate_cost(model, prompt_tokens), 6),
+    }
+
+
+def routing_config():
+    """Models, thresholds and targets in effect, with the stats gathered so far"""
+    return {
+        'default_model': DEFAULT_MODEL,
+        'route_models': ROUTE_MODELS,
+        'escalate_prompt_tokens': ESCALATE_PROMPT_TOKENS,
+        'latency_target_seconds': LATENCY_TARGET_SECONDS or None,
+        'cost_target_usd': COST_TARGET_USD or None,
+        'models': MODELS,
+        'stats': model_stats.snapshot(),
+    }
@@ -0,0 +1,190 @@
+"""
+Region Preview Module
+
+Renders the part of a sheet around some cell ranges as an HTML table, straight from
+the extracted cell data (see xl_extract), so an attributed answer can be shown in
+milliseconds without building a highlighted workbook and loading it in the viewer.
+
+Each range is shown with a margin of surrounding cells; ranges close to each other
+share one region, distant ones get their own. Merged cells keep their row/column
+spans, and the highlighted cells are outlined the way the highlighter borders them
+(a range touching a merged cell highlights the whole merged cell).
+"""
+
+import html
+
+from xl_json_helper import parse_range, column_letter
+
+# Cells shown around each range
+DEFAULT_PADDING = 2
+# Largest region rendered; a bigger range is cut off at its bottom/right
+MAX_REGION_ROWS = 60
+MAX_REGION_COLS = 20
+MAX_REGIONS = 10
+
+OUTLINE = '2px solid #d32f2f'
+PREVIEW_CSS = (
+    '.region-preview{border-collapse:collapse;font:12px Calibri,Arial,sans-serif;margin-bottom:12px}'
+    '.region-preview th,.region-preview td{border:1px solid #d9d9d9;padding:2px 6px;white-space:nowrap}'
+    '.region-preview th{background:#f3f3f3;color:#666;font-weight:normal}'
+    '.region-preview td.hl{background:#fff8e1}'
+    '.region-preview caption{text-align:left;font-weight:bold;padding:2px 0}'
+)
+
+
+def _merged_ranges(keys):
+    """Bounds (min_row, min_col, max_row, max_col) of the merged-range keys among keys"""
+    merged = {}
+    for key in keys:
+        if ':' not in key:
+            continue
+        try:
+            merged[key] = parse_range(key)[1:]
+        except ValueError:
+            continue
+    return merged
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def plan_regions(ranges, padding=DEFAULT_PADDING):
+    """
+    Group range bounds into the regions to render: each range padded by `padding`,
+    overlapping boxes joined while they fit MAX_REGION_ROWS x MAX_REGION_COLS
+    """
+    boxes = []
+    for min_row, min_col, max_row, max_col in ranges:
+        top, left = max(1, min_row - padding), max(1, min_col - padding)
+        bottom = min(max_row + padding, top + MAX_REGION_ROWS - 1)
+        right = min(max_col + padding, left + MAX_REGION_COLS - 1)
+        boxes.append((top, left, bottom, right))
+
+    regions = []
+    for box in sorted(boxes):
+        for i, region in enumerate(regions):
+            joined = (min(region[0], box[0]), min(region[1], box[1]), max(region[2], box[2]), max(region[3], box[3]))
+            if (_intersects(region, box) and joined[2] - joined[0] < MAX_REGION_ROWS
+                    and joined[3] - joined[1] < MAX_REGION_COLS):
+                regions[i] = joined
+                break
+        else:
+            regions.append(box)
+    return regions[:MAX_REGIONS]
+
+
+def highlight_boxes(ranges, merged):
+    """The ranges plus every merged cell they touch (highlighted whole, like the highlighter does)"""
+    return list(ranges) + [bounds for bounds in merged.values() if any(_intersects(bounds, box) for box in ranges)]
+
+
+def highlighted_cells(boxes, region):
+    """(row, col) of the highlighted cells in a region and the ring of cells around it"""
+    window = (region[0] - 1, region[1] - 1, region[2] + 1, region[3] + 1)
+    cells = set()
+    for box in boxes:
+        if not _intersects(box, window):
+            continue
+        for row in range(max(box[0], window[0]), min(box[2], window[2]) + 1):
+            for col in range(max(box[1], window[1]), min(box[3], window[3]) + 1):
+                cells.add((row, col))
+    return cells
+
+
+def _outline_style(box, highlighted):
+    """Inline borders drawing the outline of the highlighted area along a rendered cell's edges"""
+    top, left, bottom, right = box
+    sides = []
+    if any((top, col) in highlighted and (top - 1, col) not in highlighted for col in range(left, right + 1)):
+        sides.append(f'border-top:{OUTLINE}')
+    if any((bottom, col) in highlighted and (bottom + 1, col) not in highlighted for col in range(left, right + 1)):
+        sides.append(f'border-bottom:{OUTLINE}')
+    if any((row, left) in highlighted and (row, left - 1) not in highlighted for row in range(top, bottom + 1)):
+        sides.append(f'border-left:{OUTLINE}')
+    if any((row, right) in highlighted and (row, right + 1) not in highlighted for row in range(top, bottom + 1)):
+        sides.append(f'border-right:{OUTLINE}')
+    return ';'.join(sides)
+
+
+def render_region(sheet_name, cells, region, highlighted, merged):
+    """HTML table of one region of a sheet"""
+    top, left, bottom, right = region
+
+    # Merged cells overlapping the region, clipped to it, by their rendered top-left cell
+    spans = {}
+    covered = set()
+    for key, bounds in merged.items():
+        if not _intersects(bounds, region):
+            continue
+        clipped = (max(bounds[0], top), max(bounds[1], left), min(bounds[2], bottom), min(bounds[3], right))
+        spans[(clipped[0], clipped[1])] = (key, clipped)
+        for row in range(clipped[0], clipped[2] + 1):
+            for col in range(clipped[1], clipped[3] + 1):
+                covered.add((row, col))
+
+    range_ref = f"{column_letter(left)}{top}:{column_letter(right)}{bottom}"
+    parts = [f'<table class="region-preview" data-sheet="{html.escape(sheet_name)}" data-range="{range_ref}">',
+             f'<caption>{html.escape(sheet_name)}!{range_ref}</caption>', '<thead><tr><th></th>']
+    parts += [f'<th>{column_letter(col)}</th>' for col in range(left, right + 1)]
+    parts.append('</tr></thead><tbody>')
+
+    for row in range(top, bottom + 1):
+        parts.append(f'<tr><th>{row}</th>')
+        for col in range(left, right + 1):
+            attributes = ''
+            if (row, col) in spans:
+                key, box = spans[(row, col)]
+                rowspan, colspan = box[2] - box[0] + 1, box[3] - box[1] + 1
+                if rowspan > 1:
+                    attributes += f' rowspan="{rowspan}"'
+                if colspan > 1:
+                    attributes += f' colspan="{colspan}"'
+            elif (row, col) in covered:
+                continue
+            else:
+                key, box = f"{column_letter(col)}{row}", (row, col, row, col)
+
+            cell = cells.get(key)
+            value, formula = (cell[0], cell[1]) if cell is not None else (None, None)
+            if (row, col) in highlighted:
+                attributes += ' class="hl"'
+            style = _outline_style(box, highlighted)
+            if style:
+                attributes += f' style="{style}"'
+            if formula:
+                attributes += f' title="{html.escape(formula)}"'
+            text = html.escape(str(value)) if value is not None else ''
+            parts.append(f'<td data-cell="{key}"{attributes}>{text}</td>')
+        parts.append('</tr>')
+
+    parts.append('</tbody></table>')
+    return ''.join(parts)
+
+
+def render_preview(data, ranges_by_sheet, padding=DEFAULT_PADDING, merged_map=None):
+    """
+    Render the regions around ranges_by_sheet ({sheet: ['A1', 'B2:C4']}) of an extraction.
+    merged_map (see xl_json_helper.build_merged_map) saves scanning each sheet for merged cells.
+    Returns {'regions': [{'sheet', 'range', 'highlighted'}], 'html'}; the HTML fragment
+    starts with its own <style>, so it can be embedded as is.
+    """
+    regions, tables = [], []
+    for sheet_name, refs in ranges_by_sheet.items():
+        cells = data[sheet_name]
+        merged = _merged_ranges(set(merged_map.get(sheet_name, {}).values()) if merged_map is not None else cells)
+        bounds = [parse_range(ref)[1:] for ref in refs]
+        boxes = highlight_boxes(bounds, merged)
+
+        for region in plan_regions(bounds, padding):
+            if len(regions) >= MAX_REGIONS:
+                break
+            top, left, bottom, right = region
+            regions.append({
+                'sheet': sheet_name,
+                'range': f"{column_letter(left)}{top}:{column_letter(right)}{bottom}",
+                'highlighted': [ref for ref, ref_bounds in zip(refs, bounds) if _intersects(ref_bounds, region)],
+            })
+            tables.append(render_region(sheet_name, cells, region, highlighted_cells(boxes, region), merged))
+
+    return {'regions': regions, 'html': f'<style>{PREVIEW_CSS}</style>' + ''.join(tables)}
@@ -0,0 +1,211 @@
+"""
+Cell Search Index Module
+
+Builds a per-file search index over extracted cell data (see xl_extract) so lookups
+don't have to lowercase and scan every cell for every query.
+
+Each sheet is indexed separately, with one section per searchable field (cell value
+and formula text). A section stores every distinct lowercased text once, together with:
+  - the coordinates of the cells holding that text
+  - a token inverted index (whole-word matches)
+  - a trigram index (substring matches; candidates are verified against the text)
+"""
+
+import json
+import re
+from functools import lru_cache
+
+SEARCH_FIELDS = ('value', 'formula')
+# Position of each field in an extracted cell: [value, formula]
+FIELD_POSITIONS = {'value': 0, 'formula': 1}
+NGRAM_SIZE = 3
+INDEX_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def ngrams(text, size=NGRAM_SIZE):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def build_field_index(cells, position):
+    """Index one field of one sheet: {coordinate: [value, formula]} -> field section"""
+    text_ids = {}
+    texts = []
+    text_cells = []
+
+    for coordinate, cell_data in cells.items():
+        raw = cell_data[position] if len(cell_data) > position else None
+        if raw is None:
+            continue
+        text = str(raw).lower()
+        text_id = text_ids.get(text)
+        if text_id is None:
+            text_id = len(texts)
+            text_ids[text] = text_id
+            texts.append(text)
+            text_cells.append([])
+        text_cells[text_id].append(coordinate)
+
+    tokens = {}
+    grams = {}
+    for text_id, text in enumerate(texts):
+        for token in set(tokenize(text)):
+            tokens.setdefault(token, []).append(text_id)
+        for gram in ngrams(text):
+            grams.setdefault(gram, []).append(text_id)
+
+    return {
+        'texts': texts,
+        'cells': text_cells,
+        'tokens': tokens,
+        'grams': grams,
+    }
+
+
+def build_sheet_index(cells):
+    return {field: build_field_index(cells, FIELD_POSITIONS[field]) for field in SEARCH_FIELDS}
+
+
+def build_search_index(data):
+    """Build the search index for a whole extraction ({'schema': ..., sheet: {coord: [value, formula]}})"""
+    return {
+        'version': INDEX_VERSION,
+        'sheets': {
+            sheet_name: build_sheet_index(cells)
+            for sheet_name, cells in data.items()
+            if sheet_name != 'schema'
+        },
+    }
+
+
+def update_search_index(previous_index, data, refreshed_sheets):
+    """
+    Index a new version of an extraction, reusing previous_index's sections for every
+    sheet not listed in refreshed_sheets (see xl_extract.extract_incremental)
+    """
+    previous_sheets = previous_index['sheets'] if previous_index else {}
+    sheets = {}
+    for sheet_name, cells in data.items():
+        if sheet_name == 'schema':
+            continue
+        section = previous_sheets.get(sheet_name) if sheet_name not in refreshed_sheets else None
+        sheets[sheet_name] = section if section is not None else build_sheet_index(cells)
+    return {'version': INDEX_VERSION, 'sheets': sheets}
+
+
+def save_search_index(index, output_file):
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+
+
+def load_search_index(input_file):
+    with open(input_file, encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get('version') != INDEX_VERSION:
+        return None
+    return index
+
+
+def _matching_text_ids(section, query, match):
+    """Return the ids of distinct texts in a field section that match the query"""
+    texts = section['texts']
+
+    if match == 'token':
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return []
+        postings = [section['tokens'].get(token) for token in query_tokens]
+        if any(p is None for p in postings):
+            return []
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+        return sorted(candidates)
+
+    # Substring match
+    if len(query) < NGRAM_SIZE:
+        # Too short for trigrams; scanning distinct texts is still far cheaper than cells
+        return [text_id for text_id, text in enumerate(texts) if query in text]
+
+    postings = []
+    for gram in ngrams(query):
+        posting = section['grams'].get(gram)
+        if posting is None:
+            return []
+        postings.append(posting)
+    postings.sort(key=len)
+    candidates = set(postings[0])
+    for posting in postings[1:]:
+        candidates.intersection_update(posting)
+        if not candidates:
+            return []
+    return sorted(text_id for text_id in candidates if query in texts[text_id])
+
+
+@lru_cache(maxsize=262144)
+def cell_sort_key(coordinate):
+    # Merged keys like "B7:C7" sort by their top-left cell
+    match = re.match(r'([A-Z]+)(\d+)', coordinate)
+    if not match:
+        return (0, 0, coordinate)
+    letters, row = match.groups()
+    column = 0
+    for letter in letters:
+        column = column * 26 + (ord(letter) - 64)
+    return (int(row), column, coordinate)
+
+
+def search(index, data, query, sheets=None, fields=('value',), match='substring', page=1, page_size=50):
+    """
+    Search an indexed extraction.
+
+    sheets:   optional list of sheet names to restrict to (case-insensitive)
+    fields:   any of 'value', 'formula'
+    match:    'substring' (case-insensitive, like search_cells_by_value) or 'token' (whole words)
+    Returns {'total', 'page', 'page_size', 'results': [{worksheet, coordinate, value, formula, matched_in}]}
+    """
+    query = (query or '').lower()
+    wanted_sheets = {s.lower() for s in sheets} if sheets else None
+
+    matches = []
+    if query:
+        for sheet_name, sheet_index in index['sheets'].items():
+            if wanted_sheets is not None and sheet_name.lower() not in wanted_sheets:
+                continue
+
+            matched_in = {}
+            for field in fields:
+                section = sheet_index.get(field)
+                if section is None:
+                    continue
+                for text_id in _matching_text_ids(section, query, match):
+                    for coordinate in section['cells'][text_id]:
+                        matched_in.setdefault(coordinate, []).append(field)
+
+            for coordinate in sorted(matched_in, key=cell_sort_key):
+                matches.append((sheet_name, coordinate, matched_in[coordinate]))
+
+    start = (page - 1) * page_size
+    results = []
+    for sheet_name, coordinate, matched_fields in matches[start:start + page_size]:
+        cell_data = data.get(sheet_name, {}).get(coordinate, [None, None])
+        results.append({
+            'worksheet': sheet_name,
+            'coordinate': coordinate,
+            'value': cell_data[0],
+            'formula': cell_data[1] if len(cell_data) > 1 else None,
+            'matched_in': matched_fields,
+        })
+
+    return {
+        'total': len(matches),
+        'page': page,
+        'page_size': page_size,
+        'results': results,
+    }
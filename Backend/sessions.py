@@ -0,0 +1,151 @@
+"""
+Conversation Session Module
+
+Keeps the state of /qna conversations so follow-up questions carry their context.
+
+Every prompt in a session starts with the same per-file context (see
+llm_call.build_context_prefix) and only the tail changes: the last few turns are
+sent verbatim and older ones are folded into a short running summary, so prompts
+stay bounded however long the conversation gets. Each session also tracks how many
+of its prompt tokens the provider served from its prompt cache.
+"""
+
+import json
+import threading
+import time
+import uuid
+
+# Turns sent verbatim; older turns are summarized
+MAX_HISTORY_TURNS = 4
+# A long answer is cut to this many characters when replayed as history
+MAX_HISTORY_ANSWER_CHARS = 2000
+# Characters of answer text kept per summarized turn, and for the summary as a whole
+SUMMARY_ANSWER_CHARS = 200
+MAX_SUMMARY_CHARS = 4000
+
+
+def summarize_turn(turn):
+    """One summary line for a turn: its question and the start of its answer text"""
+    answer = turn['answer']
+    try:
+        items = json.loads(answer)
+        if isinstance(items, list):
+            answer = ' '.join(str(item.get('answer', '')) for item in items if isinstance(item, dict))
+    except (TypeError, ValueError):
+        pass
+    answer = ' '.join(answer.split())
+    if len(answer) > SUMMARY_ANSWER_CHARS:
+        answer = answer[:SUMMARY_ANSWER_CHARS].rstrip() + '...'
+    return f"Q: {' '.join(turn['question'].split())} A: {answer}"
+
+
+class Session:
+    """One conversation about one uploaded file"""
+
+    def __init__(self, file_id):
+        self.session_id = str(uuid.uuid4())
+        self.file_id = file_id
+        self.created = time.time()
+        self.last_used = self.created
+        self.turns = []
+        self.summary_lines = []
+        self.usage = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+        # Model routed to at the first turn, kept for the rest of the conversation: the
+        # provider caches prompt prefixes per model, and answers stay consistent
+        self.model = None
+        self._lock = threading.Lock()
+
+    def history(self):
+        with self._lock:
+            return list(self.turns)
+
+    def summary(self):
+        with self._lock:
+            return '\n'.join(self.summary_lines) or None
+
+    def add_turn(self, question, raw_answer, usage=None):
+        """Record an answered question, folding turns beyond MAX_HISTORY_TURNS into the summary"""
+        answer = raw_answer if isinstance(raw_answer, str) else json.dumps(raw_answer)
+        with self._lock:
+            self.last_used = time.time()
+            self.turns.append({'question': question, 'answer': answer[:MAX_HISTORY_ANSWER_CHARS]})
+            while len(self.turns) > MAX_HISTORY_TURNS:
+                self.summary_lines.append(summarize_turn(self.turns.pop(0)))
+            while len(self.summary_lines) > 1 and sum(len(line) + 1 for line in self.summary_lines) > MAX_SUMMARY_CHARS:
+                self.summary_lines.pop(0)
+
+            if usage:
+                self.usage['requests'] += 1
+                for key in ('prompt_tokens', 'cached_tokens', 'completion_tokens'):
+                    self.usage[key] += usage.get(key, 0)
+
+    def pin_model(self, model):
+        """Keep model for the following turns, unless one was pinned already"""
+        with self._lock:
+            if self.model is None:
+                self.model = model
+
+    def to_dict(self):
+        with self._lock:
+            usage = dict(self.usage)
+            turns = len(self.turns) + len(self.summary_lines)
+        usage['uncached_tokens'] = usage['prompt_tokens'] - usage['cached_tokens']
+        usage['cache_hit_ratio'] = round(usage['cached_tokens'] / usage['prompt_tokens'], 4) if usage['prompt_tokens'] else None
+        return {
+            'session_id': self.session_id,
+            'file_id': self.file_id,
+            'created': self.created,
+            'last_used': self.last_used,
+            'turns': turns,
+            'model': self.model,
+            'usage': usage,
+        }
+
+
+class SessionStore:
+    """Live sessions, expired after ttl_seconds idle and capped at max_sessions (least recently used go first)"""
+
+    def __init__(self, max_sessions=1000, ttl_seconds=3600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, file_id):
+        session = Session(file_id)
+        with self._lock:
+            self._expire()
+            while self._sessions and len(self._sessions) >= self.max_sessions:
+                oldest = min(self._sessions.values(), key=lambda s: s.last_used)
+                del self._sessions[oldest.session_id]
+            self._sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id):
+        """The live session with this id, or None if it never existed or has expired"""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.time()
+        return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def drop_file(self, file_id):
+        """End every session about a file (e.g. once the upload is gone)"""
+        with self._lock:
+            for session_id in [s.session_id for s in self._sessions.values() if s.file_id == file_id]:
+                del self._sessions[session_id]
+
+    def _expire(self):
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        for session_id in [s.session_id for s in self._sessions.values() if s.last_used < cutoff]:
+            del self._sessions[session_id]
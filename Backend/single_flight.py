@@ -0,0 +1,59 @@
+"""
+Single-flight Module
+
+Collapses concurrent duplicate calls into one. While a call for a key is running,
+further calls with the same key don't start their own: they wait for the running
+one (the leader) and get its result, or its exception. Once it finishes the key is
+free again, so nothing is cached - a later call runs afresh.
+
+Used for /qna, where a double click or a client retry sends the same question
+several times at once and each copy would otherwise be a separate, billed LLM call.
+"""
+
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """In-flight calls by key; safe to use from several threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Run fn() unless a call for key is already running, in which case wait for it.
+        Returns (result, shared): shared is True when the result came from another
+        caller's call. The leader's exception is raised in every caller that shared it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
@@ -0,0 +1,283 @@
+"""
+Table Detection Module
+
+Finds the rectangular data regions in extracted cell data (see xl_extract) and stores
+each one columnar: a header list plus one array of values per column, so prompts and
+local computations can work with whole columns instead of individual coordinates.
+
+A region is a group of non-empty cells connected to each other (including diagonally);
+a blank row or column separates two regions. Sparse leading rows (titles) are trimmed
+off, the first remaining row is taken as the header when it looks like one, and every
+column gets a type inferred from its values.
+
+Tables keep their link to the sheet: columns[j] is the column letter and row i of the
+table data is sheet row first_row + i, so table_cell() gives the coordinate of any
+value for attribution.
+"""
+
+import json
+import re
+
+from xl_json_helper import parse_range, column_letter
+
+TABLES_VERSION = 2
+
+# Smallest region reported as a table
+MIN_TABLE_ROWS = 2
+MIN_TABLE_COLS = 2
+
+# Leading rows filling less than this share of the region's width are titles, not data
+MIN_ROW_FILL = 0.5
+
+INT_PATTERN = re.compile(r'^[+-]?\d+$')
+FLOAT_PATTERN = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}( \d{2}:\d{2}:\d{2}(\.\d+)?)?$')
+TIME_PATTERN = re.compile(r'^\d{2}:\d{2}:\d{2}(\.\d+)?$')
+
+
+def parse_number(value):
+    """
+    The int or float an extracted (string) value spells, or None. Only the spelling the
+    extraction gives a number counts, so text such as codes, IDs and zip codes ('007',
+    '1.50') stays text instead of losing its leading or trailing zeros.
+    """
+    try:
+        if INT_PATTERN.match(value):
+            number = int(value)
+        elif FLOAT_PATTERN.match(value):
+            number = float(value)
+        else:
+            return None
+        return number if str(number) == value.lstrip('+') else None
+    except ValueError:
+        # More digits than int() converts
+        return None
+
+
+def value_type(value):
+    """'number', 'bool', 'date' or 'text' for an extracted (string) cell value"""
+    if parse_number(value) is not None:
+        return 'number'
+    if value in ('True', 'False'):
+        return 'bool'
+    if DATE_PATTERN.match(value) or TIME_PATTERN.match(value):
+        return 'date'
+    return 'text'
+
+
+def typed_value(value):
+    """Convert an extracted value to int/float/bool where it is one; other values stay strings"""
+    if value is None:
+        return None
+    number = parse_number(value)
+    if number is not None:
+        return number
+    if value in ('True', 'False'):
+        return value == 'True'
+    return value
+
+
+def column_type(values):
+    """Type shared by a column's non-empty values: one of value_type()'s, 'mixed' or 'empty'"""
+    kinds = {value_type(value) for value in values if value is not None}
+    if not kinds:
+        return 'empty'
+    return kinds.pop() if len(kinds) == 1 else 'mixed'
+
+
+def _find(parents, index):
+    while parents[index] != index:
+        parents[index] = parents[parents[index]]
+        index = parents[index]
+    return index
+
+
+def find_regions(cells):
+    """
+    Group a sheet's cells into connected regions; returns a list of {row: [(first_col, last_col)]}
+    giving the occupied column runs of each region. Merged ranges occupy their whole area.
+    """
+    occupied = {}
+    for key in cells:
+        try:
+            _, min_row, min_col, max_row, max_col = parse_range(key)
+        except ValueError:
+            continue
+        for row in range(min_row, max_row + 1):
+            occupied.setdefault(row, set()).update(range(min_col, max_col + 1))
+
+    # Contiguous column runs per row, joined with runs in the row above that touch them
+    runs = []
+    parents = []
+    previous_row, previous_runs = None, []
+    for row in sorted(occupied):
+        columns = sorted(occupied[row])
+        row_runs = []
+        start = columns[0]
+        for col, next_col in zip(columns, columns[1:] + [None]):
+            if next_col != col + 1:
+                row_runs.append(len(runs))
+                runs.append((row, start, col))
+                parents.append(len(parents))
+                start = next_col
+
+        if previous_row == row - 1:
+            for run_index in row_runs:
+                _, first, last = runs[run_index]
+                for above_index in previous_runs:
+                    _, above_first, above_last = runs[above_index]
+                    if above_first <= last + 1 and above_last >= first - 1:
+                        parents[_find(parents, run_index)] = _find(parents, above_index)
+        previous_row, previous_runs = row, row_runs
+
+    regions = {}
+    for run_index, (row, first, last) in enumerate(runs):
+        regions.setdefault(_find(parents, run_index), {}).setdefault(row, []).append((first, last))
+    return list(regions.values())
+
+
+def _table_bounds(region):
+    """Trim title rows off a region; returns (first_row, last_row, min_col, max_col) or None"""
+    rows = sorted(region)
+    min_col = min(first for row in rows for first, _ in region[row])
+    max_col = max(last for row in rows for _, last in region[row])
+    width = max_col - min_col + 1
+
+    while rows:
+        filled = sum(last - first + 1 for first, last in region[rows[0]])
+        if filled >= max(MIN_TABLE_COLS, width * MIN_ROW_FILL):
+            break
+        rows.pop(0)
+    if len(rows) < MIN_TABLE_ROWS:
+        return None
+
+    # Titles can be wider than the table below them
+    min_col = min(first for row in rows for first, _ in region[row])
+    max_col = max(last for row in rows for _, last in region[row])
+    if max_col - min_col + 1 < MIN_TABLE_COLS:
+        return None
+    return rows[0], rows[-1], min_col, max_col
+
+
+def _is_header(header_cells, data_columns):
+    """A header row is all distinct, formula-free text, and labels data below it"""
+    texts = [cell[0] for cell in header_cells if cell is not None]
+    if not texts or any(cell is not None and cell[1] for cell in header_cells):
+        return False
+    if any(value_type(text) != 'text' for text in texts) or len(set(texts)) != len(texts):
+        return False
+    if not any(any(value is not None for value in column) for column in data_columns):
+        return False
+    # Fully labelled, or labelling at least one column that isn't plain text
+    return len(texts) == len(header_cells) or any(
+        column_type(column) not in ('text', 'empty') for column in data_columns
+    )
+
+
+def detect_sheet_tables(sheet_name, cells):
+    """Detect the tables on one sheet; returns a list of table dicts in sheet order"""
+    # Merged ranges are keyed by their range ('B7:C7'); index them by top-left cell
+    merged_keys = {}
+    for key in cells:
+        if ':' in key:
+            merged_keys[key.split(':', 1)[0]] = key
+
+    bounds = [found for found in (_table_bounds(region) for region in find_regions(cells)) if found]
+    tables = []
+    for first_row, last_row, min_col, max_col in sorted(bounds):
+        letters = [column_letter(col) for col in range(min_col, max_col + 1)]
+        grid = []
+        for row in range(first_row, last_row + 1):
+            row_cells = []
+            for letter in letters:
+                coordinate = f"{letter}{row}"
+                row_cells.append(cells.get(coordinate) or cells.get(merged_keys.get(coordinate, '')))
+            grid.append(row_cells)
+
+        data_columns = [[row[j][0] if row[j] is not None else None for row in grid[1:]] for j in range(len(letters))]
+        header_row = first_row if _is_header(grid[0], data_columns) else None
+        data_rows = grid[1:] if header_row is not None else grid
+
+        headers = [
+            (grid[0][j][0] if grid[0][j] is not None else letter) if header_row is not None else letter
+            for j, letter in enumerate(letters)
+        ]
+        raw_columns = [[row[j][0] if row[j] is not None else None for row in data_rows] for j in range(len(letters))]
+        formula_columns = [[row[j][1] if row[j] is not None else None for row in data_rows] for j in range(len(letters))]
+
+        tables.append({
+            'id': f"{sheet_name}!T{len(tables) + 1}",
+            'sheet': sheet_name,
+            'range': f"{letters[0]}{first_row}:{letters[-1]}{last_row}",
+            'header_row': header_row,
+            'first_row': first_row + 1 if header_row is not None else first_row,
+            'row_count': len(data_rows),
+            'columns': letters,
+            'headers': headers,
+            'types': [column_type(column) for column in raw_columns],
+            'values': [[typed_value(value) for value in column] for column in raw_columns],
+            # None for columns without any formula
+            'formulas': [column if any(column) else None for column in formula_columns],
+        })
+    return tables
+
+
+def detect_tables(data, previous=None, refreshed_sheets=None):
+    """
+    Detect tables on every sheet of an extraction; returns {'version', 'sheets': {sheet: [table]}}.
+    With previous (tables of an earlier version of the workbook) only refreshed_sheets
+    are detected again.
+    """
+    previous_sheets = (previous or {}).get('sheets', {})
+    sheets = {}
+    for sheet_name, cells in data.items():
+        if sheet_name == 'schema':
+            continue
+        if previous is not None and sheet_name not in refreshed_sheets and sheet_name in previous_sheets:
+            sheets[sheet_name] = previous_sheets[sheet_name]
+        else:
+            sheets[sheet_name] = detect_sheet_tables(sheet_name, cells)
+    return {'version': TABLES_VERSION, 'sheets': sheets}
+
+
+def all_tables(tables):
+    """Flat list of the tables in a detect_tables() result"""
+    return [table for sheet_tables in tables.get('sheets', {}).values() for table in sheet_tables]
+
+
+def table_cell(table, row_index, col_index):
+    """Sheet coordinate of a table value (row_index counts data rows from 0)"""
+    return f"{table['columns'][col_index]}{table['first_row'] + row_index}"
+
+
+def cells_outside_tables(data, tables):
+    """The extraction's cells that no table covers (titles, notes, isolated values), per sheet"""
+    outside = {}
+    for sheet_name, cells in data.items():
+        if sheet_name == 'schema':
+            continue
+        boxes = [parse_range(table['range'])[1:] for table in tables.get('sheets', {}).get(sheet_name, [])]
+        remaining = {}
+        for key, cell in cells.items():
+            try:
+                _, min_row, min_col, _, _ = parse_range(key)
+            except ValueError:
+                continue
+            if not any(top <= min_row <= bottom and left <= min_col <= right for top, left, bottom, right in boxes):
+                remaining[key] = cell
+        if remaining:
+            outside[sheet_name] = remaining
+    return outside
+
+
+def save_tables(tables, output_file):
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(tables, f, ensure_ascii=False, separators=(',', ':'))
+
+
+def load_tables(input_file):
+    with open(input_file, encoding='utf-8') as f:
+        tables = json.load(f)
+    if tables.get('version') != TABLES_VERSION:
+        return None
+    return tables
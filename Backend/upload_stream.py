@@ -0,0 +1,151 @@
+"""
+Upload Streaming Module
+
+Streams uploaded workbooks straight to disk in chunks, hashing and size-checking
+them as they arrive, and validates the zip structure before any workbook parsing.
+
+The form parser writes each uploaded file part into a HashingFileStream (see
+api_server.UploadRequest), so memory stays flat regardless of upload size and the
+finished temp file can be renamed into place instead of copied.
+"""
+
+import hashlib
+import os
+import uuid
+import zipfile
+
+ZIP_MAGIC = b'PK\x03\x04'
+OLE_MAGIC = b'\xd0\xcf\x11\xe0'  # Legacy binary .xls
+
+# Parts every SpreadsheetML package must contain (part names are case-insensitive)
+REQUIRED_PARTS = ('[content_types].xml', 'xl/workbook.xml')
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidUpload(Exception):
+    pass
+
+
+class HashingFileStream:
+    """
+    File-like sink for an uploaded file part: writes to a hidden temp file in
+    `directory`, updating a SHA-256 of the content and enforcing max_bytes as
+    chunks arrive. The leading bytes are checked for a zip signature as soon as
+    they are available, so non-OOXML uploads are rejected before being stored.
+    """
+
+    def __init__(self, directory, max_bytes):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f".upload.{uuid.uuid4().hex}.tmp")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._head = b''
+        self._file = open(self.path, 'w+b')
+
+    def write(self, data):
+        # Errors raised here surface from the form parser, which drops this object,
+        # so the temp file is removed before raising
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.discard()
+            raise UploadTooLarge(f"Upload exceeds the {self.max_bytes // (1024 * 1024)} MB limit")
+
+        if len(self._head) < len(ZIP_MAGIC):
+            self._head += bytes(data[:len(ZIP_MAGIC) - len(self._head)])
+            if len(self._head) == len(ZIP_MAGIC):
+                try:
+                    check_signature(self._head)
+                except InvalidUpload:
+                    self.discard()
+                    raise
+
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def finish(self):
+        """Flush to disk and close; returns (size, sha256)"""
+        if len(self._head) < len(ZIP_MAGIC):
+            check_signature(self._head)
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        return self.size, self.hexdigest()
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def check_signature(head):
+    if head.startswith(OLE_MAGIC):
+        raise InvalidUpload('Legacy .xls workbooks are not supported. Please save the file as .xlsx')
+    if not head.startswith(ZIP_MAGIC):
+        raise InvalidUpload('File is not an Excel (.xlsx) workbook')
+
+
+def validate_ooxml_package(path, max_uncompressed_bytes, max_compression_ratio, max_entries):
+    """
+    Inspect the zip central directory (no decompression) and reject anything that is
+    not a SpreadsheetML package or that would inflate beyond the configured limits.
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            entries = archive.infolist()
+    except (zipfile.BadZipFile, OSError) as e:
+        raise InvalidUpload(f'File is not a valid Excel (.xlsx) workbook: {e}')
+
+    if len(entries) > max_entries:
+        raise InvalidUpload(f'Workbook package has too many parts ({len(entries)})')
+
+    names = {entry.filename.lower() for entry in entries}
+    missing = [part for part in REQUIRED_PARTS if part not in names]
+    if missing:
+        raise InvalidUpload(f"File is not an Excel (.xlsx) workbook (missing {', '.join(missing)})")
+
+    total_uncompressed = 0
+    for entry in entries:
+        if entry.flag_bits & 0x1:
+            raise InvalidUpload('Encrypted workbooks are not supported')
+
+        total_uncompressed += entry.file_size
+        if total_uncompressed > max_uncompressed_bytes:
+            raise InvalidUpload('Workbook expands beyond the allowed uncompressed size')
+
+        # Tiny parts legitimately compress extremely well; only judge parts of some size
+        if entry.file_size > 1024 * 1024:
+            ratio = entry.file_size / max(entry.compress_size, 1)
+            if ratio > max_compression_ratio:
+                raise InvalidUpload(f"Workbook part '{entry.filename}' has a suspicious compression ratio ({ratio:.0f}:1)")
+
+    return {'parts': len(entries), 'uncompressed_bytes': total_uncompressed}
@@ -0,0 +1,157 @@
+"""
+Synthetic Workbook Generator
+
+Builds parametric .xlsx files for benchmarking the extraction, highlighting and
+prompt-building paths against workbook size and shape.
+
+Usage: python workbook_generator.py <output.xlsx> [--rows 1000] [--cols 10] [--sheets 1]
+           [--merged-density 0.01] [--formula-ratio 0.1] [--charts 0] [--images 0]
+           [--write-only] [--seed 0]
+"""
+
+import argparse
+import io
+import random
+
+from openpyxl import Workbook
+from openpyxl.chart import BarChart, LineChart, Reference
+from openpyxl.utils import get_column_letter
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'supplier', 'invoice', 'account',
+         'north', 'south', 'east', 'west', 'widget', 'gadget', 'service', 'total']
+
+
+def _text_value(rng, row, col):
+    return f"{rng.choice(WORDS)} {rng.choice(WORDS)} {row}-{col}"
+
+
+def _number_value(rng):
+    return round(rng.uniform(-1000, 10000), 2)
+
+
+def _formula_value(rng, row, col, rows):
+    """A formula referring to numeric cells of the same sheet"""
+    source = get_column_letter(max(1, col - 1))
+    if rng.random() < 0.5 or row <= 2:
+        return f"={source}{row}*2"
+    start = max(2, row - 10)
+    return f"=SUM({source}{start}:{source}{row - 1})"
+
+
+def _png_bytes(size=16):
+    # Pillow is only needed when images are requested
+    from PIL import Image as PILImage
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (size, size), color=(0, 120, 212)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _fill_sheet(worksheet, rng, rows, cols, formula_ratio, merged_density, write_only):
+    header = [f"Column {get_column_letter(col)}" for col in range(1, cols + 1)]
+    worksheet.append(header)
+
+    merged_ranges = []
+    for row in range(2, rows + 1):
+        values = []
+        for col in range(1, cols + 1):
+            if col == 1:
+                values.append(_text_value(rng, row, col))
+            elif col > 2 and rng.random() < formula_ratio:
+                values.append(_formula_value(rng, row, col, rows))
+            else:
+                values.append(_number_value(rng))
+        worksheet.append(values)
+
+        # Merge pairs of cells in the text column, never overlapping previous merges
+        if not write_only and cols >= 2 and rng.random() < merged_density:
+            if not merged_ranges or merged_ranges[-1][1] < row:
+                merged_ranges.append((row, row + 1 if row < rows else row))
+
+    for start_row, end_row in merged_ranges:
+        worksheet.merge_cells(start_row=start_row, start_column=cols + 2,
+                              end_row=end_row, end_column=cols + 3)
+        worksheet.cell(row=start_row, column=cols + 2, value=f"Note {start_row}")
+
+    return merged_ranges
+
+
+def _add_charts(worksheet, rows, cols, count):
+    for index in range(count):
+        chart = BarChart() if index % 2 == 0 else LineChart()
+        chart.title = f"Chart {index + 1}"
+        data_col = 2 + (index % max(1, cols - 1))
+        data = Reference(worksheet, min_col=data_col, min_row=1, max_row=min(rows, 50))
+        categories = Reference(worksheet, min_col=1, min_row=2, max_row=min(rows, 50))
+        chart.add_data(data, titles_from_data=True)
+        chart.set_categories(categories)
+        worksheet.add_chart(chart, f"{get_column_letter(cols + 5)}{2 + index * 16}")
+
+
+def _add_images(worksheet, cols, count):
+    from openpyxl.drawing.image import Image
+    png = _png_bytes()
+    for index in range(count):
+        image = Image(io.BytesIO(png))
+        worksheet.add_image(image, f"{get_column_letter(cols + 14)}{2 + index * 8}")
+
+
+def generate_workbook(output_path, rows=1000, cols=10, sheets=1, merged_density=0.0,
+                      formula_ratio=0.1, charts=0, images=0, write_only=False, seed=0):
+    """
+    Write a synthetic workbook and return a summary of what it contains.
+    write_only streams rows straight to disk (for very large sheets); it skips
+    merged ranges, charts and images, which need a fully built worksheet.
+    """
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=write_only)
+    if not write_only:
+        workbook.remove(workbook.active)
+
+    summary = {'rows': rows, 'cols': cols, 'sheets': sheets, 'cells': rows * cols * sheets,
+               'merged_ranges': 0, 'charts': 0, 'images': 0}
+
+    for sheet_index in range(sheets):
+        worksheet = workbook.create_sheet(f"Sheet{sheet_index + 1}")
+        merged = _fill_sheet(worksheet, rng, rows, cols, formula_ratio, merged_density, write_only)
+        summary['merged_ranges'] += len(merged)
+
+        if write_only:
+            continue
+        if charts:
+            _add_charts(worksheet, rows, cols, charts)
+            summary['charts'] += charts
+        if images:
+            try:
+                _add_images(worksheet, cols, images)
+                summary['images'] += images
+            except ImportError:
+                print("Warning: Pillow is not installed; skipping images")
+
+    workbook.save(output_path)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--cols', type=int, default=10)
+    parser.add_argument('--sheets', type=int, default=1)
+    parser.add_argument('--merged-density', type=float, default=0.0)
+    parser.add_argument('--formula-ratio', type=float, default=0.1)
+    parser.add_argument('--charts', type=int, default=0)
+    parser.add_argument('--images', type=int, default=0)
+    parser.add_argument('--write-only', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    summary = generate_workbook(
+        args.output, rows=args.rows, cols=args.cols, sheets=args.sheets,
+        merged_density=args.merged_density, formula_ratio=args.formula_ratio,
+        charts=args.charts, images=args.images, write_only=args.write_only, seed=args.seed
+    )
+    print(f"Generated {args.output}: {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,73 +1,416 @@
 from openpyxl import load_workbook
+from openpyxl.styles.colors import COLOR_INDEX
+from openpyxl.styles.numbers import BUILTIN_FORMATS
+import colorsys
 import os
 import json
 import zipfile
+from collections.abc import Iterator
+from file_delivery import atomic_output
+from formula_eval import evaluate_missing, referenced_sheets
+from xl_json_helper import parse_range, column_letter
+from xlsx_package import scan_workbook, iter_cell_styles, read_styles, read_theme_colors, read_sheet_drawings
+
+CELL_SCHEMA = ["value", "formula", "hyperlink"]
+
+# Output is written a cell at a time; a large buffer keeps that from becoming many small writes
+WRITE_BUFFER_BYTES = 256 * 1024
+
+_encode = json.JSONEncoder(ensure_ascii=False).encode
 
 # Basic cell content extraction text, formula, result, hyperlinks, coordinates
 def extract_cell_content(file_path, output_path):
     pass
 # Style info extraction font, color, fill
-def extract_style_info():
+def extract_style_info(file_path, output_path, sheets=None, streaming=False):
     pass
 
 # Image extraction
-def extract_images():
+def extract_images(file_path, output_path, drawings=None):
 
     pass
 
 # Chart extraction
-def extract_charts():
+def extract_charts(file_path, output_path, drawings=None):
     pass
 
 ########################################################
 # FUNCTION DEFINITIONS
 ########################################################
-def extract_cell_content(file_path, output_path):
-    # Load workbooks - one for formulas and one for values
-    wb_vals = load_workbook(file_path, data_only=True)  # For cell values
-    wb_formulas = load_workbook(file_path, data_only=False)  # For formulas
-    
-    # Dictionary to store all sheet data with schema
-    all_sheets_data = {
-        "schema": ["value", "formula", "hyperlink"]
+def merged_cell_lookup(merged_ranges):
+    """Map each merged range's top-left coordinate to its range, and collect the other members"""
+    top_left = {}
+    covered = set()
+    for merged_range in merged_ranges:
+        _, min_row, min_col, max_row, max_col = parse_range(merged_range)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                covered.add(f"{column_letter(col)}{row}")
+        top_left[f"{column_letter(min_col)}{min_row}"] = f"{column_letter(min_col)}{min_row}:{column_letter(max_col)}{max_row}"
+    covered.difference_update(top_left)
+    return top_left, covered
+
+
+def iter_sheet_cells(ws_vals, ws_formulas, merged_ranges, keep_uncalculated=False):
+    """
+    Yield (key, [value, formula]) for every non-empty cell of a worksheet, in sheet order.
+    A merged range is yielded once under its range key ('B7:C7') with the top-left
+    cell's content; its other members are skipped.
+    Formula cells saved without a calculated result are skipped too, unless
+    keep_uncalculated is set: then they're yielded with a None value (see formula_eval).
+    """
+    top_left, covered = merged_cell_lookup(merged_ranges)
+
+    # Both workbooks come from the same file, so their rows line up cell for cell
+    for value_row, formula_row in zip(ws_vals.iter_rows(), ws_formulas.iter_rows()):
+        for cell, formula_cell in zip(value_row, formula_row):
+            if cell.value is not None:
+                value = str(cell.value)
+            elif keep_uncalculated and isinstance(formula_cell.value, str) and formula_cell.value.startswith('='):
+                value = None
+            else:  # Only process non-empty cells
+                continue
+            formula = str(formula_cell.value) if (formula_cell.value is not None and formula_cell.value != cell.value) else None
+
+            coordinate = cell.coordinate
+            merged_range = top_left.get(coordinate)
+            if merged_range is not None:
+                yield merged_range, [value, formula]
+            elif coordinate not in covered:
+                yield coordinate, [value, formula]
+
+
+def extract_sheet(ws_vals, ws_formulas, merged_ranges):
+    """Extract one worksheet as {coordinate: [value, formula]} (see iter_sheet_cells)"""
+    return dict(iter_sheet_cells(ws_vals, ws_formulas, merged_ranges))
+
+
+def refers_to(cells, sheet_names):
+    """Whether any formula among a sheet's cells refers to one of sheet_names"""
+    wanted = {sheet_name.lower() for sheet_name in sheet_names}
+    for _, formula in cells.values():
+        if formula and '!' in formula and any(name.lower() in wanted for name in referenced_sheets(formula)):
+            return True
+    return False
+
+
+def _collect(pairs, target):
+    """Pass (key, value) pairs through, keeping a copy in target"""
+    for key, value in pairs:
+        target[key] = value
+        yield key, value
+
+
+def _write_json_object(f, pairs, depth=1):
+    """
+    Write a JSON object from (key, value) pairs as they are produced. Values that are
+    iterators are written the same way as nested objects, so a sheet is never held in
+    memory as a whole; other values are encoded in one piece.
+    """
+    pad = '\n' + '  ' * depth
+    opening = '{' + pad
+    separator = opening
+    for key, value in pairs:
+        f.write(separator + _encode(key) + ': ')
+        if isinstance(value, Iterator):
+            _write_json_object(f, value, depth + 1)
+        else:
+            f.write(_encode(value))
+        separator = ',' + pad
+    f.write('{}' if separator is opening else '\n' + '  ' * (depth - 1) + '}')
+
+
+def write_json_stream(output_file, pairs):
+    """Stream a top-level JSON object to output_file, replacing it atomically once complete"""
+    with atomic_output(output_file) as tmp_path:
+        with open(tmp_path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_BYTES) as f:
+            _write_json_object(f, pairs)
+            f.write('\n')
+
+
+def _apply_tint(rgb, tint):
+    """Lighten (tint > 0) or darken (tint < 0) a color the way Excel applies theme tints"""
+    red, green, blue = (int(rgb[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    hue, lightness, saturation = colorsys.rgb_to_hls(red, green, blue)
+    lightness = lightness * (1 + tint) if tint < 0 else lightness * (1 - tint) + tint
+    red, green, blue = colorsys.hls_to_rgb(hue, lightness, saturation)
+    return ''.join(f"{round(channel * 255):02X}" for channel in (red, green, blue))
+
+
+def resolve_color(color, theme_colors=(), indexed_colors=None):
+    """Raw color attributes (see xlsx_package) -> 'RRGGBB', or None for automatic colors"""
+    if not color or color.get('auto') in ('1', 'true'):
+        return None
+
+    rgb = None
+    if 'rgb' in color:
+        rgb = color['rgb'][-6:]
+    elif 'theme' in color:
+        index = int(color['theme'])
+        # Theme indices 0-3 are lt1, dk1, lt2, dk2, while the scheme lists dk1, lt1, dk2, lt2
+        index = {0: 1, 1: 0, 2: 3, 3: 2}.get(index, index)
+        rgb = theme_colors[index] if index < len(theme_colors) else None
+    elif 'indexed' in color:
+        index = int(color['indexed'])
+        palette = indexed_colors or COLOR_INDEX
+        # 64/65 are the system foreground/background
+        rgb = palette[index][-6:] if index < len(palette) and palette[index] else None
+
+    if rgb and 'tint' in color:
+        rgb = _apply_tint(rgb, float(color['tint']))
+    return rgb.upper() if rgb else None
+
+
+def _style_entry(xf, styles, theme_colors):
+    """Describe one cellXfs entry by what differs from a plain cell; {} when nothing does"""
+    fonts, fills = styles['fonts'], styles['fills']
+    resolve = lambda color: resolve_color(color, theme_colors, styles['indexed_colors'])
+    entry = {}
+
+    number_format = styles['num_fmts'].get(xf['numFmtId']) or BUILTIN_FORMATS.get(xf['numFmtId'])
+    if number_format and number_format != 'General':
+        entry['number_format'] = number_format
+
+    if xf['fontId'] < len(fonts):
+        font, default_font = fonts[xf['fontId']], fonts[0]
+        font_entry = {key: True for key in ('bold', 'italic', 'strike') if font[key]}
+        if font['underline'] and font['underline'] != 'none':
+            font_entry['underline'] = font['underline']
+        color = resolve(font['color'])
+        if color and color != resolve(default_font['color']):
+            font_entry['color'] = color
+        for key in ('name', 'size'):
+            if font[key] and font[key] != default_font[key]:
+                font_entry[key] = font[key]
+        if font_entry:
+            entry['font'] = font_entry
+
+    if xf['fillId'] < len(fills):
+        fill = fills[xf['fillId']]
+        if fill['pattern'] and fill['pattern'] not in ('none', 'gray125'):
+            color = resolve(fill['fg']) or resolve(fill['bg'])
+            if color:
+                entry['fill'] = color if fill['pattern'] == 'solid' else {'pattern': fill['pattern'], 'color': color}
+
+    return entry
+
+
+def extract_style_info(file_path, output_path, sheets=None, streaming=False):
+    """
+    Extract cell styles as a deduplicated table plus per-cell style IDs.
+    IDs are the workbook's own cellXfs indices; entries that describe the same visible
+    style (e.g. differing only in borders) share the first-seen index, and styles with
+    nothing worth reporting are left out. `sheets` is a scan_workbook() result, to
+    avoid reading the sheets again. Returns {'styles': {id: style}, 'cells': {sheet: {key: id}}}.
+    In streaming mode the per-cell IDs are read straight from the sheet XML into the
+    output file and 'cells' is None.
+    """
+    if sheets is None:
+        sheets = scan_workbook(file_path, collect_styles=not streaming)
+
+    table = {}
+    aliases = {}
+    entry_ids = {}
+    style_cells = None if streaming else {}
+
+    with zipfile.ZipFile(file_path) as archive:
+        styles = read_styles(archive)
+        theme_colors = read_theme_colors(archive)
+
+        def sheet_style_ids(info):
+            top_left, covered = merged_cell_lookup(info['merged'])
+            if info.get('cell_styles') is not None:
+                cell_styles = info['cell_styles'].items()
+            else:
+                cell_styles = iter_cell_styles(archive, info['part'])
+            for coordinate, xf_index in cell_styles:
+                if coordinate in covered or xf_index >= len(styles['xfs']):
+                    continue
+                if xf_index not in aliases:
+                    entry = _style_entry(styles['xfs'][xf_index], styles, theme_colors)
+                    key = json.dumps(entry, sort_keys=True)
+                    if entry and key not in entry_ids:
+                        entry_ids[key] = str(xf_index)
+                        table[str(xf_index)] = entry
+                    aliases[xf_index] = entry_ids.get(key) if entry else None
+                style_id = aliases[xf_index]
+                if style_id is not None:
+                    yield top_left.get(coordinate, coordinate), style_id
+
+        def sheets_cells():
+            for sheet_name, info in sheets.items():
+                cells = sheet_style_ids(info)
+                if style_cells is not None:
+                    cells = _collect(cells, style_cells.setdefault(sheet_name, {}))
+                yield sheet_name, cells
+
+        def sections():
+            yield 'cells', sheets_cells()
+            # Only complete once every sheet has been written
+            yield 'styles', table
+
+        file_name = os.path.basename(file_path).split(".")[0]
+        output_file = os.path.join(output_path, f"{file_name}_styles.json")
+        write_json_stream(output_file, sections())
+
+    print(f"Style info extracted and saved to {output_file} ({len(table)} distinct styles)")
+    return {'styles': table, 'cells': style_cells}
+
+
+def _save_drawing_info(file_path, output_path, suffix, info):
+    file_name = os.path.basename(file_path).split(".")[0]
+    output_file = os.path.join(output_path, f"{file_name}_{suffix}.json")
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=2, ensure_ascii=False)
+    print(f"{suffix.capitalize()} extracted and saved to {output_file}")
+
+
+def extract_charts(file_path, output_path, drawings=None):
+    """
+    Extract chart metadata (type, title, series references, anchored range) per sheet,
+    in the charts.json layout the highlighters read:
+    {"charts": [{"sheet_name", "charts_on_sheet": [{"type", "title", "coords", "series", ...}]}]}
+    `drawings` is a read_sheet_drawings() result, to avoid reading the package again.
+    """
+    if drawings is None:
+        drawings = read_sheet_drawings(file_path)
+    charts_info = {
+        "charts": [
+            {"sheet_name": sheet_name, "charts_on_sheet": sheet_drawings['charts']}
+            for sheet_name, sheet_drawings in drawings.items() if sheet_drawings['charts']
+        ]
     }
-    
-    # Process each sheet
-    for sheet_name in wb_vals.sheetnames:
-        ws_vals = wb_vals[sheet_name]
-        ws_formulas = wb_formulas[sheet_name]
-        
-        # Use dictionary instead of nested arrays for direct cell access
-        sheet_data = {}
-        
-        # First process merged cells
-        for merged_range in ws_vals.merged_cells.ranges:
-            # Get the value from the top-left cell of the merged range
-            top_left_cell = ws_vals[merged_range.start_cell.coordinate]
-            if top_left_cell.value is not None:
-                value = str(top_left_cell.value)
-                formula = str(ws_formulas[merged_range.start_cell.coordinate].value) if (ws_formulas[merged_range.start_cell.coordinate].value is not None and ws_formulas[merged_range.start_cell.coordinate].value != top_left_cell.value) else None
-                sheet_data[merged_range.coord] = [value, formula]
-        
-        # Then process remaining non-merged cells
-        for row in ws_vals.iter_rows():
-            for cell in row:
-                # Skip if cell is part of a merged range
-                if not any(cell.coordinate in merged_range for merged_range in ws_vals.merged_cells.ranges):
-                    if cell.value is not None:  # Only process non-empty cells
-                        value = str(cell.value)
-                        formula = str(ws_formulas[cell.coordinate].value) if (ws_formulas[cell.coordinate].value is not None and ws_formulas[cell.coordinate].value != cell.value) else None
-                        sheet_data[cell.coordinate] = [value, formula]
-        
-        all_sheets_data[sheet_name] = sheet_data
-    
-    # Write to JSON file
+    _save_drawing_info(file_path, output_path, 'charts', charts_info)
+    return charts_info
+
+
+def extract_images(file_path, output_path, drawings=None):
+    """
+    Extract image metadata (file name, name/description, anchored range) per sheet,
+    in the images.json layout: {"images": [{"sheet_name", "images_on_sheet": [...]}]}
+    """
+    if drawings is None:
+        drawings = read_sheet_drawings(file_path)
+    images_info = {
+        "images": [
+            {"sheet_name": sheet_name, "images_on_sheet": sheet_drawings['images']}
+            for sheet_name, sheet_drawings in drawings.items() if sheet_drawings['images']
+        ]
+    }
+    _save_drawing_info(file_path, output_path, 'images', images_info)
+    return images_info
+
+
+def _load_read_only(file_path, data_only):
+    workbook = load_workbook(file_path, read_only=True, data_only=data_only)
+    for worksheet in workbook.worksheets:
+        # Don't trust the stored <dimension>; read every row that is actually there
+        worksheet.reset_dimensions()
+    return workbook
+
+
+def extract_incremental(file_path, output_path, previous_data=None, previous_hashes=None, streaming=False):
+    """
+    Extract a workbook, re-reading only worksheets whose content fingerprint differs
+    from previous_hashes (see xlsx_package.scan_workbook); other sheets are copied
+    from previous_data. Without a previous version every sheet is extracted.
+    Styles, charts and images are always re-read; they come from small parts or
+    from the package scan that runs anyway.
+    Formulas saved without a calculated result get their values computed from the
+    other cells (see formula_eval), which needs every sheet in memory; an unchanged
+    sheet with formulas referring to a re-read or removed sheet is therefore re-read too.
+    In streaming mode cells are written to the output file as they are read and nothing
+    else is kept ('data' and the per-cell styles are None), so memory stays flat however
+    large the sheets are; load the output file when the data is needed. Formulas aren't
+    computed then, and those without a result are left out as before.
+    Returns {'data', 'styles', 'charts', 'images', 'sheet_hashes', 'refreshed', 'reused',
+    'removed', 'formulas'}, 'formulas' being evaluate_missing()'s counts (None when streaming).
+    """
+    sheets = scan_workbook(file_path, collect_styles=not streaming)
+    sheet_hashes = {sheet_name: info['fingerprint'] for sheet_name, info in sheets.items()}
+    previous_data = previous_data or {}
+    previous_hashes = previous_hashes or {}
+
+    refreshed = [
+        sheet_name for sheet_name, fingerprint in sheet_hashes.items()
+        if previous_hashes.get(sheet_name) != fingerprint or sheet_name not in previous_data
+    ]
+    removed = [sheet_name for sheet_name in previous_hashes if sheet_name not in sheet_hashes]
+
+    # Values computed from a sheet that changed may be out of date, also through other
+    # sheets referring to the one that does
+    stale = set(refreshed) | set(removed)
+    while not streaming:
+        dependent = [sheet_name for sheet_name in sheet_hashes
+                     if sheet_name not in stale and refers_to(previous_data[sheet_name], stale)]
+        if not dependent:
+            break
+        stale.update(dependent)
+    refreshed = [sheet_name for sheet_name in sheet_hashes if sheet_name in stale]
+    reused = [sheet_name for sheet_name in sheet_hashes if sheet_name not in refreshed]
+
+    # Dictionary to store all sheet data with schema, in workbook order
+    all_sheets_data = None if streaming else {"schema": CELL_SCHEMA}
+    formulas = None
+
+    def sections(wb_vals, wb_formulas):
+        yield 'schema', CELL_SCHEMA
+        for sheet_name in sheet_hashes:
+            if sheet_name in refreshed:
+                cells = iter_sheet_cells(wb_vals[sheet_name], wb_formulas[sheet_name], sheets[sheet_name]['merged'],
+                                         keep_uncalculated=not streaming)
+            else:
+                cells = iter(previous_data[sheet_name].items())
+            yield sheet_name, cells
+
     file_name = os.path.basename(file_path).split(".")[0]
     output_file = os.path.join(output_path, f"{file_name}_cell_content.json")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(all_sheets_data, f, indent=2, ensure_ascii=False)
-    
-    print(f"Cell content extracted and saved to {output_file}")  
+
+    # Read-only workbooks parse a sheet only when it is iterated, so unchanged
+    # sheets cost nothing
+    wb_vals = _load_read_only(file_path, data_only=True) if refreshed else None  # For cell values
+    wb_formulas = _load_read_only(file_path, data_only=False) if refreshed else None  # For formulas
+    try:
+        if streaming:
+            write_json_stream(output_file, sections(wb_vals, wb_formulas))
+        else:
+            # Every sheet is read before anything is written, as a formula can refer to any of them
+            for sheet_name, cells in sections(wb_vals, wb_formulas):
+                all_sheets_data[sheet_name] = cells if sheet_name == 'schema' else dict(cells)
+            formulas = evaluate_missing(all_sheets_data)
+            write_json_stream(output_file, ((sheet_name, cells if sheet_name == 'schema' else iter(cells.items()))
+                                            for sheet_name, cells in all_sheets_data.items()))
+    finally:
+        if refreshed:
+            wb_vals.close()
+            wb_formulas.close()
+
+    print(f"Cell content extracted and saved to {output_file} (refreshed: {refreshed}, reused: {reused}, "
+          f"formulas computed: {formulas})")
+    drawings = read_sheet_drawings(file_path)
+    return {
+        'data': all_sheets_data,
+        'styles': extract_style_info(file_path, output_path, sheets, streaming),
+        'charts': extract_charts(file_path, output_path, drawings),
+        'images': extract_images(file_path, output_path, drawings),
+        'sheet_hashes': sheet_hashes,
+        'refreshed': refreshed,
+        'reused': reused,
+        'removed': removed,
+        'formulas': formulas,
+    }
+
+
+def extract_cell_content(file_path, output_path):
+    """Extract every worksheet of a workbook; returns the cell data"""
+    return extract_incremental(file_path, output_path)['data']
+
+
+def extract_cell_content_streaming(file_path, output_path):
+    """Extract every worksheet straight to disk in bounded memory; returns the output file path"""
+    extract_incremental(file_path, output_path, streaming=True)
+    file_name = os.path.basename(file_path).split(".")[0]
+    return os.path.join(output_path, f"{file_name}_cell_content.json")
 
 def main():
     # input_path = input("Enter the path to the Excel file: ")
@@ -1,21 +1,130 @@
 import json
+import re
 # Remove Flask import since we don't need it for this function
 # from flask import jsonify
 
-def get_cell_content(data, worksheet_name=None, cell_coordinate=None):
-    """Get cell content with O(1) lookup"""
+# Largest rectangle get_range will materialize
+MAX_RANGE_CELLS = 100000
+
+CELL_PATTERN = re.compile(r'^\$?([A-Za-z]{1,3})\$?([1-9]\d*)$')
+
+
+def column_index(letters):
+    """'A' -> 1, 'AA' -> 27"""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + (ord(letter) - 64)
+    return index
+
+
+def column_letter(index):
+    """1 -> 'A', 27 -> 'AA'"""
+    letters = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def parse_cell(coordinate):
+    """'$B$7' -> (row, column)"""
+    match = CELL_PATTERN.match(coordinate.strip())
+    if not match:
+        raise ValueError(f"Invalid cell coordinate: {coordinate}")
+    return int(match.group(2)), column_index(match.group(1))
+
+
+def parse_range(range_ref):
+    """
+    Split a range reference into (sheet_name or None, min_row, min_col, max_row, max_col).
+    Accepts 'A1', 'A1:D100', 'Sheet1!A1:B2' and "'My sheet'!A1".
+    """
+    sheet_name = None
+    ref = range_ref.strip()
+    if '!' in ref:
+        sheet_part, ref = ref.rsplit('!', 1)
+        sheet_name = sheet_part.strip()
+        if len(sheet_name) >= 2 and sheet_name[0] == sheet_name[-1] == "'":
+            sheet_name = sheet_name[1:-1].replace("''", "'")
+
+    start, _, end = ref.partition(':')
+    start_row, start_col = parse_cell(start)
+    end_row, end_col = parse_cell(end) if end else (start_row, start_col)
+    return (sheet_name, min(start_row, end_row), min(start_col, end_col),
+            max(start_row, end_row), max(start_col, end_col))
+
+
+def first_worksheet_name(data):
+    """Name of the first worksheet (skipping the 'schema' key) without building a list"""
+    return next((key for key in data if key != 'schema'), None)
+
+
+def build_sheet_merged_map(cells):
+    """Map every member coordinate of each merged-range key ('B7:C7') to that key"""
+    merged_map = {}
+    for key in cells:
+        if ':' not in key:
+            continue
+        try:
+            _, min_row, min_col, max_row, max_col = parse_range(key)
+        except ValueError:
+            continue
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                merged_map[f"{column_letter(col)}{row}"] = key
+    return merged_map
+
+
+def build_merged_map(data):
+    """Precompute {sheet_name: {member_coordinate: merged_key}} for a whole extraction"""
+    return {
+        sheet_name: build_sheet_merged_map(cells)
+        for sheet_name, cells in data.items()
+        if sheet_name != 'schema'
+    }
+
+
+def _resolve_sheet_name(data, worksheet_name):
+    if worksheet_name is None:
+        return first_worksheet_name(data)
+    if worksheet_name in data:
+        return worksheet_name
+    # Fall back to a case-insensitive match, like the highlighter does
+    lowered = worksheet_name.lower()
+    return next((key for key in data if key != 'schema' and key.lower() == lowered), worksheet_name)
+
+
+def _lookup(cells, coordinate, sheet_merged_map):
+    """Return (cell_data, key) for a coordinate, resolving merged-range members"""
+    cell_data = cells.get(coordinate)
+    if cell_data is not None:
+        return cell_data, coordinate
+    merged_key = sheet_merged_map.get(coordinate) if sheet_merged_map else None
+    if merged_key is not None:
+        return cells.get(merged_key), merged_key
+    return None, None
+
+
+def get_cell_content(data, worksheet_name=None, cell_coordinate=None, merged_map=None):
+    """Get cell content with O(1) lookup; members of merged ranges resolve to the merged cell"""
     try:
-        if worksheet_name is None:  # Use the first worksheet (skip 'schema' key)
-            worksheet_names = [key for key in data.keys() if key != 'schema']
-            worksheet_name = worksheet_names[0] if worksheet_names else None
-        
+        worksheet_name = _resolve_sheet_name(data, worksheet_name)
+
         if worksheet_name is None:
             print("No worksheet found")
             return None
-            
+
+        cells = data[worksheet_name]
+        coordinate = str(cell_coordinate).replace('$', '').upper()
+
         # Access cell data as array: [value, formula, hyperlink]
-        cell_data = data[worksheet_name][str(cell_coordinate)]
-        
+        cell_data = cells.get(coordinate)
+        if cell_data is None:
+            sheet_merged_map = merged_map.get(worksheet_name) if merged_map is not None else build_sheet_merged_map(cells)
+            cell_data, _ = _lookup(cells, coordinate, sheet_merged_map)
+        if cell_data is None:
+            raise KeyError(coordinate)
+
         return {
             'value': cell_data[0],      # Index 0 = value
             'formula': cell_data[1],    # Index 1 = formula
@@ -28,10 +137,82 @@ def get_cell_content(data, worksheet_name=None, cell_coordinate=None):
     except Exception as e:
         print(f"Error: {e}")
         return None
-    
+
+
+def get_range(data, range_ref, worksheet_name=None, merged_map=None):
+    """
+    Fetch a rectangular range as dense row-major 2-D arrays.
+    A sheet prefix in range_ref ('Sheet1!A1:B2') overrides worksheet_name.
+    Every member of a merged range carries the merged cell's value; 'merged' holds the
+    merged key for those positions (None elsewhere) so callers can rebuild the layout.
+    Returns {'worksheet', 'range', 'values', 'formulas', 'merged'}.
+    """
+    sheet_name, min_row, min_col, max_row, max_col = parse_range(range_ref)
+    worksheet_name = _resolve_sheet_name(data, sheet_name or worksheet_name)
+    if worksheet_name is None or worksheet_name not in data:
+        raise KeyError(f"Worksheet not found: {sheet_name or worksheet_name}")
+
+    cell_count = (max_row - min_row + 1) * (max_col - min_col + 1)
+    if cell_count > MAX_RANGE_CELLS:
+        raise ValueError(f"Range {range_ref} has {cell_count} cells; the limit is {MAX_RANGE_CELLS}")
+
+    cells = data[worksheet_name]
+    if merged_map is None:
+        merged_map = {worksheet_name: build_sheet_merged_map(cells)}
+    sheet_merged_map = merged_map.get(worksheet_name, {})
+
+    letters = [column_letter(col) for col in range(min_col, max_col + 1)]
+    values, formulas, merged = [], [], []
+    for row in range(min_row, max_row + 1):
+        value_row, formula_row, merged_row = [], [], []
+        for letter in letters:
+            cell_data, key = _lookup(cells, f"{letter}{row}", sheet_merged_map)
+            value_row.append(cell_data[0] if cell_data else None)
+            formula_row.append(cell_data[1] if cell_data and len(cell_data) > 1 else None)
+            merged_row.append(key if key is not None and ':' in key else None)
+        values.append(value_row)
+        formulas.append(formula_row)
+        merged.append(merged_row)
+
+    return {
+        'worksheet': worksheet_name,
+        'range': f"{letters[0]}{min_row}:{letters[-1]}{max_row}",
+        'values': values,
+        'formulas': formulas,
+        'merged': merged,
+    }
+
+
+def get_ranges(data, range_refs, worksheet_name=None, merged_map=None):
+    """Bulk get_range; the merged map is built once and shared across all ranges"""
+    if merged_map is None:
+        merged_map = build_merged_map(data)
+    return [get_range(data, ref, worksheet_name, merged_map) for ref in range_refs]
+
+
+def group_cells_by_style(style_info, max_cells_per_style=None):
+    """
+    Invert extract_style_info's per-cell IDs into {sheet: {style_id: [keys]}}, the compact
+    form for prompts; lists longer than max_cells_per_style end with a '+N more' marker.
+    """
+    grouped = {}
+    for sheet_name, cells in style_info.get('cells', {}).items():
+        by_style = {}
+        for key, style_id in cells.items():
+            by_style.setdefault(style_id, []).append(key)
+        if max_cells_per_style is not None:
+            for style_id, keys in by_style.items():
+                if len(keys) > max_cells_per_style:
+                    by_style[style_id] = keys[:max_cells_per_style] + [f"+{len(keys) - max_cells_per_style} more"]
+        if by_style:
+            grouped[sheet_name] = by_style
+    return grouped
+
+
 def main():
     data = json.load(open("extract-output/1bf1eda2-ca7b-4c95-8ca8-cbf3da39b5df_Family_budget_monthly_cell_content.json"))
     print(get_cell_content(data, "Monthly budget report", "C3"))
+    print(get_range(data, "B2:D4", "Monthly budget report"))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
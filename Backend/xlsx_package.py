@@ -0,0 +1,515 @@
+"""
+XLSX Package Module
+
+Reads the parts of an .xlsx zip package directly, without openpyxl: which part
+holds each worksheet, the merged ranges and cell style indices of a sheet, the raw
+style and theme tables, the charts and images anchored on each sheet, and a content
+fingerprint per sheet that changes whenever what xl_extract would read from that
+sheet changes.
+"""
+
+import hashlib
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+from xl_json_helper import column_letter
+
+WORKBOOK_PART = 'xl/workbook.xml'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+WORKSHEET_REL_TYPE = 'worksheet'
+
+FINGERPRINT_VERSION = 2
+
+# Drawing geometry: anchors without an end cell are mapped onto the grid using
+# the sheet's column widths and default row height
+EMU_PER_PIXEL = 9525
+EMU_PER_POINT = 12700
+DEFAULT_COL_WIDTH = 8.43
+DEFAULT_ROW_HEIGHT = 15
+MAX_GRID_STEPS = 16384
+
+
+def _local(tag):
+    """Tag name without its namespace"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _read_xml(archive, part):
+    try:
+        return ET.fromstring(archive.read(part))
+    except KeyError:
+        return None
+
+
+def resolve_target(source_part, target):
+    """Resolve a relationship target relative to the part that declares it"""
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+
+def rels_part_for(part):
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', f'{name}.rels')
+
+
+def read_relationships(archive, part):
+    """{relationship_id: (type_suffix, resolved_target_part)} for a part"""
+    root = _read_xml(archive, rels_part_for(part))
+    relationships = {}
+    if root is None:
+        return relationships
+    for rel in root:
+        if rel.get('TargetMode') == 'External':
+            continue
+        rel_type = rel.get('Type', '').rsplit('/', 1)[-1]
+        relationships[rel.get('Id')] = (rel_type, resolve_target(part, rel.get('Target', '')))
+    return relationships
+
+
+def worksheet_parts(archive):
+    """[(sheet_name, part)] for every worksheet in workbook order (chartsheets are skipped)"""
+    workbook = _read_xml(archive, WORKBOOK_PART)
+    if workbook is None:
+        return []
+    relationships = read_relationships(archive, WORKBOOK_PART)
+
+    parts = []
+    for element in workbook.iter():
+        if _local(element.tag) != 'sheet':
+            continue
+        rel_type, part = relationships.get(element.get(f'{REL_NS}id'), (None, None))
+        if rel_type == WORKSHEET_REL_TYPE:
+            parts.append((element.get('name'), part))
+    return parts
+
+
+def _shared_strings(archive, relationships):
+    part = _part_of_type(relationships, 'sharedStrings')
+    root = _read_xml(archive, part) if part else None
+    if root is None:
+        return []
+    return [''.join(item.itertext()) for item in root if _local(item.tag) == 'si']
+
+
+def _part_of_type(relationships, rel_type):
+    return next((target for target_type, target in relationships.values() if target_type == rel_type), None)
+
+
+def _color(element):
+    """Raw color attributes: rgb / theme / indexed / auto, with an optional tint"""
+    if element is None:
+        return None
+    color = {key: element.get(key) for key in ('rgb', 'theme', 'indexed', 'auto', 'tint') if element.get(key) is not None}
+    return color or None
+
+
+def _child(element, name):
+    return next((child for child in element if _local(child.tag) == name), None)
+
+
+def _flag(element, name):
+    """Boolean font property: present means on unless val says otherwise"""
+    child = _child(element, name)
+    return child is not None and child.get('val', '1') not in ('0', 'false')
+
+
+def read_styles(archive, relationships=None):
+    """
+    Raw style tables from xl/styles.xml: custom number formats, fonts, fills and
+    cellXfs (the indices cells refer to with s="N"), plus a custom indexed palette.
+    """
+    if relationships is None:
+        relationships = read_relationships(archive, WORKBOOK_PART)
+    styles = {'num_fmts': {}, 'fonts': [], 'fills': [], 'xfs': [], 'indexed_colors': None}
+    part = _part_of_type(relationships, 'styles')
+    root = _read_xml(archive, part) if part else None
+    if root is None:
+        return styles
+
+    for element in root:
+        name = _local(element.tag)
+        if name == 'numFmts':
+            styles['num_fmts'] = {int(fmt.get('numFmtId')): fmt.get('formatCode') for fmt in element}
+        elif name == 'fonts':
+            for font in element:
+                size = _child(font, 'sz')
+                font_name = _child(font, 'name')
+                underline = _child(font, 'u')
+                styles['fonts'].append({
+                    'name': font_name.get('val') if font_name is not None else None,
+                    'size': float(size.get('val')) if size is not None and size.get('val') else None,
+                    'bold': _flag(font, 'b'),
+                    'italic': _flag(font, 'i'),
+                    'strike': _flag(font, 'strike'),
+                    'underline': underline.get('val', 'single') if underline is not None else None,
+                    'color': _color(_child(font, 'color')),
+                })
+        elif name == 'fills':
+            for fill in element:
+                pattern = _child(fill, 'patternFill')
+                styles['fills'].append({
+                    'pattern': pattern.get('patternType') if pattern is not None else None,
+                    'fg': _color(_child(pattern, 'fgColor')) if pattern is not None else None,
+                    'bg': _color(_child(pattern, 'bgColor')) if pattern is not None else None,
+                })
+        elif name == 'cellXfs':
+            styles['xfs'] = [
+                {key: int(xf.get(key, '0')) for key in ('numFmtId', 'fontId', 'fillId')}
+                for xf in element
+            ]
+        elif name == 'colors':
+            indexed = _child(element, 'indexedColors')
+            if indexed is not None:
+                styles['indexed_colors'] = [color.get('rgb') for color in indexed]
+    return styles
+
+
+def read_theme_colors(archive, relationships=None):
+    """Theme color scheme as 'RRGGBB' strings in clrScheme order (dk1, lt1, dk2, lt2, accent1..6, ...)"""
+    if relationships is None:
+        relationships = read_relationships(archive, WORKBOOK_PART)
+    part = _part_of_type(relationships, 'theme')
+    root = _read_xml(archive, part) if part else None
+    if root is None:
+        return []
+    scheme = next((element for element in root.iter() if _local(element.tag) == 'clrScheme'), None)
+    if scheme is None:
+        return []
+
+    colors = []
+    for slot in scheme:
+        value = next((child.get('lastClr') or child.get('val') for child in slot), None)
+        colors.append(value)
+    return colors
+
+
+def _style_formats(styles):
+    """Number format (id, code) per cellXfs index; dates/times change extracted values"""
+    return [(xf['numFmtId'], styles['num_fmts'].get(xf['numFmtId'])) for xf in styles['xfs']]
+
+
+def _date1904(archive):
+    workbook = _read_xml(archive, WORKBOOK_PART)
+    if workbook is None:
+        return False
+    properties = next((element for element in workbook if _local(element.tag) == 'workbookPr'), None)
+    return properties is not None and properties.get('date1904') in ('1', 'true')
+
+
+def _child_text(element, name):
+    child = next((child for child in element if _local(child.tag) == name), None)
+    if child is None:
+        return None, None
+    return ''.join(child.itertext()), child
+
+
+def _iter_elements(f):
+    """
+    iterparse a worksheet, yielding finished elements. Completed rows are dropped
+    from <sheetData> as they go, so memory does not grow with the number of rows.
+    """
+    sheet_data = None
+    for event, element in ET.iterparse(f, events=('start', 'end')):
+        if event == 'start':
+            if sheet_data is None and _local(element.tag) == 'sheetData':
+                sheet_data = element
+            continue
+        yield element
+        if sheet_data is not None and _local(element.tag) == 'row':
+            sheet_data.clear()
+
+
+def scan_sheet(archive, part, shared_strings=(), style_formats=(), collect_styles=True):
+    """
+    Stream one worksheet part; returns {'fingerprint', 'merged', 'cell_styles'}, where
+    cell_styles maps each non-empty, non-default-styled cell to its cellXfs index
+    (None when collect_styles is False; see iter_cell_styles).
+    The fingerprint covers what extraction reads from each cell - value, type,
+    formula, the text of shared strings and the number format (dates) - plus the
+    merged ranges, rather than the raw XML, so a resave that only moves the
+    selection or reorders mergeCells keeps the sheet's fingerprint.
+    """
+    digest = hashlib.sha256()
+    merged = []
+    cell_styles = {} if collect_styles else None
+    position = 0
+    with archive.open(part) as f:
+        for element in _iter_elements(f):
+            name = _local(element.tag)
+            if name == 'c':
+                position += 1
+                cell_type = element.get('t')
+                value, _ = _child_text(element, 'v')
+                if cell_type == 's' and value is not None and value.isdigit():
+                    index = int(value)
+                    value = shared_strings[index] if index < len(shared_strings) else None
+                elif cell_type == 'inlineStr':
+                    value, _ = _child_text(element, 'is')
+
+                formula, formula_element = _child_text(element, 'f')
+                if formula_element is not None:
+                    formula = f"{formula}|{sorted(formula_element.attrib.items())}"
+
+                style = element.get('s', '0')
+                style_index = int(style) if style.isdigit() else -1
+                number_format = style_formats[style_index] if 0 <= style_index < len(style_formats) else None
+
+                coordinate = element.get('r') or f"#{position}"
+                if collect_styles and style_index > 0 and (value is not None or formula_element is not None):
+                    cell_styles[coordinate] = style_index
+                digest.update(f"{coordinate}\x00{cell_type}\x00{value}\x00{formula}\x00{number_format}\x01".encode('utf-8'))
+                element.clear()
+            elif name == 'mergeCell':
+                merged.append(element.get('ref'))
+
+    for merged_range in sorted(merged):
+        digest.update(f"m{merged_range}\x01".encode('utf-8'))
+
+    return {'fingerprint': digest.hexdigest(), 'merged': merged, 'cell_styles': cell_styles}
+
+
+def iter_cell_styles(archive, part):
+    """Yield (coordinate, cellXfs index) for each non-empty, non-default-styled cell, in sheet order"""
+    with archive.open(part) as f:
+        for element in _iter_elements(f):
+            if _local(element.tag) != 'c':
+                continue
+            style = element.get('s', '0')
+            coordinate = element.get('r')
+            if coordinate and style.isdigit() and style != '0' and len(element):
+                yield coordinate, int(style)
+            element.clear()
+
+
+def scan_workbook(file_path, collect_styles=True):
+    """
+    Fingerprint every worksheet of an .xlsx file without loading it in openpyxl.
+    Returns {sheet_name: {'part', 'fingerprint', 'merged', 'cell_styles'}} in workbook order.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        relationships = read_relationships(archive, WORKBOOK_PART)
+        shared_strings = _shared_strings(archive, relationships)
+        style_formats = _style_formats(read_styles(archive, relationships))
+        workbook_salt = f"v{FINGERPRINT_VERSION};1904={_date1904(archive)};"
+
+        sheets = {}
+        for sheet_name, part in worksheet_parts(archive):
+            info = scan_sheet(archive, part, shared_strings, style_formats, collect_styles)
+            info['fingerprint'] = hashlib.sha256((workbook_salt + info['fingerprint']).encode()).hexdigest()
+            info['part'] = part
+            sheets[sheet_name] = info
+    return sheets
+
+
+def worksheet_bytes(file_path):
+    """Total uncompressed size of an .xlsx file's worksheet parts (from the zip directory)"""
+    with zipfile.ZipFile(file_path) as archive:
+        parts = {part for _, part in worksheet_parts(archive)}
+        return sum(entry.file_size for entry in archive.infolist() if entry.filename in parts)
+
+
+# --- Charts and images ---
+
+def sheet_layout(archive, part):
+    """Column widths and default row height from a sheet's header (parsing stops at sheetData)"""
+    layout = {'widths': {}, 'default_width': DEFAULT_COL_WIDTH, 'default_height': DEFAULT_ROW_HEIGHT}
+    with archive.open(part) as f:
+        for event, element in ET.iterparse(f, events=('start', 'end')):
+            name = _local(element.tag)
+            if name == 'sheetData':
+                break
+            if event != 'end':
+                continue
+            if name == 'sheetFormatPr':
+                if element.get('defaultColWidth'):
+                    layout['default_width'] = float(element.get('defaultColWidth'))
+                if element.get('defaultRowHeight'):
+                    layout['default_height'] = float(element.get('defaultRowHeight'))
+            elif name == 'col' and element.get('width'):
+                for col in range(int(element.get('min', '1')), min(int(element.get('max', '1')), MAX_GRID_STEPS) + 1):
+                    layout['widths'][col] = float(element.get('width'))
+    return layout
+
+
+def _column_emu(layout, col_index):
+    """Width in EMU of a zero-based column, using Excel's character-width to pixel rule"""
+    width = layout['widths'].get(col_index + 1, layout['default_width'])
+    return int((256 * width + int(128 / 7)) / 256 * 7) * EMU_PER_PIXEL
+
+
+def _row_emu(layout, row_index):
+    return int(layout['default_height'] * EMU_PER_POINT)
+
+
+def _walk(index, offset, size_of):
+    """Advance from a zero-based cell index by offset EMU; returns (index, remaining offset)"""
+    for _ in range(MAX_GRID_STEPS):
+        size = size_of(index)
+        if offset < size or size <= 0:
+            break
+        offset -= size
+        index += 1
+    return index, offset
+
+
+def _marker(element):
+    return {key: int(_child(element, key).text or 0) if _child(element, key) is not None else 0
+            for key in ('col', 'colOff', 'row', 'rowOff')}
+
+
+def anchor_range(anchor, layout):
+    """Cell range ('I2:P16') a drawing anchor covers"""
+    kind = _local(anchor.tag)
+    if kind == 'twoCellAnchor':
+        start, end = _marker(_child(anchor, 'from')), _marker(_child(anchor, 'to'))
+        min_col, min_row, max_col, max_row = start['col'], start['row'], end['col'], end['row']
+    else:
+        ext = _child(anchor, 'ext')
+        width = int(ext.get('cx', 0)) if ext is not None else 0
+        height = int(ext.get('cy', 0)) if ext is not None else 0
+        if kind == 'oneCellAnchor':
+            start = _marker(_child(anchor, 'from'))
+            min_col, col_offset = start['col'], start['colOff']
+            min_row, row_offset = start['row'], start['rowOff']
+        else:  # absoluteAnchor
+            position = _child(anchor, 'pos')
+            min_col, col_offset = _walk(0, int(position.get('x', 0)), lambda i: _column_emu(layout, i))
+            min_row, row_offset = _walk(0, int(position.get('y', 0)), lambda i: _row_emu(layout, i))
+        max_col, _ = _walk(min_col, col_offset + width, lambda i: _column_emu(layout, i))
+        max_row, _ = _walk(min_row, row_offset + height, lambda i: _row_emu(layout, i))
+
+    return f"{column_letter(min_col + 1)}{min_row + 1}:{column_letter(max(max_col, min_col) + 1)}{max(max_row, min_row) + 1}"
+
+
+def _reference(element):
+    """Formula and cached text of a chart data source (tx, cat, val, ...)"""
+    if element is None:
+        return None, None
+    formula = next((child.text for child in element.iter() if _local(child.tag) == 'f'), None)
+    cached = [child.text for child in element.iter() if _local(child.tag) == 'v' and child.text is not None]
+    return formula, cached
+
+
+def _first_child(element, *names):
+    # Elements without children are falsy, so `_child(...) or _child(...)` would misfire
+    for name in names:
+        child = _child(element, name)
+        if child is not None:
+            return child
+    return None
+
+
+def _chart_title(chart):
+    title = _child(chart, 'title')
+    if title is None:
+        return None
+    text = ''.join(child.text or '' for child in title.iter() if _local(child.tag) == 't')
+    if text:
+        return text
+    formula, cached = _reference(_child(title, 'tx'))
+    return ' '.join(cached) if cached else formula
+
+
+def read_chart(archive, part):
+    """Chart type(s), title and series references of one chart part"""
+    root = _read_xml(archive, part)
+    chart = _child(root, 'chart') if root is not None else None
+    plot_area = _child(chart, 'plotArea') if chart is not None else None
+    if plot_area is None:
+        return {'type': None, 'title': None, 'series': [], 'file': part}
+
+    types = []
+    series = []
+    for group in plot_area:
+        name = _local(group.tag)
+        if not name.endswith('Chart'):
+            continue
+        chart_type = name[:-len('Chart')]
+        direction = _child(group, 'barDir')
+        if direction is not None and direction.get('val') == 'col':
+            chart_type = chart_type.replace('bar', 'column')
+        if chart_type not in types:
+            types.append(chart_type)
+
+        for ser in group:
+            if _local(ser.tag) != 'ser':
+                continue
+            title_ref, title = _reference(_child(ser, 'tx'))
+            categories_ref, _ = _reference(_first_child(ser, 'cat', 'xVal'))
+            values_ref, _ = _reference(_first_child(ser, 'val', 'yVal'))
+            series.append({
+                'title': ' '.join(title) if title else None,
+                'title_ref': title_ref,
+                'categories_ref': categories_ref,
+                'values_ref': values_ref,
+            })
+
+    return {
+        'type': '+'.join(types) if types else None,
+        'title': _chart_title(chart),
+        'series': series,
+        'file': part,
+    }
+
+
+def _drawing_name(anchor):
+    properties = next((element for element in anchor.iter() if _local(element.tag) == 'cNvPr'), None)
+    if properties is None:
+        return None, None
+    return properties.get('name'), properties.get('descr')
+
+
+def read_drawing(archive, part, layout):
+    """Charts and images of one drawing part: ([chart], [image]) with their anchored ranges"""
+    root = _read_xml(archive, part)
+    if root is None:
+        return [], []
+    relationships = read_relationships(archive, part)
+
+    charts, images = [], []
+    for anchor in root:
+        if _local(anchor.tag) not in ('twoCellAnchor', 'oneCellAnchor', 'absoluteAnchor'):
+            continue
+        coords = anchor_range(anchor, layout)
+        name, description = _drawing_name(anchor)
+
+        for element in anchor.iter():
+            element_name = _local(element.tag)
+            if element_name == 'chart' and element.get(f'{REL_NS}id'):
+                rel_type, target = relationships.get(element.get(f'{REL_NS}id'), (None, None))
+                if rel_type == 'chart':
+                    charts.append({'name': name, 'coords': coords, **read_chart(archive, target)})
+            elif element_name == 'blip' and element.get(f'{REL_NS}embed'):
+                rel_type, target = relationships.get(element.get(f'{REL_NS}embed'), (None, None))
+                if rel_type == 'image':
+                    images.append({
+                        'filename': posixpath.basename(target),
+                        'name': name,
+                        'description': description,
+                        'coords': coords,
+                        'file': target,
+                    })
+    return charts, images
+
+
+def read_sheet_drawings(file_path):
+    """
+    Charts and images anchored on each worksheet, read from the drawing and chart
+    parts without loading the workbook. Returns {sheet_name: {'charts', 'images'}}
+    in workbook order; sheets without drawings have empty lists.
+    """
+    drawings = {}
+    with zipfile.ZipFile(file_path) as archive:
+        for sheet_name, part in worksheet_parts(archive):
+            charts, images = [], []
+            drawing_parts = [target for rel_type, target in read_relationships(archive, part).values() if rel_type == 'drawing']
+            if drawing_parts:
+                layout = sheet_layout(archive, part)
+                for drawing_part in drawing_parts:
+                    drawing_charts, drawing_images = read_drawing(archive, drawing_part, layout)
+                    charts.extend(drawing_charts)
+                    images.extend(drawing_images)
+            drawings[sheet_name] = {'charts': charts, 'images': images}
+    return drawings
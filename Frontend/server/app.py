@@ -1,22 +1,27 @@
-import openpyxl
-from openpyxl.styles import PatternFill, Border, Side
-from openpyxl.utils import get_column_letter, column_index_from_string
-from openpyxl.utils.cell import range_boundaries, coordinate_from_string
-from openpyxl.cell import Cell
-from openpyxl.worksheet.views import SheetView, Selection, Pane
-from openpyxl.workbook.workbook import Workbook
+# openpyxl is imported where it is used, so the usage/argument checks and the worker
+# handshake don't pay for it; workers call warmup() once before accepting jobs.
 import sys
 import os
 import json
-import shutil
+import io
+import time
+from contextlib import redirect_stdout, redirect_stderr
+from workbook_cache import WorkbookCache
 
-def highlight_cells(input_filepath, sheet_name, cell_addresses_json, merged_cells_data_json, charts_data_json, images_data_json, output_filepath):
+def highlight_cells(input_filepath, sheet_name, cell_addresses_json, merged_cells_data_json, charts_data_json, images_data_json, output_filepath, workbook_cache=None):
     """
     Adds borders to multiple specified cells/ranges in an Excel file and saves a new copy.
     Determines merged cells, charts, and images based on the provided JSON data.
     Works with the specified sheet name (case-insensitive).
     Sets the active cell to the first highlighted cell to attempt focusing the view.
+    When a WorkbookCache is given, a warm workbook is reused and restored afterwards.
     """
+    from openpyxl.styles import Border, Side
+    from openpyxl.utils import get_column_letter
+    from openpyxl.utils.cell import range_boundaries
+    from openpyxl.worksheet.views import SheetView, Selection, Pane
+
+    workbook = None
     try:
         # Validate file extensions
         input_ext = os.path.splitext(input_filepath)[1].lower()
@@ -29,13 +34,11 @@ def highlight_cells(input_filepath, sheet_name, cell_addresses_json, merged_cell
             output_filepath = os.path.splitext(output_filepath)[0] + '.xlsx'
             print(f"Warning: Invalid output extension. Using .xlsx instead: {output_filepath}", file=sys.stderr)
 
-        # Load workbook with preservation options
-        workbook = openpyxl.load_workbook(
-            input_filepath,
-            data_only=False,  # Preserve formulas
-            keep_vba=True,    # Preserve macros
-            keep_links=True   # Preserve external links
-        )
+        # Load workbook with preservation options (or reuse a warm one in worker mode)
+        if workbook_cache is not None:
+            workbook = workbook_cache.checkout(input_filepath)
+        else:
+            workbook = load_workbook(input_filepath)
         
         # Try to get the specified sheet (case-insensitive)
         sheet_name_lower = sheet_name.lower()
@@ -56,10 +59,11 @@ def highlight_cells(input_filepath, sheet_name, cell_addresses_json, merged_cell
         # Make this sheet active in the workbook
         workbook.active = worksheet
 
-        cell_addresses_to_process = json.loads(cell_addresses_json)
-        merged_cells_data = json.loads(merged_cells_data_json)
-        charts_data = json.loads(charts_data_json)
-        images_data = json.loads(images_data_json)
+        # Worker jobs pass already-decoded JSON; command-line runs pass strings
+        cell_addresses_to_process = _decode_json_arg(cell_addresses_json)
+        merged_cells_data = _decode_json_arg(merged_cells_data_json)
+        charts_data = _decode_json_arg(charts_data_json)
+        images_data = _decode_json_arg(images_data_json)
         
         # Create border style with a nice blue color (RGB: 0, 120, 212)
         blue_side = Side(style='thick', color='0078D4')
@@ -150,7 +154,7 @@ def highlight_cells(input_filepath, sheet_name, cell_addresses_json, merged_cell
 
                 # For single cell, apply all borders
                 if min_col == max_col and min_row == max_row:
-                    cell = worksheet.cell(row=min_row, column=min_col)
+                    cell = _cell_for_update(worksheet, min_row, min_col, workbook_cache)
                     cell.border = Border(
                         left=blue_side,
                         right=blue_side,
@@ -162,7 +166,7 @@ def highlight_cells(input_filepath, sheet_name, cell_addresses_json, merged_cell
                 # For ranges, apply borders to create a complete outline
                 for row_idx in range(min_row, max_row + 1):
                     for col_idx in range(min_col, max_col + 1):
-                        current_cell = worksheet.cell(row=row_idx, column=col_idx)
+                        current_cell = _cell_for_update(worksheet, row_idx, col_idx, workbook_cache)
                         
                         # Get current cell's border
                         current_border = current_cell.border
@@ -230,10 +234,121 @@ def highlight_cells(input_filepath, sheet_name, cell_addresses_json, merged_cell
     except Exception as e:
         print(f"Error processing Excel file: {e}", file=sys.stderr)
         return 1, None
+    finally:
+        if workbook_cache is not None and workbook is not None:
+            workbook_cache.release(input_filepath)
+
+def warmup():
+    """Import openpyxl ahead of the first job"""
+    import openpyxl
+    import openpyxl.styles
+    import openpyxl.worksheet.views
+
+
+def load_workbook(input_filepath):
+    """Load a workbook with preservation options"""
+    import openpyxl
+    return openpyxl.load_workbook(
+        input_filepath,
+        data_only=False,  # Preserve formulas
+        keep_vba=True,    # Preserve macros
+        keep_links=True   # Preserve external links
+    )
+
+def _decode_json_arg(value):
+    """Accept either a JSON string or an already-decoded object"""
+    if isinstance(value, (str, bytes)):
+        return json.loads(value)
+    return value
+
+
+def _cell_for_update(worksheet, row, column, workbook_cache):
+    """Return a cell about to be re-bordered, recording its state for a warm workbook"""
+    if workbook_cache is not None:
+        workbook_cache.record_cell(worksheet, row, column)
+    return worksheet.cell(row=row, column=column)
+
+
+def _worker_job(job, workbook_cache):
+    """Run one worker job and return (return_code, captured_log)"""
+    input_file = job.get('input_filepath')
+    if not input_file or not os.path.exists(input_file):
+        return 1, f"Error: Input file not found at {input_file}\n"
+
+    captured = io.StringIO()
+    with redirect_stdout(captured), redirect_stderr(captured):
+        return_code, _ = highlight_cells(
+            input_file,
+            job.get('sheet_name', ''),
+            job.get('cell_addresses', []),
+            job.get('merged_cells_data', {}),
+            job.get('charts_data', {}),
+            job.get('images_data', {}),
+            job.get('output_filepath'),
+            workbook_cache=workbook_cache
+        )
+    if return_code != 0:
+        # A failed job (e.g. a save that broke half way) may leave the warm workbook unusable
+        workbook_cache.evict(input_file)
+    return return_code, captured.getvalue()
+
+
+def run_worker():
+    """
+    Long-lived worker mode: reads one JSON job per line on stdin and writes one
+    JSON result per line on stdout. Diagnostics go to stderr so stdout stays a
+    clean protocol channel.
+
+    Job:    {"id", "input_filepath", "sheet_name", "cell_addresses", "merged_cells_data",
+             "charts_data", "images_data", "output_filepath"}
+    Result: {"id", "return_code", "elapsed_ms", "cache_hit", "log"}
+    """
+    protocol_out = sys.stdout
+    warmup()
+    workbook_cache = WorkbookCache(load_workbook, max_entries=int(os.getenv('HIGHLIGHT_WORKBOOK_CACHE_SIZE', '8')))
+
+    protocol_out.write(json.dumps({'ready': True, 'pid': os.getpid()}) + '\n')
+    protocol_out.flush()
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            result = {'id': None, 'return_code': 1, 'log': f'Invalid job JSON: {e}'}
+        else:
+            hits_before = workbook_cache.hits
+            start = time.perf_counter()
+            try:
+                return_code, log = _worker_job(job, workbook_cache)
+            except Exception as e:
+                workbook_cache.evict(job.get('input_filepath') or '')
+                return_code, log = 1, f"Error processing job: {e}\n"
+            result = {
+                'id': job.get('id'),
+                'return_code': return_code,
+                'elapsed_ms': round((time.perf_counter() - start) * 1000, 2),
+                'cache_hit': workbook_cache.hits > hits_before,
+                'log': log,
+            }
+            sys.stderr.write(log)
+            sys.stderr.flush()
+
+        protocol_out.write(json.dumps(result) + '\n')
+        protocol_out.flush()
+
+    return 0
 
 if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == '--worker':
+        sys.exit(run_worker())
+
     if len(sys.argv) != 8:
         print("Usage: python app.py <input_filepath> <sheet_name> <cell_addresses_json> <merged_cells_data_json> <charts_data_json> <images_data_json> <output_filepath>", file=sys.stderr)
+        print("       python app.py --worker", file=sys.stderr)
         sys.exit(1)
 
     input_file = sys.argv[1]
@@ -0,0 +1,138 @@
+"""
+Highlight latency benchmark: one Python process per request vs the --worker mode.
+
+Usage: python bench_worker.py [--script app.py] [--workbook file.xlsx] [--sheet Sheet1]
+                              [--requests 20] [--rows 2000]
+
+Without --workbook a synthetic workbook with --rows rows is generated in a temp dir.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def generate_workbook(path, rows):
+    import openpyxl
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'Sheet1'
+    worksheet.append(['Item', 'Quantity', 'Price', 'Total'])
+    for row in range(2, rows + 2):
+        worksheet.append([f'Item {row}', row % 17, (row % 29) * 1.25, f'=B{row}*C{row}'])
+    worksheet.merge_cells('F2:G3')
+    workbook.save(path)
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    p95_index = max(0, int(round(0.95 * len(ordered))) - 1)
+    return {
+        'mean_ms': round(statistics.mean(ordered), 2),
+        'p50_ms': round(statistics.median(ordered), 2),
+        'p95_ms': round(ordered[p95_index], 2),
+        'min_ms': round(ordered[0], 2),
+        'max_ms': round(ordered[-1], 2),
+    }
+
+
+def job_for(index, workbook_path, sheet_name, out_dir):
+    return {
+        'id': index,
+        'input_filepath': workbook_path,
+        'sheet_name': sheet_name,
+        'cell_addresses': [f'B{index + 2}', f'C{index + 2}:D{index + 4}'],
+        'merged_cells_data': {},
+        'charts_data': {},
+        'images_data': {},
+        'output_filepath': os.path.join(out_dir, f'bench_{index}.xlsx'),
+    }
+
+
+def bench_spawn(script, jobs):
+    samples = []
+    for job in jobs:
+        args = [
+            sys.executable, script,
+            job['input_filepath'],
+            job['sheet_name'],
+            json.dumps(job['cell_addresses']),
+            json.dumps(job['merged_cells_data']),
+            json.dumps(job['charts_data']),
+            json.dumps(job['images_data']),
+            job['output_filepath'],
+        ]
+        start = time.perf_counter()
+        completed = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - start) * 1000)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Spawned highlight failed for job {job['id']}")
+    return samples
+
+
+def bench_worker(script, jobs):
+    start = time.perf_counter()
+    worker = subprocess.Popen([sys.executable, script, '--worker'],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True)
+    json.loads(worker.stdout.readline())
+    startup_ms = (time.perf_counter() - start) * 1000
+
+    samples = []
+    cache_hits = 0
+    try:
+        for job in jobs:
+            start = time.perf_counter()
+            worker.stdin.write(json.dumps(job) + '\n')
+            worker.stdin.flush()
+            result = json.loads(worker.stdout.readline())
+            samples.append((time.perf_counter() - start) * 1000)
+            if result['return_code'] != 0:
+                raise RuntimeError(f"Worker highlight failed for job {job['id']}: {result.get('log')}")
+            cache_hits += 1 if result.get('cache_hit') else 0
+    finally:
+        worker.stdin.close()
+        worker.wait()
+    return samples, startup_ms, cache_hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--script', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'))
+    parser.add_argument('--workbook')
+    parser.add_argument('--sheet', default='Sheet1')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        workbook_path = args.workbook
+        if workbook_path is None:
+            workbook_path = os.path.join(out_dir, 'bench_input.xlsx')
+            generate_workbook(workbook_path, args.rows)
+
+        jobs = [job_for(i, workbook_path, args.sheet, out_dir) for i in range(args.requests)]
+
+        spawn_samples = bench_spawn(args.script, jobs)
+        worker_samples, startup_ms, cache_hits = bench_worker(args.script, jobs)
+
+    report = {
+        'script': args.script,
+        'workbook': args.workbook or f'synthetic ({args.rows} rows)',
+        'requests': args.requests,
+        'spawn': summarize(spawn_samples),
+        'worker': summarize(worker_samples),
+        'worker_startup_ms': round(startup_ms, 2),
+        'worker_cache_hits': cache_hits,
+        'speedup_p50': round(statistics.median(spawn_samples) / statistics.median(worker_samples), 2),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
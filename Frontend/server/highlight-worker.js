@@ -0,0 +1,184 @@
+const { spawn } = require("child_process");
+const readline = require("readline");
+
+// Client for the long-lived `python3 app.py --worker` process.
+// Jobs are written as one JSON object per line on the worker's stdin and
+// results come back one JSON object per line on its stdout, matched by id.
+// The worker runs one job at a time, so jobs wait here and are sent one by one;
+// a job's timeout only runs while the worker is working on it.
+class HighlightWorker {
+  constructor(scriptPath, options = {}) {
+    this.scriptPath = scriptPath;
+    this.pythonCommand = options.pythonCommand || "python3";
+    this.jobTimeoutMs = options.jobTimeoutMs || 60000;
+    this.process = null;
+    this.ready = null;
+    this.isReady = false;
+    this.queue = [];
+    this.current = null;
+    this.nextId = 1;
+  }
+
+  // Jobs queued or running on this worker
+  get load() {
+    return this.queue.length + (this.current ? 1 : 0);
+  }
+
+  start() {
+    if (this.ready) {
+      return this.ready;
+    }
+
+    const child = spawn(this.pythonCommand, [this.scriptPath, "--worker"], {
+      stdio: ["pipe", "pipe", "pipe"],
+    });
+    this.process = child;
+
+    this.ready = new Promise((resolve, reject) => {
+      const lines = readline.createInterface({ input: child.stdout });
+      lines.on("line", (line) => {
+        let message;
+        try {
+          message = JSON.parse(line);
+        } catch (e) {
+          console.error("Highlight worker sent invalid JSON:", line);
+          return;
+        }
+
+        if (message.ready) {
+          console.log(`Highlight worker ready (pid ${message.pid})`);
+          this.isReady = true;
+          resolve();
+          this._next();
+          return;
+        }
+
+        const job = this.current;
+        if (!job || job.id !== message.id) {
+          return;
+        }
+        this.current = null;
+        clearTimeout(job.timer);
+        job.resolve(message);
+        this._next();
+      });
+
+      child.stderr.on("data", (data) => {
+        console.error("Highlight worker stderr:", data.toString());
+      });
+
+      child.on("error", (err) => {
+        console.error("Failed to start highlight worker:", err);
+        reject(err);
+        this._reset(child, err);
+      });
+
+      child.on("exit", (code, signal) => {
+        const err = new Error(`Highlight worker exited with ${signal || `code ${code}`}`);
+        console.error(err.message);
+        reject(err);
+        this._reset(child, err);
+      });
+    });
+    // Failures reach the jobs through _reset
+    this.ready.catch(() => {});
+
+    return this.ready;
+  }
+
+  run(job) {
+    return new Promise((resolve, reject) => {
+      this.queue.push({ job, resolve, reject });
+      this.start();
+      this._next();
+    });
+  }
+
+  stop() {
+    if (this.process) {
+      this.process.stdin.end();
+    }
+  }
+
+  // Send the next queued job once the worker is ready and idle
+  _next() {
+    if (!this.isReady || this.current || this.queue.length === 0) {
+      return;
+    }
+
+    const job = this.queue.shift();
+    job.id = this.nextId++;
+    job.timer = setTimeout(() => {
+      // A hung job would hold up every job behind it: kill the worker (the exit
+      // handler fails this job) and let a fresh one take the rest
+      job.error = new Error(`Highlight job ${job.id} timed out after ${this.jobTimeoutMs} ms`);
+      console.error(`${job.error.message}; restarting the highlight worker`);
+      this.process.kill();
+    }, this.jobTimeoutMs);
+    this.current = job;
+    this.process.stdin.write(JSON.stringify({ ...job.job, id: job.id }) + "\n");
+  }
+
+  // The worker is gone: fail the job it was running and start a fresh one for the
+  // queued jobs, unless it never got ready (then they'd fail the same way)
+  _reset(child, err) {
+    if (child !== this.process) {
+      return;
+    }
+    const wasReady = this.isReady;
+    if (this.current) {
+      clearTimeout(this.current.timer);
+      this.current.reject(this.current.error || err);
+      this.current = null;
+    }
+    this.process = null;
+    this.ready = null;
+    this.isReady = false;
+
+    if (!wasReady) {
+      for (const job of this.queue) {
+        job.reject(err);
+      }
+      this.queue = [];
+    } else if (this.queue.length > 0) {
+      this.start();
+    }
+  }
+}
+
+// A few workers, so highlights of different workbooks run in parallel as they did
+// with a process per request. A job goes to the least busy worker, preferring the
+// one that last highlighted the same workbook (its workbook cache is warm).
+class HighlightWorkerPool {
+  constructor(scriptPath, options = {}) {
+    const size = Math.max(1, options.size || 1);
+    this.workers = Array.from({ length: size }, () => new HighlightWorker(scriptPath, options));
+    this.lastWorker = new Map();
+    this.maxRemembered = 1000;
+  }
+
+  start() {
+    return Promise.all(this.workers.map((worker) => worker.start()));
+  }
+
+  run(job) {
+    const leastBusy = this.workers.reduce((best, worker) => (worker.load < best.load ? worker : best));
+    const warm = this.lastWorker.get(job.input_filepath);
+    const worker = warm && warm.load <= leastBusy.load ? warm : leastBusy;
+
+    this.lastWorker.delete(job.input_filepath);
+    this.lastWorker.set(job.input_filepath, worker);
+    if (this.lastWorker.size > this.maxRemembered) {
+      this.lastWorker.delete(this.lastWorker.keys().next().value);
+    }
+    return worker.run(job);
+  }
+
+  stop() {
+    for (const worker of this.workers) {
+      worker.stop();
+    }
+  }
+}
+
+module.exports = { HighlightWorker, HighlightWorkerPool };
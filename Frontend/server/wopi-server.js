@@ -5,6 +5,7 @@ const axios = require("axios");
 const cors = require("cors");
 const { spawn } = require("child_process");
 const multer = require('multer');
+const { HighlightWorkerPool } = require("./highlight-worker");
 
 const app = express();
 const port = 3001;
@@ -24,6 +25,14 @@ const storage = multer.diskStorage({
 
 const upload = multer({ storage: storage });
 
+// Highlight jobs go to a few long-lived Python workers (HIGHLIGHT_WORKERS, default 2)
+// instead of a process per request.
+// Set HIGHLIGHT_WORKER=0 to fall back to spawning app.py for every request.
+const USE_HIGHLIGHT_WORKER = process.env.HIGHLIGHT_WORKER !== "0";
+const highlightWorker = new HighlightWorkerPool(path.join(__dirname, 'app.py'), {
+  size: parseInt(process.env.HIGHLIGHT_WORKERS || "2", 10),
+});
+
 app.use(express.json());
 app.use(cors());
 app.use('/public', express.static(path.join(__dirname, 'public')));
@@ -72,6 +81,36 @@ try {
   console.error('Error loading charts/images JSON files:', e);
 }
 
+// Decoded once so worker jobs don't re-parse them per request
+let chartsData = {};
+let imagesData = {};
+try {
+  chartsData = JSON.parse(chartsDataJson);
+  imagesData = JSON.parse(imagesDataJson);
+} catch (e) {
+  console.error('Error parsing charts/images JSON data:', e);
+}
+
+// Per-file chart/image metadata published by the Backend next to a highlighted
+// workbook (<name>.charts.json / <name>.images.json); falls back to the global files
+function loadDrawingData(fileNameWithoutExt) {
+  const drawingData = { chartsData, imagesData, chartsDataJson, imagesDataJson };
+  for (const kind of ['charts', 'images']) {
+    const sidecarPath = path.join(__dirname, 'public', `${fileNameWithoutExt}.${kind}.json`);
+    if (!fs.existsSync(sidecarPath)) {
+      continue;
+    }
+    try {
+      const json = fs.readFileSync(sidecarPath, 'utf8');
+      drawingData[`${kind}Data`] = JSON.parse(json);
+      drawingData[`${kind}DataJson`] = json;
+    } catch (e) {
+      console.error(`Error loading ${sidecarPath}, using global ${kind}.json:`, e);
+    }
+  }
+  return drawingData;
+}
+
 async function getNgrokUrl() {
   try {
     const res = await axios.get("http://127.0.0.1:4040/api/tunnels");
@@ -141,6 +180,41 @@ function cleanupPreviousHighlights(originalFileNameWithoutExt) {
   });
 }
 
+// Run app.py once for a single highlight (used when the worker is disabled)
+function spawnHighlightScript(pythonScriptPath, args) {
+  const pythonProcess = spawn('python3', [pythonScriptPath, ...args]);
+
+  let pythonOutput = '';
+  let pythonError = '';
+
+  pythonProcess.stdout.on('data', (data) => {
+    pythonOutput += data.toString();
+    console.log('Python stdout:', data.toString());
+  });
+
+  pythonProcess.stderr.on('data', (data) => {
+    pythonError += data.toString();
+    console.error('Python stderr:', data.toString());
+  });
+
+  return new Promise((resolve, reject) => {
+    pythonProcess.on('close', (code) => {
+      if (code === 0) {
+        resolve();
+      } else {
+        const errorMessage = `Python script exited with code ${code}.\nError:\n${pythonError}\nOutput:\n${pythonOutput}`;
+        console.error(errorMessage);
+        reject(new Error(errorMessage));
+      }
+    });
+
+    pythonProcess.on('error', (err) => {
+      console.error('Failed to start Python child process:', err);
+      reject(err);
+    });
+  });
+}
+
 app.post("/highlight-cells", async (req, res) => {
   const { fileName, sheetName, cellRanges } = req.body;
 
@@ -177,60 +251,47 @@ app.post("/highlight-cells", async (req, res) => {
     return res.status(500).send("Python script (app.py) not found on server.");
   }
 
+  const drawingData = loadDrawingData(originalFileNameWithoutExt);
+
   try {
     const cellRangesArray = cellRanges.split(',').map(s => s.trim()).filter(s => s.length > 0);
     const cellAddressesJson = JSON.stringify(cellRangesArray);
 
-    console.log(`Spawning Python script with:`);
+    console.log(`Running highlight job with:`);
     console.log(`  Input File: ${originalFilePath}`);
     console.log(`  Sheet Name: ${sheetName}`);
     console.log(`  Cell Ranges: ${cellAddressesJson}`);
     console.log(`  Merged Cells Data: (first 100 chars) ${dummyMergedCellsDataJson.substring(0, 100)}...`);
-    console.log(`  Charts Data: (first 100 chars) ${chartsDataJson.substring(0, 100)}...`);
-    console.log(`  Images Data: (first 100 chars) ${imagesDataJson.substring(0, 100)}...`);
+    console.log(`  Charts Data: (first 100 chars) ${drawingData.chartsDataJson.substring(0, 100)}...`);
+    console.log(`  Images Data: (first 100 chars) ${drawingData.imagesDataJson.substring(0, 100)}...`);
     console.log(`  Output File: ${highlightedFilePath}`);
 
-    const pythonProcess = spawn('python3', [
-      pythonScriptPath,
-      originalFilePath,
-      sheetName,
-      cellAddressesJson,
-      dummyMergedCellsDataJson,
-      chartsDataJson,
-      imagesDataJson,
-      highlightedFilePath
-    ]);
-
-    let pythonOutput = '';
-    let pythonError = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      pythonOutput += data.toString();
-      console.log('Python stdout:', data.toString());
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      pythonError += data.toString();
-      console.error('Python stderr:', data.toString());
-    });
-
-    await new Promise((resolve, reject) => {
-      pythonProcess.on('close', (code) => {
-        if (code === 0) {
-          console.log(`Python script exited successfully. Output file: ${highlightedFileName}`);
-          resolve();
-        } else {
-          const errorMessage = `Python script exited with code ${code}.\nError:\n${pythonError}\nOutput:\n${pythonOutput}`;
-          console.error(errorMessage);
-          reject(new Error(errorMessage));
-        }
+    if (USE_HIGHLIGHT_WORKER) {
+      const result = await highlightWorker.run({
+        input_filepath: originalFilePath,
+        sheet_name: sheetName,
+        cell_addresses: cellRangesArray,
+        merged_cells_data: dummyMergedCellsData,
+        charts_data: drawingData.chartsData,
+        images_data: drawingData.imagesData,
+        output_filepath: highlightedFilePath
       });
-
-      pythonProcess.on('error', (err) => {
-        console.error('Failed to start Python child process:', err);
-        reject(err);
-      });
-    });
+      if (result.return_code !== 0) {
+        throw new Error(`Highlight worker job failed.\nOutput:\n${result.log}`);
+      }
+      console.log(`Highlight worker finished in ${result.elapsed_ms} ms (cache hit: ${result.cache_hit}). Output file: ${highlightedFileName}`);
+    } else {
+      await spawnHighlightScript(pythonScriptPath, [
+        originalFilePath,
+        sheetName,
+        cellAddressesJson,
+        dummyMergedCellsDataJson,
+        drawingData.chartsDataJson,
+        drawingData.imagesDataJson,
+        highlightedFilePath
+      ]);
+      console.log(`Python script exited successfully. Output file: ${highlightedFileName}`);
+    }
 
     res.json({ highlightedFileName: highlightedFileName });
 
@@ -291,4 +352,9 @@ app.post("/get-file-id", async (req, res) => {
 
 app.listen(port, () => {
   console.log(`WOPI server running on port ${port}`);
+  if (USE_HIGHLIGHT_WORKER) {
+    highlightWorker.start().catch((err) => {
+      console.error('Highlight worker failed to start; it will be retried on the next request:', err.message);
+    });
+  }
 }); 
\ No newline at end of file
@@ -0,0 +1,100 @@
+# Warm workbook cache for the highlight worker (app.py --worker), shared with
+# ../wopi-viewer/app.py. Like app.py, it doesn't import openpyxl itself.
+import sys
+import os
+import copy
+from collections import OrderedDict
+
+
+def has_drawings(workbook):
+    """
+    Whether any worksheet holds images or charts. openpyxl reads an image's data
+    from its source file object once, when saving, and closes it, so such a
+    workbook can only be saved once after loading.
+    """
+    return any(ws._images or ws._charts for ws in workbook.worksheets)
+
+
+class WorkbookCache:
+    """
+    Keeps recently used workbooks loaded between worker jobs.
+    A checked-out workbook is modified in place by highlight_cells; every cell
+    border, sheet view and the active sheet touched by the job is recorded and
+    put back on release, so the next job starts from the pristine file state.
+    Workbooks with images or charts are loaded fresh for every job (see has_drawings).
+    """
+
+    def __init__(self, loader, max_entries=8):
+        self.max_entries = max_entries
+        self.loader = loader
+        self._entries = OrderedDict()  # path -> (signature, workbook)
+        self._undo = None
+        self.hits = 0
+        self.misses = 0
+
+    def checkout(self, input_filepath):
+        key = os.path.abspath(input_filepath)
+        stat = os.stat(key)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == signature:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            workbook = entry[1]
+        else:
+            self.misses += 1
+            self._entries.pop(key, None)
+            workbook = self.loader(key)
+            if has_drawings(workbook):
+                # Not kept, so nothing to restore on release
+                self._undo = None
+                return workbook
+            self._entries[key] = (signature, workbook)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        self._undo = {
+            'active': workbook.active.title if workbook.active is not None else None,
+            'views': {ws.title: copy.deepcopy(ws.views) for ws in workbook.worksheets},
+            'cells': {},
+        }
+        return workbook
+
+    def record_cell(self, worksheet, row, column):
+        key = (worksheet.title, row, column)
+        if self._undo is None or key in self._undo['cells']:
+            return
+        existing = worksheet._cells.get((row, column))
+        # None marks a cell that only exists because we created it
+        self._undo['cells'][key] = copy.copy(existing.border) if existing is not None else None
+
+    def release(self, input_filepath):
+        key = os.path.abspath(input_filepath)
+        entry = self._entries.get(key)
+        undo, self._undo = self._undo, None
+        if entry is None or undo is None:
+            return
+
+        workbook = entry[1]
+        try:
+            for (sheet_title, row, column), border in undo['cells'].items():
+                worksheet = workbook[sheet_title]
+                if border is None:
+                    worksheet._cells.pop((row, column), None)
+                else:
+                    worksheet.cell(row=row, column=column).border = border
+            for ws in workbook.worksheets:
+                if ws.title in undo['views']:
+                    ws.views = undo['views'][ws.title]
+            if undo['active'] is not None:
+                workbook.active = workbook[undo['active']]
+        except Exception as e:
+            # Never serve a half-restored workbook; reload it on the next job
+            print(f"Warning: Could not restore cached workbook {key}, evicting: {e}", file=sys.stderr)
+            self._entries.pop(key, None)
+
+    def evict(self, input_filepath):
+        """Drop a workbook, e.g. after a failed job left it in an unknown state"""
+        self._undo = None
+        self._entries.pop(os.path.abspath(input_filepath), None)
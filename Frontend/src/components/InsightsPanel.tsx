@@ -240,6 +240,8 @@ export const InsightsPanel = () => {
     setFileId,
   } = useSpreadsheet();
   const [attributions, setAttributions] = useState<ResponseData[]>([]);
+  // Backend conversation for the current file, so follow-up questions keep context
+  const sessionRef = useRef<{ fileId: string; sessionId: string } | null>(null);
 
   // Function to get mock response based on query
   const getMockResponse = (query: string) => {
@@ -458,20 +460,34 @@ export const InsightsPanel = () => {
 
         console.log("Sending question to backend:", messageToSend);
         console.log("File ID:", fileId);
-        const requestBody = {
-          file_id: fileId,
-          question: messageToSend,
+        const sendQuestion = (sessionId?: string) => {
+          const requestBody = {
+            file_id: fileId,
+            question: messageToSend,
+            ...(sessionId ? { session_id: sessionId } : {}),
+          };
+          console.log("Request payload:", requestBody);
+          return fetch(`${config.apiUrl}/qna`, {
+            method: "POST",
+            headers: {
+              "Content-Type": "application/json",
+              Accept: "application/json",
+              "Access-Control-Allow-Origin": "*",
+            },
+            body: JSON.stringify(requestBody),
+          });
         };
-        console.log("Request payload:", requestBody);
-        const response = await fetch(`${config.apiUrl}/qna`, {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-            Accept: "application/json",
-            "Access-Control-Allow-Origin": "*",
-          },
-          body: JSON.stringify(requestBody),
-        });
+
+        const sessionId =
+          sessionRef.current?.fileId === fileId
+            ? sessionRef.current.sessionId
+            : undefined;
+        let response = await sendQuestion(sessionId);
+        if (sessionId && response.status === 404) {
+          // The conversation expired on the server; start a new one
+          sessionRef.current = null;
+          response = await sendQuestion();
+        }
 
         console.log("Response status:", response.status);
         console.log(
@@ -486,6 +502,9 @@ export const InsightsPanel = () => {
 
         const result = await response.json();
         console.log("Response data:", result);
+        if (result.session_id) {
+          sessionRef.current = { fileId, sessionId: result.session_id };
+        }
 
         // Store attributions for later use
         const attributions: ResponseData[] = [];